@@ -1,6 +1,15 @@
 from django.contrib import admin
 
-from .models import Ad, ExchangeProposal
+from .models import (
+    Ad,
+    AdFacet,
+    AdProposalCounter,
+    ArchivedExchangeProposal,
+    Category,
+    ExchangeProposal,
+    IdempotencyKey,
+    UserProposalCounter,
+)
 
 
 @admin.register(Ad)
@@ -15,3 +24,37 @@ class ExchangeProposalAdmin(admin.ModelAdmin):
     list_display = ("id", "ad_sender", "ad_receiver", "status")
     search_fields = ("ad_sender", "ad_receiver")
     list_filter = ("status",)
+
+
+@admin.register(ArchivedExchangeProposal)
+class ArchivedExchangeProposalAdmin(admin.ModelAdmin):
+    list_display = ("id", "ad_sender", "ad_receiver", "status", "created_at", "archived_at")
+    list_filter = ("status",)
+
+
+@admin.register(Category)
+class CategoryAdmin(admin.ModelAdmin):
+    list_display = ("id", "name")
+    search_fields = ("name",)
+
+
+@admin.register(AdFacet)
+class AdFacetAdmin(admin.ModelAdmin):
+    list_display = ("category", "condition", "ad_count")
+    list_filter = ("condition",)
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ("key", "user", "proposal", "status", "created_at")
+    search_fields = ("key",)
+
+
+@admin.register(UserProposalCounter)
+class UserProposalCounterAdmin(admin.ModelAdmin):
+    list_display = ("user", "waiting_received", "waiting_sent")
+
+
+@admin.register(AdProposalCounter)
+class AdProposalCounterAdmin(admin.ModelAdmin):
+    list_display = ("ad", "proposal_count")
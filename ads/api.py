@@ -0,0 +1,232 @@
+import django_filters
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Q
+from rest_framework import permissions, serializers, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.routers import DefaultRouter
+from rest_framework.utils.urls import replace_query_param
+
+from .cycles import get_cycle_engine
+from .events import publish_proposal_event
+from .models import Ad, Category, ExchangeConflict, ExchangeProposal, IdempotencyKey, change_proposal_counters
+from .pagination import CursorPaginator
+from .serializers import AdSerializer, ExchangeProposalSerializer
+
+
+class ApiCursorPagination(BasePagination):
+    """
+    Keyset-пагинация API на ads.pagination.CursorPaginator: ?after= - курсор, ?limit= - размер страницы.
+
+    Ответ: {"next": ссылка на следующую страницу или null, "results": [...]}, без подсчёта общего числа строк.
+    """
+
+    cursor_query_param = "after"
+    limit_query_param = "limit"
+
+    def get_limit(self, request):
+        limit = request.query_params.get(self.limit_query_param, "")
+        if not limit.isdigit() or int(limit) < 1:
+            return settings.ADS_API_PAGE_SIZE
+        return min(int(limit), settings.ADS_API_MAX_PAGE_SIZE)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        paginator = CursorPaginator(queryset, self.get_limit(request), view.cursor_ordering)
+        self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        return self.page.object_list
+
+    def get_next_link(self):
+        if not self.page.has_next():
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.page.next_cursor)
+
+    def get_paginated_response(self, data):
+        return Response({"next": self.get_next_link(), "results": data})
+
+
+class AdFilter(django_filters.FilterSet):
+    category = django_filters.CharFilter(method="filter_category")
+
+    class Meta:
+        model = Ad
+        fields = ["category", "condition", "user"]
+
+    def filter_category(self, queryset, name, value):
+        return queryset.filter(category__key=Category.normalize(value))
+
+
+class ExchangeProposalFilter(django_filters.FilterSet):
+    box = django_filters.ChoiceFilter(
+        choices=[("sent", "отправленные"), ("received", "полученные")], method="filter_box"
+    )
+
+    class Meta:
+        model = ExchangeProposal
+        fields = ["box", "status"]
+
+    def filter_box(self, queryset, name, value):
+        lookup = "ad_sender__user" if value == "sent" else "ad_receiver__user"
+        return queryset.filter(**{lookup: self.request.user})
+
+
+class BatchMixin:
+    """
+    Пакетные операции: POST .../batch/ создаёт список объектов, PATCH .../batch/ изменяет объекты по полю id.
+
+    Пакет применяется целиком в одной транзакции: при любой ошибке не сохраняется ничего, а ответ 400 содержит
+    ошибки по номерам объектов в пакете, как у ListSerializer: {"2": {"category": [...]}}.
+    """
+
+    def prepare_batch(self, items):
+        """Загружает данные, общие для всего пакета, до проверки объектов."""
+
+    def perform_batch_create(self, serializer):
+        serializer.save()
+
+    @action(detail=False, methods=["post", "patch"])
+    def batch(self, request, *args, **kwargs):
+        items = request.data
+        if not isinstance(items, list) or not items or not all(isinstance(item, dict) for item in items):
+            raise serializers.ValidationError("Ожидается непустой список объектов")
+        if len(items) > settings.ADS_API_MAX_BATCH:
+            raise serializers.ValidationError(f"В пакете не больше {settings.ADS_API_MAX_BATCH} объектов")
+        self.prepare_batch(items)
+
+        if request.method == "POST":
+            serializer = self.get_serializer(data=items, many=True)
+            serializer.is_valid(raise_exception=True)
+            with transaction.atomic():
+                self.perform_batch_create(serializer)
+            return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+        ids = [item.get("id") for item in items]
+        objects = self.get_queryset().in_bulk([pk for pk in ids if isinstance(pk, int)])
+        updates, errors = [], {}
+        for position, (pk, item) in enumerate(zip(ids, items)):
+            if pk not in objects:
+                errors[position] = {"id": ["Объект не найден"]}
+            elif pk in ids[:position]:
+                errors[position] = {"id": ["Объект повторяется в пакете"]}
+            else:
+                serializer = self.get_serializer(objects[pk], data=item, partial=True)
+                if not serializer.is_valid():
+                    errors[position] = serializer.errors
+                updates.append(serializer)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        with transaction.atomic():
+            for serializer in updates:
+                self.perform_update(serializer)
+        return Response([serializer.data for serializer in updates])
+
+
+class AdViewSet(BatchMixin, viewsets.ModelViewSet):
+    """Товары: читать могут все, изменять и удалять - только автор (чужой товар даёт 404)."""
+
+    serializer_class = AdSerializer
+    filterset_class = AdFilter
+    pagination_class = ApiCursorPagination
+    permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    cursor_ordering = ["-created_at", "-id"]
+
+    def get_queryset(self):
+        queryset = Ad.objects.select_related("category").defer("search_vector")
+        if self.request.method not in permissions.SAFE_METHODS:
+            queryset = queryset.filter(user=self.request.user)
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_batch_create(self, serializer):
+        # Товары сохраняются по одному, чтобы сигналы обновили поиск, счётчики категорий и подбор пар
+        serializer.save(user=self.request.user)
+
+
+class ExchangeProposalViewSet(BatchMixin, viewsets.ModelViewSet):
+    """
+    Предложения обмена пользователя: отправленные и полученные (?box=sent|received).
+
+    Изменять и удалять предложение может автор, принимать и отклонять - получатель; ключ идемпотентности
+    принятия и отклонения передаётся заголовком Idempotency-Key.
+    """
+
+    serializer_class = ExchangeProposalSerializer
+    filterset_class = ExchangeProposalFilter
+    pagination_class = ApiCursorPagination
+    cursor_ordering = ["-id"]
+    batch_ads = None
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = ExchangeProposal.objects.all()
+        if self.action in ("accept", "decline"):
+            return queryset.filter(ad_receiver__user=user)
+        if self.request.method not in permissions.SAFE_METHODS:
+            return queryset.filter(ad_sender__user=user)
+        return queryset.filter(Q(ad_sender__user=user) | Q(ad_receiver__user=user))
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.batch_ads is not None:
+            context["ads"] = self.batch_ads
+        return context
+
+    def prepare_batch(self, items):
+        # Товары всех предложений пакета проверяются по одному запросу, а не по запросу на предложение
+        ids = {item.get(name) for item in items for name in ("ad_sender", "ad_receiver")}
+        self.batch_ads = Ad.objects.only("id", "user_id").in_bulk([pk for pk in ids if isinstance(pk, int)])
+
+    def perform_batch_create(self, serializer):
+        proposals = ExchangeProposal.objects.bulk_create(
+            ExchangeProposal(**attrs) for attrs in serializer.validated_data
+        )
+        serializer.instance = proposals
+        # bulk_create не вызывает сигналы, поэтому счётчики предложений обновляются и события публикуются здесь,
+        # а граф циклов - рёбрами новых предложений
+        user = self.request.user.pk
+        rows = [
+            (
+                proposal.ad_sender_id,
+                user,
+                proposal.ad_receiver_id,
+                self.batch_ads[proposal.ad_receiver_id].user_id,
+                proposal.status,
+            )
+            for proposal in proposals
+        ]
+        change_proposal_counters(added=rows)
+        for proposal, (_, sender, _, receiver, _) in zip(proposals, rows):
+            publish_proposal_event("created", proposal.pk, proposal.status, (sender, receiver))
+        edges = {(sender, receiver) for _, sender, _, receiver, _ in rows}
+        transaction.on_commit(lambda: get_cycle_engine().refresh_edges(edges))
+
+    def resolve(self, status_value):
+        proposal = self.get_object()
+        key = self.request.headers.get("Idempotency-Key", "").strip()
+        try:
+            proposal.resolve(status_value, self.request.user, key[: IdempotencyKey._meta.get_field("key").max_length])
+        except ExchangeConflict as error:
+            return Response({"detail": str(error)}, status=status.HTTP_409_CONFLICT)
+        except IntegrityError:
+            return Response(
+                {"detail": "Ключ идемпотентности уже использован для другого действия"},
+                status=status.HTTP_409_CONFLICT,
+            )
+        return Response(self.get_serializer(proposal).data)
+
+    @action(detail=True, methods=["post"])
+    def accept(self, request, *args, **kwargs):
+        return self.resolve("accepted")
+
+    @action(detail=True, methods=["post"])
+    def decline(self, request, *args, **kwargs):
+        return self.resolve("declined")
+
+
+router = DefaultRouter()
+router.register("ads", AdViewSet, basename="ad")
+router.register("proposals", ExchangeProposalViewSet, basename="proposal")
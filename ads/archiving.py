@@ -0,0 +1,72 @@
+"""
+Перенос решённых предложений обмена в архив (ArchivedExchangeProposal), чтобы таблица ExchangeProposal, которую
+читают списки предложений, счётчики и граф циклов, оставалась небольшой.
+
+Предложения переносятся пачками по возрастанию первичного ключа, каждая пачка - в своей короткой транзакции:
+строки блокируются только на время переноса пачки, а прерванный перенос продолжается с последнего ключа.
+"""
+
+import datetime
+import time
+
+from django.conf import settings
+from django.db import router, transaction
+from django.utils import timezone
+
+from .models import ArchivedExchangeProposal, ExchangeProposal, IdempotencyKey
+
+FIELDS = ("id", "ad_sender_id", "ad_receiver_id", "comment", "status", "created_at")
+
+
+def archive_cutoff(days=None):
+    """Предложения, созданные раньше этой даты, переносятся в архив."""
+    days = settings.ADS_ARCHIVE_AFTER_DAYS if days is None else days
+    return timezone.localdate() - datetime.timedelta(days=days)
+
+
+def archive_batch(cutoff, after=0, batch_size=None):
+    """
+    Переносит в архив до batch_size решённых предложений, созданных раньше cutoff, с ключом больше after.
+    Возвращает последний перенесённый ключ (after, если переносить нечего) и число перенесённых предложений.
+    """
+    batch_size = batch_size or settings.ADS_ARCHIVE_BATCH_SIZE
+    using = router.db_for_write(ExchangeProposal)
+    with transaction.atomic(using=using):
+        # Строки, которые сейчас меняет другая транзакция (например, resolve), пропускаются до следующего запуска
+        rows = list(
+            ExchangeProposal.objects.using(using)
+            .select_for_update(skip_locked=True)
+            .filter(pk__gt=after, status__in=["accepted", "declined"], created_at__lt=cutoff)
+            .order_by("pk")
+            .values(*FIELDS)[:batch_size]
+        )
+        if not rows:
+            return after, 0
+        ids = [row["id"] for row in rows]
+        ArchivedExchangeProposal.objects.using(using).bulk_create(ArchivedExchangeProposal(**row) for row in rows)
+        # Ключи идемпотентности решённого предложения больше не нужны: повтор запроса получит 404
+        IdempotencyKey.objects.using(using).filter(proposal__in=ids)._raw_delete(using)
+        # Удаление в обход сигналов: перенос не меняет ни счётчики предложений (AdProposalCounter считает и архив),
+        # ни ожидающие предложения графа циклов, и участникам не отправляются события удаления
+        ExchangeProposal.objects.using(using).filter(pk__in=ids)._raw_delete(using)
+    return ids[-1], len(ids)
+
+
+def archive_resolved_proposals(cutoff, after=0, batch_size=None, max_batches=None, pause=0, progress=None):
+    """
+    Переносит в архив пачками все решённые предложения, созданные раньше cutoff, начиная с ключа больше after;
+    max_batches ограничивает число пачек за запуск, pause - пауза в секундах между пачками, progress(ключ, число)
+    вызывается после каждой пачки. Возвращает последний перенесённый ключ и общее число перенесённых предложений.
+    """
+    total = batches = 0
+    while max_batches is None or batches < max_batches:
+        after, moved = archive_batch(cutoff, after, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        if progress is not None:
+            progress(after, moved)
+        if pause:
+            time.sleep(pause)
+    return after, total
@@ -0,0 +1,199 @@
+"""
+Асинхронные варианты представлений ads.views для чтения: списки товаров, поиск и страница товара.
+
+Данные загружаются асинхронным ORM без перехода в поток на весь запрос; шаблон по-прежнему отрисовывается
+синхронно (Django делает это в потоке после возврата TemplateResponse). Какие маршруты обслуживаются этими
+представлениями, задаёт настройка ADS_ASYNC_VIEWS, см. ads/urls.py.
+"""
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth.views import redirect_to_login
+from django.core.paginator import InvalidPage, Page, Paginator
+from django.db.models.query import QuerySet
+from django.http import Http404
+from django.views import View
+from django.views.generic.base import TemplateResponseMixin
+
+from .caching import AsyncConditionalGetMixin, aget_ad_version, aget_list_version, aget_proposal_badges
+from .models import Ad, AdFacet
+from .pagination import CURSOR_MODE, CursorPaginator
+from .search import filter_search_queryset, get_search_backend
+
+
+class AsyncViewMixin:
+    """
+    Загружает пользователя асинхронно до обработки запроса и проверяет вход, если login_required.
+
+    После этого request.user - готовый объект, и шаблоны и проверки не обращаются к базе синхронно, поэтому
+    примесь должна стоять в списке базовых классов первой.
+    """
+
+    login_required = False
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await request.auser()
+        if self.login_required and not request.user.is_authenticated:
+            return redirect_to_login(request.get_full_path())
+        return await super().dispatch(request, *args, **kwargs)
+
+
+async def count_rows(rows):
+    if isinstance(rows, QuerySet):
+        return await rows.acount()
+    # Результаты поиска InvertedIndexSearchBackend - не QuerySet, они считаются и читаются синхронно
+    return await sync_to_async(rows.count)()
+
+
+async def fetch_rows(rows, bottom, top):
+    if isinstance(rows, QuerySet):
+        return [row async for row in rows[bottom:top]]
+    return await sync_to_async(rows.__getitem__)(slice(bottom, top))
+
+
+class AsyncListView(TemplateResponseMixin, View):
+    """
+    Список с пагинацией как у ListView и CursorPaginationMixin: страница и число строк загружаются асинхронно.
+
+    Контекст шаблона тот же: object_list, page_obj, paginator, is_paginated и is_cursor_paginated.
+    """
+
+    queryset = None
+    ordering: list[str] | None = ["id"]
+    paginate_by = 15
+    page_kwarg = "page"
+    cursor_param = "after"
+    pagination_mode: str | None = None
+    context_object_name: str | None = None
+
+    def get_queryset(self):
+        return self.queryset.all()
+
+    async def get_object_list(self):
+        queryset = self.get_queryset()
+        return queryset.order_by(*self.ordering) if self.ordering else queryset
+
+    def get_pagination_mode(self):
+        return self.pagination_mode or settings.ADS_PAGINATION
+
+    async def paginate(self, rows):
+        if self.get_pagination_mode() == CURSOR_MODE:
+            paginator = CursorPaginator(rows, self.paginate_by, self.ordering)
+            page = await paginator.apage(self.request.GET.get(self.cursor_param))
+            return paginator, page
+
+        paginator = Paginator(rows, self.paginate_by)
+        # Число строк считается заранее асинхронно, чтобы Paginator не выполнял COUNT(*) синхронно
+        paginator.count = await count_rows(rows)
+        number = self.request.GET.get(self.page_kwarg) or 1
+        try:
+            number = paginator.num_pages if number == "last" else paginator.validate_number(number)
+        except InvalidPage as error:
+            raise Http404(f"Неверная страница ({number}): {error}")
+        bottom = (number - 1) * paginator.per_page
+        top = bottom + paginator.per_page
+        return paginator, Page(await fetch_rows(rows, bottom, top), number, paginator)
+
+    async def get_context_data(self, **kwargs):
+        paginator, page = await self.paginate(await self.get_object_list())
+        context = {
+            "view": self,
+            "paginator": paginator,
+            "page_obj": page,
+            "is_paginated": page.has_other_pages(),
+            "is_cursor_paginated": self.get_pagination_mode() == CURSOR_MODE,
+            "object_list": page.object_list,
+        }
+        if self.context_object_name:
+            context[self.context_object_name] = page.object_list
+        context.update(kwargs)
+        return context
+
+    async def get(self, request, *args, **kwargs):
+        return self.render_to_response(await self.get_context_data())
+
+
+class AsyncAdListVersionMixin(AsyncConditionalGetMixin):
+    async def get_version(self):
+        # Значки для ETag загружаются здесь: get_client_state вызывается синхронно
+        self.badges = await aget_proposal_badges(self.request.user)
+        return await aget_list_version()
+
+    def get_client_state(self):
+        return self.badges
+
+
+class AdListView(AsyncViewMixin, AsyncAdListVersionMixin, AsyncListView):
+    """Асинхронный вариант ads.views.AdListView."""
+
+    read_from_replica = True
+
+    queryset = Ad.objects.select_related("user", "category")
+    template_name = "ads/ad_list.html"
+    context_object_name = "ad_list"
+
+
+class NotUserAdListView(AdListView):
+    """Асинхронный вариант ads.views.NotUserAdListView."""
+
+    login_required = True
+
+    def get_queryset(self):
+        return super().get_queryset().exclude(user=self.request.user)
+
+
+class UserAdListView(AdListView):
+    """Асинхронный вариант ads.views.UserAdListView."""
+
+    login_required = True
+
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user)
+
+
+class AdSearchView(AsyncViewMixin, AsyncAdListVersionMixin, AsyncListView):
+    """Асинхронный вариант ads.views.AdSearchView."""
+
+    read_from_replica = True
+
+    queryset = Ad.objects.select_related("user", "category")
+    template_name = "ads/search_results.html"
+    context_object_name = "ads"
+    pagination_mode = "offset"
+    ordering = None
+
+    async def get_object_list(self):
+        queryset, search_query = filter_search_queryset(self.get_queryset(), self.request.GET)
+        if search_query:
+            # Поисковые движки синхронные (индекс в памяти строится из базы), поэтому поиск выполняется в потоке
+            return await sync_to_async(get_search_backend().search)(queryset, search_query)
+        return queryset
+
+    async def get_context_data(self, **kwargs):
+        context = await super().get_context_data(**kwargs)
+
+        categories, conditions = await AdFacet.atotals()
+        context["categories"] = categories
+        context["condition_choices"] = [
+            (value, label, conditions.get(value, 0)) for value, label in Ad.CONDITION_CHOICES
+        ]
+        return context
+
+
+class AdDetailView(AsyncViewMixin, AsyncConditionalGetMixin, TemplateResponseMixin, View):
+    """Асинхронный вариант ads.views.AdDetailView."""
+
+    read_from_replica = True
+
+    login_required = True
+    template_name = "ads/ad_detail.html"
+
+    async def get_version(self):
+        return await aget_ad_version(self.kwargs["pk"])
+
+    async def get(self, request, pk):
+        try:
+            ad = await Ad.objects.select_related("user", "category").aget(pk=pk)
+        except Ad.DoesNotExist:
+            raise Http404("Товар не найден")
+        return self.render_to_response({"view": self, "object": ad, "ad": ad})
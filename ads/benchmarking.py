@@ -0,0 +1,180 @@
+import random
+import statistics
+import time
+from contextlib import contextmanager
+
+from django.db import connection, transaction
+
+from users.models import User
+
+from .models import Ad, AdFacet, Category, ExchangeProposal, reconcile_proposal_counters
+
+# Словарь для генерации правдоподобных объявлений
+TITLE_WORDS = [
+    "ноутбук",
+    "смартфон",
+    "диван",
+    "кофемашина",
+    "фотоаппарат",
+    "велосипед",
+    "книга",
+    "куртка",
+    "кресло",
+    "стол",
+    "планшет",
+    "наушники",
+    "часы",
+    "рюкзак",
+    "палатка",
+    "гитара",
+    "телевизор",
+    "холодильник",
+    "пылесос",
+    "самокат",
+]
+DESCRIPTION_WORDS = [
+    "отличное",
+    "состояние",
+    "новый",
+    "гарантия",
+    "коробка",
+    "царапины",
+    "работает",
+    "зарядка",
+    "кожаный",
+    "синий",
+    "черный",
+    "белый",
+    "большой",
+    "маленький",
+    "комплект",
+    "доставка",
+    "обмен",
+    "срочно",
+    "торг",
+    "оригинал",
+]
+CATEGORIES = ["Электроника", "Мебель", "Одежда", "Книги", "Спорт", "Техника", "Туризм", "Музыка"]
+
+
+def get_categories():
+    return [Category.objects.get_for_name(name) for name in CATEGORIES]
+
+
+def make_ad(rng, user, categories):
+    """Создаёт (не сохраняя) случайное объявление."""
+    return Ad(
+        title=" ".join(rng.sample(TITLE_WORDS, 2)).capitalize(),
+        description=" ".join(rng.choices(DESCRIPTION_WORDS, k=12)),
+        category=rng.choice(categories),
+        condition=rng.choice(Ad.CONDITION_CHOICES)[0],
+        user=user,
+    )
+
+
+def seed_ads(user, count, batch_size=5000, seed=0):
+    """Добавляет count случайных объявлений пачками через bulk_create."""
+    rng = random.Random(seed)
+    categories = get_categories()
+    for start in range(0, count, batch_size):
+        Ad.objects.bulk_create([make_ad(rng, user, categories) for _ in range(min(batch_size, count - start))])
+    # bulk_create не вызывает сигналы, поэтому счётчики пересчитываются целиком
+    AdFacet.rebuild()
+    analyze()
+
+
+def seed_proposals(sender, receiver, count, seed=0):
+    """Добавляет count предложений обмена от товаров пользователя sender к товарам receiver."""
+    rng = random.Random(seed)
+    sender_ads = list(Ad.objects.filter(user=sender).values_list("pk", flat=True))
+    receiver_ads = list(Ad.objects.filter(user=receiver).values_list("pk", flat=True))
+    statuses = ["waiting", "accepted", "declined"]
+    ExchangeProposal.objects.bulk_create(
+        ExchangeProposal(
+            ad_sender_id=rng.choice(sender_ads),
+            ad_receiver_id=rng.choice(receiver_ads),
+            comment="Предлагаю обмен",
+            status=rng.choice(statuses),
+        )
+        for _ in range(count)
+    )
+    # bulk_create не вызывает сигналы, поэтому счётчики предложений сверяются с таблицей
+    reconcile_proposal_counters()
+
+
+def seed_replay_data(size, proposals):
+    """
+    Данные для воспроизведения запросов: участник с десятой частью из size товаров, другой пользователь
+    с остальными и по proposals предложений в каждую сторону. Возвращает пользователей и объекты для
+    аргументов маршрутов (см. ads.replay.Replayer).
+    """
+    member = User.objects.create_user(username="benchmark_member", password="benchmark")
+    other = User.objects.create_user(username="benchmark_other", password="benchmark")
+    own_count = max(size // 10, 1)
+    seed_ads(member, own_count, seed=1)
+    seed_ads(other, max(size - own_count, 1), seed=2)
+    seed_proposals(member, other, proposals, seed=3)
+    seed_proposals(other, member, proposals, seed=4)
+
+    ad_ids = Ad.objects.order_by("pk").values_list("pk", flat=True)
+    proposal_ids = ExchangeProposal.objects.order_by("pk").values_list("pk", flat=True)
+    objects = {
+        "ad": ad_ids.filter(user=other).first(),
+        "own_ad": ad_ids.filter(user=member).first(),
+        "sent_proposal": proposal_ids.filter(ad_sender__user=member).first(),
+        "received_proposal": proposal_ids.filter(ad_receiver__user=member).first(),
+    }
+    return {"anonymous": None, "member": member, "other": other}, objects
+
+
+def seed_barter_graph(user_count, proposal_count, batch_size=10_000, seed=0, ads_per_user=1, statuses=("waiting",)):
+    """
+    Создаёт user_count пользователей с ads_per_user товарами у каждого и proposal_count предложений
+    со случайным статусом из statuses между случайными товарами. Возвращает id созданных пользователей.
+    """
+    rng = random.Random(seed)
+    categories = get_categories()
+    users, ads = [], []
+    # bulk_create в PostgreSQL и SQLite возвращает объекты с первичными ключами, поэтому повторно их не читаем
+    for start in range(0, user_count, batch_size):
+        stop = min(start + batch_size, user_count)
+        created = User.objects.bulk_create(
+            User(username=f"barter_{seed}_{number}", password="!") for number in range(start, stop)
+        )
+        users.extend(user.pk for user in created)
+        for _ in range(ads_per_user):
+            ads.extend(ad.pk for ad in Ad.objects.bulk_create(make_ad(rng, user, categories) for user in created))
+
+    for start in range(0, proposal_count, batch_size):
+        batch = []
+        for _ in range(min(batch_size, proposal_count - start)):
+            sender, receiver = rng.sample(ads, 2)
+            batch.append(ExchangeProposal(ad_sender_id=sender, ad_receiver_id=receiver, status=rng.choice(statuses)))
+        ExchangeProposal.objects.bulk_create(batch)
+    reconcile_proposal_counters()
+    analyze()
+    return users
+
+
+def analyze():
+    """Обновляет статистику планировщика после массовой вставки."""
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+
+
+def measure(func, repeat=5):
+    """Выполняет func repeat раз и возвращает медианное время в миллисекундах."""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+@contextmanager
+def rollback_after():
+    """Выполняет блок в транзакции, которая всегда откатывается, чтобы не оставлять тестовые данные."""
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
@@ -0,0 +1,210 @@
+import hashlib
+import time
+
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+# Версия - время последнего изменения в микросекундах. В отличие от счётчика, после вытеснения ключа из кэша
+# новая версия всё равно больше прежних, поэтому клиент не получит 304 для изменившейся страницы.
+LIST_VERSION_KEY = "ads:list:version"
+
+
+def ad_version_key(pk):
+    return f"ads:ad:{pk}:version"
+
+
+def to_version(moment=None):
+    return int((moment.timestamp() if moment else time.time()) * 1_000_000)
+
+
+def bump_ad_version(pk, moment=None):
+    """Меняет версии товара и списков товаров после сохранения или удаления."""
+    version = to_version(moment)
+    cache.set_many({ad_version_key(pk): version, LIST_VERSION_KEY: version}, timeout=None)
+
+
+def bump_list_version():
+    """Меняет версию списков после массовых изменений, которые не вызывают сигналы."""
+    cache.set(LIST_VERSION_KEY, to_version(), timeout=None)
+
+
+def get_ad_version(pk):
+    """Версия товара; если её нет в кэше, восстанавливается по Ad.updated_at. Для несуществующего товара - None."""
+    from .models import Ad  # ads.models использует этот модуль
+
+    version = cache.get(ad_version_key(pk))
+    if version is None:
+        updated_at = Ad.objects.filter(pk=pk).values_list("updated_at", flat=True).first()
+        if updated_at is None:
+            return None
+        version = to_version(updated_at)
+        cache.add(ad_version_key(pk), version, timeout=None)
+    return version
+
+
+def get_list_version():
+    return cache.get_or_set(LIST_VERSION_KEY, to_version, timeout=None)
+
+
+def get_shared_version(key):
+    """
+    Версия данных, которые каждый процесс держит в памяти (граф циклов обмена, матрицы подбора пар). Процесс
+    сравнивает её с версией своей копии и перестраивает копию, если данные изменил другой процесс.
+    """
+    return cache.get_or_set(key, to_version, timeout=None)
+
+
+def bump_shared_version(key):
+    """
+    Увеличивает версию на единицу и возвращает новую. Если она больше версии копии процесса ровно на единицу,
+    после построения копии данные менял только этот процесс и копию можно обновить на месте.
+    """
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Ключ вытеснен: счёт начинается со времени в микросекундах, поэтому новая версия больше прежних
+        cache.add(key, to_version(), timeout=None)
+        return cache.incr(key)
+
+
+async def aget_ad_version(pk):
+    """Асинхронный вариант get_ad_version."""
+    from .models import Ad
+
+    version = await cache.aget(ad_version_key(pk))
+    if version is None:
+        updated_at = await Ad.objects.filter(pk=pk).values_list("updated_at", flat=True).afirst()
+        if updated_at is None:
+            return None
+        version = to_version(updated_at)
+        await cache.aadd(ad_version_key(pk), version, timeout=None)
+    return version
+
+
+async def aget_list_version():
+    return await cache.aget_or_set(LIST_VERSION_KEY, to_version, timeout=None)
+
+
+def proposal_badges_key(user_id):
+    return f"ads:user:{user_id}:badges"
+
+
+def drop_proposal_badges(user_ids):
+    """Сбрасывает значки предложений пользователей после изменения их счётчиков."""
+    keys = [proposal_badges_key(user_id) for user_id in user_ids]
+    if keys:
+        cache.delete_many(keys)
+        # Запрос, прочитавший прежние счётчики до фиксации транзакции, мог снова положить их в кэш
+        transaction.on_commit(lambda: cache.delete_many(keys), robust=True)
+
+
+def get_proposal_badges(user):
+    """
+    Значки в шапке: {"waiting_received": ..., "waiting_sent": ...} из UserProposalCounter, без обращения к таблице
+    предложений; для анонимного пользователя - None.
+
+    Счётчики читаются с основной базы, даже если страница читает товары с реплики: значение с отстающей реплики
+    осталось бы в кэше до следующего изменения счётчиков.
+    """
+    from .models import UserProposalCounter
+
+    if not user.is_authenticated:
+        return None
+    badges = cache.get(proposal_badges_key(user.pk))
+    if badges is None:
+        counter = (
+            UserProposalCounter.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk=user.pk)
+            .values(*UserProposalCounter.counter_fields)
+            .first()
+        )
+        badges = counter or dict.fromkeys(UserProposalCounter.counter_fields, 0)
+        cache.set(proposal_badges_key(user.pk), badges, timeout=None)
+    return badges
+
+
+async def aget_proposal_badges(user):
+    """Асинхронный вариант get_proposal_badges."""
+    from .models import UserProposalCounter
+
+    if not user.is_authenticated:
+        return None
+    badges = await cache.aget(proposal_badges_key(user.pk))
+    if badges is None:
+        counter = (
+            await UserProposalCounter.objects.using(DEFAULT_DB_ALIAS)
+            .filter(pk=user.pk)
+            .values(*UserProposalCounter.counter_fields)
+            .afirst()
+        )
+        badges = counter or dict.fromkeys(UserProposalCounter.counter_fields, 0)
+        await cache.aset(proposal_badges_key(user.pk), badges, timeout=None)
+    return badges
+
+
+class ConditionalGetMixin:
+    """
+    Отвечает 304 Not Modified на If-None-Match / If-Modified-Since, не выполняя запросы представления и не отрисовывая
+    шаблон.
+
+    ETag строится из версии данных в кэше (get_version), пользователя и ключа сессии: страницы содержат имя
+    пользователя и CSRF-токен формы выхода, который меняется при входе вместе с ключом сессии.
+    Версии должны храниться в общем кэше (Redis, Memcached), если приложение запущено в нескольких процессах.
+    """
+
+    def get_version(self):
+        raise NotImplementedError
+
+    def get_client_state(self):
+        """Данные пользователя на странице, которые меняются независимо от версии, например значки в шапке."""
+        return ""
+
+    def get_etag(self, version):
+        request = self.request
+        client = f"{request.user.pk}:{request.session.session_key}:{self.get_client_state()}"
+        return f'"{version}-{hashlib.blake2b(client.encode(), digest_size=6).hexdigest()}"'
+
+    def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        etag, last_modified, response = self.get_conditional_response(self.get_version())
+        if response is None:
+            response = super().dispatch(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
+
+    def get_conditional_response(self, version):
+        """ETag, время изменения и ответ 304, если страница у клиента актуальна (иначе None)."""
+        if version is None:
+            return None, None, None
+        etag = self.get_etag(version)
+        last_modified = version // 1_000_000
+        return etag, last_modified, get_conditional_response(self.request, etag=etag, last_modified=last_modified)
+
+    @staticmethod
+    def add_validators(response, etag, last_modified):
+        if etag is not None and response.status_code == 200:
+            response.headers.setdefault("ETag", etag)
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+
+        # Браузер и прокси хранят страницу, но каждый раз проверяют её актуальность
+        patch_cache_control(response, private=True, no_cache=True)
+        return response
+
+
+class AsyncConditionalGetMixin(ConditionalGetMixin):
+    """Вариант ConditionalGetMixin для асинхронных представлений: get_version - корутина."""
+
+    async def get_version(self):
+        raise NotImplementedError
+
+    async def dispatch(self, request, *args, **kwargs):
+        if request.method not in ("GET", "HEAD"):
+            return await super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+
+        etag, last_modified, response = self.get_conditional_response(await self.get_version())
+        if response is None:
+            response = await super(ConditionalGetMixin, self).dispatch(request, *args, **kwargs)
+        return self.add_validators(response, etag, last_modified)
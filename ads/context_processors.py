@@ -0,0 +1,8 @@
+from django.utils.functional import SimpleLazyObject
+
+from .caching import get_proposal_badges
+
+
+def proposal_badges(request):
+    """Значки ожидающих предложений для шапки; загружаются, только если шаблон к ним обращается."""
+    return {"proposal_badges": SimpleLazyObject(lambda: get_proposal_badges(request.user))}
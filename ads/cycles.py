@@ -0,0 +1,228 @@
+import functools
+import threading
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .caching import bump_shared_version, get_shared_version
+
+# Циклы длиннее четырёх участников на практике не договариваются, а число путей растёт экспоненциально
+MAX_CYCLE_LENGTH = 4
+# Предел числа путей с каждой стороны поиска, чтобы пользователи с тысячами предложений не замедляли ответ
+MAX_PATHS = 20_000
+# Версия графа в общем кэше: её меняет каждое изменение ожидающих предложений в любом процессе
+CYCLES_VERSION_KEY = "ads:cycles:version"
+
+
+class ProposalGraph:
+    """
+    Ориентированный граф пользователей по ожидающим предложениям обмена.
+
+    Ребро u -> v означает, что пользователь u хочет товар пользователя v; вес ребра - число таких предложений.
+    """
+
+    def __init__(self):
+        self.outgoing = defaultdict(dict)
+        self.incoming = defaultdict(dict)
+
+    def __len__(self):
+        return sum(len(targets) for targets in self.outgoing.values())
+
+    def set_edge(self, source, target, count):
+        if count > 0 and source != target:
+            self.outgoing[source][target] = count
+            self.incoming[target][source] = count
+            return
+        for adjacency, node, other in ((self.outgoing, source, target), (self.incoming, target, source)):
+            if node in adjacency:
+                adjacency[node].pop(other, None)
+                if not adjacency[node]:
+                    del adjacency[node]
+
+    @staticmethod
+    def paths(start, adjacency, depth):
+        """Простые пути из start длиной 1..depth по adjacency; levels[d] - пути из d рёбер (без start)."""
+        levels = [[], [(node,) for node in adjacency.get(start, ())]]
+        total = len(levels[1])
+        for _ in range(depth - 1):
+            level = []
+            for path in levels[-1]:
+                for node in adjacency.get(path[-1], ()):
+                    if node != start and node not in path:
+                        level.append(path + (node,))
+                if total + len(level) >= MAX_PATHS:
+                    break
+            total += len(level)
+            levels.append(level)
+        return levels
+
+    def find_cycles(self, user, max_length=MAX_CYCLE_LENGTH, limit=10):
+        """
+        Циклы u -> p1 -> ... -> u длиной до max_length, от коротких к длинным.
+
+        Поиск встречный: пути длиной ceil(L/2) от пользователя по исходящим рёбрам соединяются с путями
+        длиной floor(L/2) к пользователю по входящим, поэтому перебирается порядка d^(L/2) путей вместо d^L.
+        """
+        forward = self.paths(user, self.outgoing, (max_length + 1) // 2)
+        backward = self.paths(user, self.incoming, max_length // 2)
+
+        cycles = []
+        for length in range(2, max_length + 1):
+            forward_length, backward_length = (length + 1) // 2, length // 2
+            if forward_length >= len(forward) or backward_length >= len(backward):
+                break
+            # Обратные пути по вершине встречи: q[-1] -> ... -> q[0] -> user
+            meeting = defaultdict(list)
+            for path in backward[backward_length]:
+                meeting[path[-1]].append(path)
+
+            for path in forward[forward_length]:
+                for back in meeting.get(path[-1], ()):
+                    nodes = path + tuple(reversed(back[:-1]))
+                    if len(set(nodes)) == len(nodes):
+                        cycles.append((user,) + nodes)
+                        if len(cycles) >= limit:
+                            return cycles
+        return cycles
+
+
+class CycleEngine:
+    """
+    Подбирает многосторонние обмены (A хочет товар B, B - товар C, C - товар A) по ожидающим предложениям.
+
+    Граф строится при первом обращении и обновляется сигналами ads.signals в текущем процессе. Изменения
+    в других процессах видны по версии CYCLES_VERSION_KEY в общем кэше: если граф устарел, он строится заново.
+    """
+
+    def __init__(self):
+        self.graph = None
+        self.version = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def waiting_proposals():
+        from .models import ExchangeProposal
+
+        return ExchangeProposal.objects.filter(status="waiting")
+
+    def _get_graph(self):
+        # Версия читается до загрузки рёбер: изменение во время загрузки вызовет ещё одно построение
+        version = get_shared_version(CYCLES_VERSION_KEY)
+        with self.lock:
+            if self.graph is None or self.version != version:
+                graph = ProposalGraph()
+                edges = (
+                    self.waiting_proposals()
+                    .values_list("ad_sender__user_id", "ad_receiver__user_id")
+                    .annotate(count=Count("id"))
+                    .order_by()
+                )
+                for source, target, count in edges.iterator(chunk_size=10_000):
+                    graph.set_edge(source, target, count)
+                self.graph = graph
+                self.version = version
+            return self.graph
+
+    def _apply_change(self, apply=None):
+        """
+        Отмечает изменение графа в общем кэше и применяет его к графу процесса, если после построения графа других
+        изменений не было; иначе граф строится заново при следующем обращении.
+        """
+        version = bump_shared_version(CYCLES_VERSION_KEY)
+        with self.lock:
+            if self.graph is None:
+                return
+            if version != self.version + 1:
+                self.graph = None
+                return
+            if apply is not None:
+                apply(self.graph)
+            self.version = version
+
+    def refresh_edges(self, edges):
+        """Пересчитывает рёбра (source, target) графа одним запросом, например после массового отклонения."""
+        if not edges:
+            return
+        if self.graph is None:
+            self._apply_change()
+            return
+        condition = Q()
+        for source, target in edges:
+            condition |= Q(ad_sender__user_id=source, ad_receiver__user_id=target)
+        counts = (
+            self.waiting_proposals()
+            .filter(condition)
+            .values_list("ad_sender__user_id", "ad_receiver__user_id")
+            .annotate(count=Count("id"))
+            .order_by()
+        )
+        counts = {(source, target): count for source, target, count in counts}
+
+        def apply(graph):
+            for source, target in edges:
+                graph.set_edge(source, target, counts.get((source, target), 0))
+
+        self._apply_change(apply)
+
+    def refresh_proposal(self, proposal):
+        """Пересчитывает ребро графа после создания, изменения или удаления предложения."""
+        from .models import Ad
+
+        # Другие процессы могли перестроить граф до фиксации транзакции и не увидеть изменение
+        transaction.on_commit(self._apply_change, robust=True)
+        if self.graph is None:
+            self._apply_change()
+            return
+        users = dict(
+            Ad.objects.filter(pk__in=[proposal.ad_sender_id, proposal.ad_receiver_id]).values_list("pk", "user_id")
+        )
+        source, target = users.get(proposal.ad_sender_id), users.get(proposal.ad_receiver_id)
+        if source is not None and target is not None:
+            self.refresh_edges([(source, target)])
+        else:
+            # Товар удалён: ребро без предложений уберёт suggest
+            self._apply_change()
+
+    def rebuild(self):
+        bump_shared_version(CYCLES_VERSION_KEY)
+        with self.lock:
+            self.graph = None
+
+    def suggest(self, user, max_length=MAX_CYCLE_LENGTH, limit=10):
+        """
+        Предлагаемые циклы обмена для пользователя: списки предложений, первое из которых - предложение пользователя.
+
+        Для каждого ребра берётся самое раннее ожидающее предложение; все рёбра загружаются одним запросом.
+        """
+        cycles = self._get_graph().find_cycles(user.pk, max_length, limit)
+        edges = {
+            (cycle[position], cycle[(position + 1) % len(cycle)]) for cycle in cycles for position in range(len(cycle))
+        }
+        if not edges:
+            return []
+
+        condition = Q()
+        for source, target in edges:
+            condition |= Q(ad_sender__user_id=source, ad_receiver__user_id=target)
+        proposals = {}
+        queryset = self.waiting_proposals().filter(condition).select_related("ad_sender__user", "ad_receiver__user")
+        for proposal in queryset.order_by("id"):
+            proposals.setdefault((proposal.ad_sender.user_id, proposal.ad_receiver.user_id), proposal)
+
+        suggestions = []
+        for cycle in cycles:
+            cycle_edges = [(cycle[position], cycle[(position + 1) % len(cycle)]) for position in range(len(cycle))]
+            if all(edge in proposals for edge in cycle_edges):
+                suggestions.append([proposals[edge] for edge in cycle_edges])
+        # Рёбра, для которых предложений уже нет, удаляются из графа
+        for source, target in edges - proposals.keys():
+            with self.lock:
+                if self.graph is not None:
+                    self.graph.set_edge(source, target, 0)
+        return suggestions
+
+
+@functools.cache
+def get_cycle_engine():
+    return CycleEngine()
@@ -0,0 +1,292 @@
+"""
+Уведомления о предложениях обмена в реальном времени: поток Server-Sent Events (ads:proposal-events).
+
+Изменения предложений публикуются после фиксации транзакции в брокер из настройки ADS_EVENTS_BROKER, брокер
+доставляет их открытым потокам пользователей-участников:
+
+- InProcessBroker - публикация и подписчики в одном процессе (один процесс ASGI-сервера или тесты);
+- SocketBroker - процессы обмениваются событиями через Unix-сокеты в каталоге ADS_EVENTS_SOCKET_DIR, поэтому
+  событие из любого процесса (в том числе WSGI) доходит до потоков во всех процессах ASGI-сервера на этой машине.
+
+Поток обслуживает EventStreamApplication из config/asgi.py, а не представление Django: обработчик ASGI Django держит
+на каждый запрос отдельный поток выполнения синхронного кода до конца ответа, и тысячи открытых потоков событий
+держали бы тысячи потоков ОС и подключений к базе. Здесь открытый поток - это сопрограмма и очередь событий.
+"""
+
+import asyncio
+import atexit
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from http.cookies import SimpleCookie
+from importlib import import_module
+from pathlib import Path
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import auth
+from django.core.exceptions import DisallowedHost
+from django.core.handlers.asgi import ASGIRequest
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# Размер дейтаграммы SocketBroker: события - небольшие JSON-объекты
+MAX_DATAGRAM = 64 * 1024
+
+
+class Subscription:
+    """Открытый поток событий пользователя: очередь сообщений в цикле событий, которому принадлежит поток."""
+
+    __slots__ = ("user_id", "loop", "queue")
+
+    # Помещается в очередь при закрытии потока, чтобы get() вернулся сразу
+    CLOSED = object()
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(settings.ADS_EVENTS_QUEUE_SIZE)
+
+    @staticmethod
+    def push(subscriptions, message):
+        """
+        Добавляет сообщение в очереди потоков; можно вызывать из любого потока. Цикл событий будится один раз
+        на все его потоки, а не на каждый.
+        """
+        loops = {}
+        for subscription in subscriptions:
+            loops.setdefault(subscription.loop, []).append(subscription)
+        for loop, items in loops.items():
+            try:
+                loop.call_soon_threadsafe(Subscription.put, items, message)
+            except RuntimeError:
+                # Цикл событий уже закрыт: потоки завершились, не успев отписаться
+                pass
+
+    @staticmethod
+    def put(subscriptions, message):
+        for subscription in subscriptions:
+            queue = subscription.queue
+            if queue.full():
+                # Клиент не успевает читать: старое сообщение отбрасывается, а не копится в памяти
+                queue.get_nowait()
+            queue.put_nowait(message)
+
+    def close(self):
+        self.push([self], self.CLOSED)
+
+    async def get(self, timeout):
+        """Следующее сообщение потока (байты), None, если за timeout секунд сообщений не было, или CLOSED."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class InProcessBroker:
+    """Брокер в памяти процесса: события доходят только до потоков, открытых в этом же процессе."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subscribers = {}
+
+    def subscribe(self, user_id):
+        """Подписывает поток на события пользователя; вызывается в цикле событий потока."""
+        subscription = Subscription(user_id)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscriptions = self.subscribers.get(subscription.user_id, set())
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                self.subscribers.pop(subscription.user_id, None)
+
+    def publish(self, user_ids, event):
+        """Отправляет событие всем потокам пользователей user_ids."""
+        self.deliver(user_ids, event)
+
+    def deliver(self, user_ids, event):
+        with self.lock:
+            subscriptions = [item for user_id in user_ids for item in self.subscribers.get(user_id, ())]
+        if subscriptions:
+            # Событие сериализуется один раз для всех потоков
+            Subscription.push(subscriptions, format_event(event))
+
+
+class SocketBroker(InProcessBroker):
+    """
+    Брокер для нескольких процессов на одной машине. Процесс с подписчиками слушает свой Unix-сокет
+    ADS_EVENTS_SOCKET_DIR/<pid>.sock, публикация отправляет дейтаграмму в каждый сокет каталога, сокеты
+    завершившихся процессов удаляются при публикации.
+    """
+
+    def __init__(self, directory=None):
+        super().__init__()
+        self.directory = Path(directory or settings.ADS_EVENTS_SOCKET_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        # Переполненный сокет медленного процесса не должен останавливать публикующий запрос
+        self.sender.setblocking(False)
+        self.receiver = None
+
+    @property
+    def path(self):
+        return self.directory / f"{os.getpid()}.sock"
+
+    def subscribe(self, user_id):
+        self.listen()
+        return super().subscribe(user_id)
+
+    def listen(self):
+        """Открывает сокет процесса при первой подписке; дейтаграммы читает фоновый поток."""
+        with self.lock:
+            if self.receiver is not None:
+                return
+            self.path.unlink(missing_ok=True)
+            self.receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self.receiver.bind(str(self.path))
+            atexit.register(self.path.unlink, missing_ok=True)
+        threading.Thread(target=self.receive, args=(self.receiver,), name="ads-events", daemon=True).start()
+
+    def receive(self, receiver):
+        while True:
+            try:
+                message = json.loads(receiver.recv(MAX_DATAGRAM))
+            except OSError:
+                return
+            except ValueError:
+                logger.warning("Некорректное сообщение в сокете событий %s", self.path)
+                continue
+            self.deliver(message["users"], message["event"])
+
+    def publish(self, user_ids, event):
+        data = json.dumps({"users": list(user_ids), "event": event}).encode()
+        for path in self.directory.glob("*.sock"):
+            try:
+                self.sender.sendto(data, str(path))
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Процесс завершился, не удалив сокет
+                path.unlink(missing_ok=True)
+            except OSError as error:
+                logger.warning("Событие не доставлено в %s: %s", path, error)
+
+
+@functools.cache
+def get_event_broker():
+    return import_string(settings.ADS_EVENTS_BROKER)()
+
+
+def publish_proposal_event(action, proposal_id, status, user_ids):
+    """
+    Публикует событие предложения его участникам после фиксации транзакции: action - created, updated или
+    deleted, status - статус предложения после изменения.
+    """
+    user_ids = sorted({user_id for user_id in user_ids if user_id is not None})
+    if not user_ids:
+        return
+    event = {"type": "proposal", "action": action, "id": proposal_id, "status": status, "time": time.time()}
+    transaction.on_commit(lambda: get_event_broker().publish(user_ids, event), robust=True)
+
+
+def format_event(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n".encode()
+
+
+class EventStreamApplication:
+    """
+    ASGI-приложение перед Django: GET на адрес ads:proposal-events открывает поток событий пользователя сессии,
+    остальные запросы передаются application.
+    """
+
+    def __init__(self, application):
+        self.application = application
+
+    @functools.cached_property
+    def path(self):
+        return reverse("ads:proposal-events")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"] == self.path and scope["method"] == "GET":
+            await self.stream(scope, receive, send)
+        else:
+            await self.application(scope, receive, send)
+
+    async def authenticate(self, scope):
+        """
+        Идентификатор пользователя сессии из cookie или None; сессия и пользователь обычно берутся из кэша.
+        Поток хранит только идентификатор, а не объекты запроса и пользователя.
+        """
+        request = ASGIRequest(scope, None)
+        try:
+            request.get_host()
+        except DisallowedHost:
+            return None
+        cookies = SimpleCookie(request.META.get("HTTP_COOKIE", ""))
+        session_key = cookies[settings.SESSION_COOKIE_NAME].value if settings.SESSION_COOKIE_NAME in cookies else None
+        request.session = import_module(settings.SESSION_ENGINE).SessionStore(session_key)
+        try:
+            user = await auth.aget_user(request)
+        finally:
+            # Поток открыт долго, поэтому подключение к базе, открытое при промахе кэша, закрывается сразу
+            await sync_to_async(close_old_connections)()
+        return user.pk if user.is_authenticated else None
+
+    async def stream(self, scope, receive, send):
+        user_id = await self.authenticate(scope)
+        if user_id is None:
+            await send({"type": "http.response.start", "status": 403, "headers": [(b"content-type", b"text/plain")]})
+            await send({"type": "http.response.body", "body": b""})
+            return
+
+        broker = get_event_broker()
+        subscription = broker.subscribe(user_id)
+        watcher = asyncio.ensure_future(self.wait_for_disconnect(receive, subscription))
+        try:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 200,
+                    "headers": [
+                        (b"content-type", b"text/event-stream; charset=utf-8"),
+                        (b"cache-control", b"no-cache"),
+                        # nginx не должен буферизовать поток
+                        (b"x-accel-buffering", b"no"),
+                    ],
+                }
+            )
+            await send(
+                {
+                    "type": "http.response.body",
+                    "body": f"retry: {settings.ADS_EVENTS_RETRY_MS}\n\n".encode(),
+                    "more_body": True,
+                }
+            )
+            while True:
+                message = await subscription.get(settings.ADS_EVENTS_HEARTBEAT)
+                if message is Subscription.CLOSED:
+                    break
+                # Комментарий раз в ADS_EVENTS_HEARTBEAT секунд не даёт прокси закрыть простаивающее соединение
+                body = b": ping\n\n" if message is None else message
+                await send({"type": "http.response.body", "body": body, "more_body": True})
+        except OSError:
+            # Клиент отключился во время отправки
+            pass
+        finally:
+            watcher.cancel()
+            broker.unsubscribe(subscription)
+
+    @staticmethod
+    async def wait_for_disconnect(receive, subscription):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        subscription.close()
@@ -1,23 +1,49 @@
 from django import forms
 
-from .models import Ad, ExchangeProposal
+from .models import Ad, Category, ExchangeProposal
+from .widgets import AutocompleteSelect
 
 
 class AdForm(forms.ModelForm):
+    # Категория вводится текстом, как раньше, и сопоставляется с Category без учёта регистра при сохранении,
+    # поэтому в Meta.fields её нет: модель не проверяет категорию, которой ещё нет в базе
+    category = forms.CharField(max_length=20, label="Категория")
+    field_order = ["title", "description", "image_url", "category", "condition"]
+
     class Meta:
         model = Ad
-        fields = ["title", "description", "image_url", "category", "condition"]
+        fields = ["title", "description", "image_url", "condition"]
 
     def __init__(self, *args, **kwargs):
         super(AdForm, self).__init__(*args, **kwargs)
         for field in self.fields.values():
             field.widget.attrs.update({"class": "form-control"})
 
+        if self.instance.category_id:
+            self.initial["category"] = self.instance.category.name
+
+    def clean_category(self):
+        # Только нормализация: категория создаётся в save(), а не у формы с ошибками в других полях
+        return " ".join(self.cleaned_data["category"].split())
+
+    def save(self, commit=True):
+        self.instance.category = Category.objects.get_for_name(self.cleaned_data["category"])
+        ad = super().save(commit)
+        # Копии изображения создаются один раз при загрузке, а не при каждом показе страницы
+        if commit and "image_url" in self.changed_data:
+            ad.refresh_image_variants()
+        return ad
+
 
 class ExchangeProposalForm(forms.ModelForm):
     class Meta:
         model = ExchangeProposal
         fields = ["ad_sender", "ad_receiver", "comment"]
+        # Товары выбираются подсказками, а не списком всех товаров на странице
+        widgets = {
+            "ad_sender": AutocompleteSelect("own", forward="ad_receiver"),
+            "ad_receiver": AutocompleteSelect("others"),
+        }
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user", None)
@@ -36,6 +62,7 @@ class ExchangeProposalUpdateForm(forms.ModelForm):
     class Meta:
         model = ExchangeProposal
         fields = ["ad_sender", "comment"]
+        widgets = {"ad_sender": AutocompleteSelect("own")}
 
     def __init__(self, *args, **kwargs):
         user = kwargs.pop("user", None)
@@ -47,3 +74,5 @@ class ExchangeProposalUpdateForm(forms.ModelForm):
         if user:
             # Предложить можно только свой товар
             self.fields["ad_sender"].queryset = Ad.objects.filter(user=user)
+        # Свои товары в подсказках ранжируются по товару, который запрошен в предложении
+        self.fields["ad_sender"].widget.attrs["data-autocomplete-receiver"] = self.instance.ad_receiver_id
@@ -0,0 +1,75 @@
+import base64
+import posixpath
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageFilter, ImageOps
+
+# Ширины уменьшенных копий: карточка в списке занимает до ~360px, с запасом под экраны с высокой плотностью
+VARIANT_WIDTHS = (320, 640, 960)
+VARIANT_FORMATS = {
+    "webp": ("WEBP", {"quality": 80, "method": 4}),
+    "jpeg": ("JPEG", {"quality": 82, "optimize": True, "progressive": True}),
+}
+VARIANTS_DIR = "variants"
+PLACEHOLDER_WIDTH = 16
+
+
+def variant_name(name, width, extension):
+    """ads/photo.jpg -> ads/variants/photo-jpg-320.webp"""
+    directory, filename = posixpath.split(name)
+    stem, source_extension = posixpath.splitext(filename)
+    # Расширение исходного файла входит в имя, чтобы копии photo.jpg и photo.png не совпадали
+    if source_extension:
+        stem = f"{stem}-{source_extension[1:]}"
+    return posixpath.join(directory, VARIANTS_DIR, f"{stem}-{width}.{extension}")
+
+
+def encode(image, extension):
+    image_format, options = VARIANT_FORMATS[extension]
+    buffer = BytesIO()
+    image.save(buffer, image_format, **options)
+    return buffer.getvalue()
+
+
+def make_placeholder(image):
+    """Крошечная размытая копия в виде data URI, которая показывается до загрузки изображения."""
+    height = max(1, round(image.height * PLACEHOLDER_WIDTH / image.width))
+    tiny = image.resize((PLACEHOLDER_WIDTH, height), Image.Resampling.BILINEAR).filter(ImageFilter.GaussianBlur(1))
+    buffer = BytesIO()
+    tiny.save(buffer, "JPEG", quality=40)
+    return "data:image/jpeg;base64," + base64.b64encode(buffer.getvalue()).decode()
+
+
+def build_variants(name, storage=default_storage):
+    """
+    Создаёт уменьшенные копии изображения name во всех форматах VARIANT_FORMATS.
+
+    Возвращает описание для Ad.image_variants: {"sources": {формат: [[ширина, имя файла], ...]}, "placeholder": ...}.
+    Изображение не увеличивается: если оно уже исходных ширин, создаётся одна копия исходного размера.
+    Файлы прежних копий не удаляются, см. delete_variants.
+    """
+    with storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image = image.convert("RGB")
+
+    widths = [width for width in VARIANT_WIDTHS if width < image.width] or [image.width]
+    sources = {extension: [] for extension in VARIANT_FORMATS}
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.Resampling.LANCZOS)
+        for extension in VARIANT_FORMATS:
+            # Занятое имя не перезаписывается: хранилище выбирает свободное, а прежние копии удаляет вызывающий код
+            variant = storage.save(variant_name(name, width, extension), ContentFile(encode(resized, extension)))
+            sources[extension].append([width, variant])
+
+    return {"sources": sources, "placeholder": make_placeholder(image)}
+
+
+def delete_variants(variants, exclude=(), storage=default_storage):
+    """Удаляет файлы копий, описанные в Ad.image_variants, кроме имён из exclude."""
+    for files in variants.get("sources", {}).values():
+        for _, name in files:
+            if name not in exclude:
+                storage.delete(name)
@@ -0,0 +1,143 @@
+import csv
+import json
+from itertools import islice
+from pathlib import PurePosixPath
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.utils import validate_file_name
+
+from .models import Ad, Category
+
+FORMATS = {".json": "json", ".ndjson": "ndjson", ".jsonl": "ndjson", ".csv": "csv"}
+CONDITIONS = {value for value, _ in Ad.CONDITION_CHOICES}
+CHUNK_SIZE = 1 << 16
+
+
+def detect_format(path):
+    return FORMATS.get(PurePosixPath(str(path)).suffix.lower())
+
+
+def iter_json(file, chunk_size=CHUNK_SIZE):
+    """
+    Читает JSON-массив по одному элементу, не загружая файл целиком.
+
+    Подходит как для списка товаров, так и для фикстуры Django вида [{"model": ..., "fields": ...}, ...].
+    """
+    decoder = json.JSONDecoder()
+    buffer = file.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        raise ValueError("Ожидается JSON-массив")
+    position = 1
+    while True:
+        # Пропускаем пробелы и запятые между элементами
+        while True:
+            length = len(buffer)
+            while position < length and buffer[position] in " \t\r\n,":
+                position += 1
+            if position < length:
+                break
+            buffer, position = file.read(chunk_size), 0
+            if not buffer:
+                raise ValueError("Неожиданный конец JSON-массива")
+
+        if buffer[position] == "]":
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # Элемент не поместился в буфер: дочитываем следующий блок
+            chunk = file.read(chunk_size)
+            if not chunk:
+                raise
+            buffer, position = buffer[position:] + chunk, 0
+            continue
+        yield item
+        position = end
+
+
+def iter_ndjson(file):
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_rows(file, file_format):
+    """Возвращает пары (номер записи, поля товара) для файла в формате json, ndjson или csv."""
+    if file_format == "csv":
+        rows = csv.DictReader(file)
+    elif file_format == "ndjson":
+        rows = iter_ndjson(file)
+    else:
+        rows = iter_json(file)
+
+    for number, row in enumerate(rows, 1):
+        if isinstance(row, dict) and "model" in row:
+            # Записи фикстуры других моделей пропускаются
+            if row["model"] != "ads.ad":
+                continue
+            row = row["fields"]
+        yield number, row
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def get_category_name(value):
+    # В фикстурах категория указана натуральным ключом ["Название"]
+    return str(value[0] if isinstance(value, list) and value else value)
+
+
+class CategoryCache:
+    """Категории по нормализованному названию; их немного, поэтому они хранятся в памяти весь импорт."""
+
+    def __init__(self):
+        self.categories = {category.key: category.pk for category in Category.objects.all()}
+
+    def get_id(self, name):
+        key = Category.normalize(name)
+        if key not in self.categories:
+            self.categories[key] = Category.objects.get_for_name(name).pk
+        return self.categories[key]
+
+
+def clean_row(row, categories):
+    """Проверяет поля записи и возвращает аргументы для Ad; ошибки сообщаются через ValueError."""
+    if not isinstance(row, dict):
+        raise ValueError("запись должна быть объектом")
+    title = (row.get("title") or "").strip()
+    description = (row.get("description") or "").strip()
+    category = get_category_name(row.get("category") or "").strip()
+    condition = row.get("condition") or ""
+    user = row.get("user")
+    image_url = row.get("image_url") or ""
+
+    if not title or len(title) > Ad._meta.get_field("title").max_length:
+        raise ValueError("некорректное название")
+    if not description:
+        raise ValueError("пустое описание")
+    if not category or len(category) > Category._meta.get_field("name").max_length:
+        raise ValueError("некорректная категория")
+    if condition not in CONDITIONS:
+        raise ValueError(f"неизвестное состояние {condition!r}")
+    if user in (None, ""):
+        raise ValueError("не указан пользователь")
+    if not isinstance(image_url, str) or len(image_url) > Ad._meta.get_field("image_url").max_length:
+        raise ValueError("некорректное изображение")
+    try:
+        # Путь изображения - относительный путь внутри хранилища, без ".." и абсолютных путей
+        if image_url:
+            validate_file_name(image_url, allow_relative_path=True)
+    except SuspiciousFileOperation:
+        raise ValueError(f"недопустимый путь изображения {image_url!r}")
+
+    return {
+        "title": title,
+        "description": description,
+        "image_url": image_url,
+        "category_id": categories.get_id(category),
+        "condition": condition,
+        "user": str(user),
+    }
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from ads.archiving import archive_cutoff, archive_resolved_proposals
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит принятые и отклонённые предложения старше --days дней в архив пачками, каждая пачка - отдельная "
+        "короткая транзакция. Прерванный перенос продолжается с последнего выведенного ключа (--after)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--days", type=int, default=settings.ADS_ARCHIVE_AFTER_DAYS, help="Возраст предложений в днях"
+        )
+        parser.add_argument(
+            "--batch-size", type=int, default=settings.ADS_ARCHIVE_BATCH_SIZE, help="Число предложений в пачке"
+        )
+        parser.add_argument("--max-batches", type=int, help="Сколько пачек перенести за запуск, по умолчанию все")
+        parser.add_argument("--sleep", type=float, default=0, help="Пауза между пачками в секундах")
+        parser.add_argument("--after", type=int, default=0, help="Начать с предложений с ключом больше этого")
+
+    def handle(self, *args, **options):
+        cutoff = archive_cutoff(options["days"])
+        self.stdout.write(f"перенос предложений, созданных до {cutoff:%d.%m.%Y}")
+
+        def progress(last, moved):
+            self.stdout.write(f"перенесено {moved}, последний ключ {last}")
+
+        last, total = archive_resolved_proposals(
+            cutoff,
+            after=options["after"],
+            batch_size=options["batch_size"],
+            max_batches=options["max_batches"],
+            pause=options["sleep"],
+            progress=progress if options["verbosity"] > 1 else None,
+        )
+        self.stdout.write(f"всего перенесено: {total}, последний ключ: {last}")
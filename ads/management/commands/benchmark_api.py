@@ -0,0 +1,77 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ads.benchmarking import rollback_after, seed_replay_data
+from ads.ranking import get_ranking_engine
+from ads.replay import Replayer
+from ads.search import get_search_backend
+
+API = {"version": "v1"}
+# Пары "HTML-страница - те же данные через API": страницы списков содержат по 15 объектов
+PAIRS = [
+    (
+        "список товаров",
+        {"route": "ads:ad-list"},
+        {"route": "api:ad-list", "kwargs": API, "query": {"limit": 15}},
+    ),
+    (
+        "список товаров, 3 поля",
+        {"route": "ads:ad-list"},
+        {"route": "api:ad-list", "kwargs": API, "query": {"limit": 15, "fields": "id,title,category"}},
+    ),
+    (
+        "товар",
+        {"route": "ads:ad-detail", "args": ["ad"]},
+        {"route": "api:ad-detail", "kwargs": {**API, "pk": "ad"}},
+    ),
+    (
+        "отправленные предложения",
+        {"route": "ads:sent-exchange-list"},
+        {"route": "api:proposal-list", "kwargs": API, "query": {"limit": 15, "box": "sent"}},
+    ),
+    (
+        "предложение",
+        {"route": "ads:exchange-detail", "args": ["sent_proposal"]},
+        {"route": "api:proposal-detail", "kwargs": {**API, "pk": "sent_proposal"}},
+    ),
+]
+
+
+class Command(BaseCommand):
+    help = "Сравнивает размер ответа, время и число SQL-запросов HTML-страниц и JSON API на одних данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=10_000, help="Число товаров в базе")
+        parser.add_argument("--proposals", type=int, default=1_000, help="Число предложений в каждую сторону")
+        parser.add_argument("--passes", type=int, default=50, help="Сколько раз запросить каждую страницу")
+
+    def handle(self, *args, **options):
+        # Метка пары входит в ключ замера, чтобы запросы к одному маршруту с разными параметрами не смешивались
+        pairs = [(label, [dict(entry, label=label, user="member") for entry in entries]) for label, *entries in PAIRS]
+        stream = [entry for _, entries in pairs for entry in entries]
+
+        with rollback_after(), override_settings(ALLOWED_HOSTS=["testserver"], METRICS_SLOW_REQUEST_MS=sys.maxsize):
+            users, objects = seed_replay_data(options["size"], options["proposals"])
+            get_search_backend().rebuild()
+            get_ranking_engine().rebuild()
+
+            Replayer(users, objects).replay(stream)
+            replayer = Replayer(users, objects)
+            replayer.replay(stream, options["passes"])
+            routes = replayer.report()
+
+        get_search_backend().rebuild()
+        get_ranking_engine().rebuild()
+
+        self.stdout.write(
+            f"{'страница':<28} {'HTML, байт':>11} {'API, байт':>10} {'HTML p50':>9} {'API p50':>8} "
+            f"{'SQL HTML':>9} {'SQL API':>8}"
+        )
+        for label, entries in pairs:
+            html, api = (routes[Replayer.sample_key(entry)] for entry in entries)
+            self.stdout.write(
+                f"{label:<28} {html['bytes']:>11} {api['bytes']:>10} {html['p50_ms']:>9.2f} {api['p50_ms']:>8.2f} "
+                f"{html['queries']:>9.1f} {api['queries']:>8.1f}"
+            )
@@ -0,0 +1,59 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from ads.benchmarking import rollback_after, seed_barter_graph
+from ads.cycles import MAX_CYCLE_LENGTH, CycleEngine, get_cycle_engine
+from users.models import User
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+
+class Command(BaseCommand):
+    help = "Измеряет построение графа предложений и поиск циклов обмена на синтетических данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--proposals-per-user", type=int, default=10)
+        parser.add_argument("--samples", type=int, default=200, help="Число пользователей для замера поиска")
+        parser.add_argument("--max-length", type=int, default=MAX_CYCLE_LENGTH)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'предложений':>12} {'граф, мс':>10} {'поиск p50':>10} {'поиск p95':>10} "
+            f"{'с БД p50':>10} {'циклов':>7}"
+        )
+        for size in options["sizes"]:
+            # Каждый размер заполняется в своей транзакции, которая откатывается после замеров
+            with rollback_after():
+                users = seed_barter_graph(max(size // options["proposals_per_user"], 2), size, seed=size)
+                engine = CycleEngine()
+                build, graph = timed(engine._get_graph)
+
+                sample = random.Random(0).sample(users, min(options["samples"], len(users)))
+                search = []
+                found = []
+                for user in sample:
+                    elapsed, cycles = timed(lambda: graph.find_cycles(user, options["max_length"]))
+                    search.append(elapsed)
+                    found.append(len(cycles))
+
+                # Полный ответ с загрузкой предложений из базы
+                suggest = [
+                    timed(lambda: engine.suggest(User(pk=user), options["max_length"]))[0] for user in sample[:50]
+                ]
+
+            search.sort()
+            p95 = search[int(len(search) * 0.95) - 1] if len(search) > 1 else search[0]
+            self.stdout.write(
+                f"{size:>12} {build:>10.0f} {statistics.median(search):>10.2f} {p95:>10.2f} "
+                f"{statistics.median(suggest):>10.2f} {statistics.mean(found):>7.1f}"
+            )
+
+        get_cycle_engine().rebuild()
@@ -0,0 +1,168 @@
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from ads.events import SocketBroker
+from ads.replay import percentile
+from users.models import User
+
+from .benchmark_servers import RunningServer, free_port
+
+
+def worker_pids(pid):
+    """Процессы gunicorn, обслуживающие запросы: дочерние процессы главного."""
+    return [int(child) for child in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+
+
+def process_status(pids):
+    """Суммарные резидентная память в КБ и число потоков процессов из /proc."""
+    memory = threads = 0
+    for pid in pids:
+        for line in Path(f"/proc/{pid}/status").read_text().splitlines():
+            name, _, value = line.partition(":")
+            if name == "VmRSS":
+                memory += int(value.split()[0])
+            elif name == "Threads":
+                threads += int(value)
+    return memory, threads
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест потока событий предложений под ASGI (gunicorn с процессами uvicorn, брокер SocketBroker): "
+        "память и потоки на открытое соединение и задержка доставки событий p50/p95/p99 во все соединения. "
+        "Каждое соединение занимает файловый дескриптор в тесте и на сервере, см. ulimit -n"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--connections", type=int, default=2_000, help="Число открытых потоков событий")
+        parser.add_argument("--events", type=int, default=50, help="Число опубликованных событий")
+        parser.add_argument("--interval", type=float, default=0.1, help="Пауза между событиями в секундах")
+        parser.add_argument("--workers", type=int, default=2, help="Число процессов сервера")
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError("Для нагрузочного теста нужны пакеты из группы dev: httpx, gunicorn, uvicorn-worker")
+
+        # Сервер работает в отдельном процессе, поэтому пользователь сохраняется в базе и удаляется после замеров
+        user = User.objects.create_user(username=f"benchmark-events-{os.getpid()}")
+        directory = tempfile.mkdtemp(prefix="barter-events-")
+        try:
+            client = Client()
+            client.force_login(user)
+            cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+            port = free_port()
+            command = [
+                "gunicorn",
+                "config.asgi:application",
+                "--worker-class=uvicorn_worker.UvicornWorker",
+                f"--bind=127.0.0.1:{port}",
+                f"--workers={options['workers']}",
+                "--log-level=warning",
+            ]
+            env = dict(
+                os.environ,
+                DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+                ALLOWED_HOSTS="127.0.0.1",
+                METRICS_SLOW_REQUEST_MS=str(sys.maxsize),
+                ADS_EVENTS_BROKER="ads.events.SocketBroker",
+                ADS_EVENTS_SOCKET_DIR=directory,
+            )
+            server = RunningServer([sys.executable, "-m", *command], env, f"http://127.0.0.1:{port}", httpx)
+            with server:
+                result = asyncio.run(self.load(server, port, cookie, user.pk, directory, options))
+        finally:
+            user.delete()
+            shutil.rmtree(directory, ignore_errors=True)
+
+        connections = options["connections"]
+        self.stdout.write(f"процессов сервера:        {options['workers']}")
+        self.stdout.write(f"открыто потоков:          {result['opened']} из {connections}")
+        self.stdout.write(f"память процессов, КБ:     {result['memory_before']} -> {result['memory_after']}")
+        self.stdout.write(f"память на поток, КБ:      {result['memory_per_stream']:.1f}")
+        self.stdout.write(f"потоков ОС:               {result['threads_before']} -> {result['threads_after']}")
+        self.stdout.write(f"доставлено событий:       {result['delivered']} из {result['expected']}")
+        self.stdout.write(
+            f"задержка доставки, мс:    p50 {result['p50_ms']:.2f}  p95 {result['p95_ms']:.2f}  "
+            f"p99 {result['p99_ms']:.2f}"
+        )
+
+    async def load(self, server, port, cookie, user_id, directory, options):
+        pids = worker_pids(server.process.pid)
+        memory_before, threads_before = process_status(pids)
+        request = (
+            f"GET {reverse('ads:proposal-events')} HTTP/1.1\r\nHost: 127.0.0.1\r\nCookie: {cookie}\r\n"
+            "Accept: text/event-stream\r\n\r\n"
+        ).encode()
+
+        async def connect():
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            writer.write(request)
+            headers = await reader.readuntil(b"\r\n\r\n")
+            if b" 200 " not in headers.split(b"\r\n", 1)[0]:
+                raise CommandError(f"Поток событий не открылся: {headers.decode(errors='replace')}")
+            # Первое сообщение потока - интервал переподключения: после него соединение подписано
+            await reader.readuntil(b"retry: ")
+            return reader, writer
+
+        streams = []
+        # Соединения открываются пачками, чтобы не переполнить очередь принятия соединений сервера
+        for start in range(0, options["connections"], 200):
+            batch = min(200, options["connections"] - start)
+            streams += await asyncio.gather(*(connect() for _ in range(batch)))
+        await asyncio.sleep(1)
+        memory_after, threads_after = process_status(pids)
+
+        latencies = []
+
+        async def read_events(reader):
+            # Ответ передаётся частями (chunked), поэтому события ищутся по строкам data:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    return
+                if line.startswith(b"data: "):
+                    latencies.append((time.time() - json.loads(line[6:])["time"]) * 1000)
+
+        readers = [asyncio.ensure_future(read_events(reader)) for reader, _ in streams]
+        broker = SocketBroker(directory)
+        for number in range(options["events"]):
+            broker.publish([user_id], {"type": "proposal", "action": "benchmark", "id": number, "time": time.time()})
+            await asyncio.sleep(options["interval"])
+        # Доставка ждётся, пока приходят новые события
+        expected = len(streams) * options["events"]
+        delivered = -1
+        while delivered < len(latencies) < expected:
+            delivered = len(latencies)
+            await asyncio.sleep(2)
+
+        for task in readers:
+            task.cancel()
+        for _, writer in streams:
+            writer.close()
+
+        return {
+            "opened": len(streams),
+            "memory_before": memory_before,
+            "memory_after": memory_after,
+            "memory_per_stream": (memory_after - memory_before) / max(len(streams), 1),
+            "threads_before": threads_before,
+            "threads_after": threads_after,
+            "delivered": len(latencies),
+            "expected": expected,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        }
@@ -0,0 +1,63 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from ads.benchmarking import rollback_after, seed_barter_graph
+from ads.models import Ad
+from ads.ranking import RankingEngine, get_ranking_engine
+from ads.replay import percentile
+
+
+def timed(func):
+    started = time.perf_counter()
+    result = func()
+    return (time.perf_counter() - started) * 1000, result
+
+
+class Command(BaseCommand):
+    help = "Измеряет построение матриц признаков и подбор пар для обмена на синтетических данных"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000], help="Число товаров")
+        parser.add_argument("--ads-per-user", type=int, default=5)
+        parser.add_argument("--samples", type=int, default=200, help="Число пользователей для замера подбора")
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'товаров':>10} {'матрицы, мс':>12} {'доли, мс':>9} {'пары p50':>9} {'пары p95':>9} "
+            f"{'свои p50':>9} {'обновление':>11}"
+        )
+        per_user = options["ads_per_user"]
+        for size in options["sizes"]:
+            # Каждый размер заполняется в своей транзакции, которая откатывается после замеров
+            with rollback_after():
+                users = seed_barter_graph(
+                    max(size // per_user, 2),
+                    size,
+                    seed=size,
+                    ads_per_user=per_user,
+                    statuses=("waiting", "accepted", "declined"),
+                )
+                engine = RankingEngine()
+                build, _ = timed(engine._get_features)
+                stats, _ = timed(engine._get_stats)
+
+                rng = random.Random(0)
+                sample = rng.sample(users, min(options["samples"], len(users)))
+                suggest = [timed(lambda: engine.suggest(user))[0] for user in sample]
+                requested = list(engine.features.rows)
+                offers = [timed(lambda: engine.rank_offers(user, rng.choice(requested)))[0] for user in sample]
+
+                ads = list(Ad.objects.filter(pk__in=rng.sample(requested, min(100, len(requested)))))
+                started = time.perf_counter()
+                for ad in ads:
+                    engine.update_ad(ad)
+                update = (time.perf_counter() - started) * 1000 / len(ads)
+
+            self.stdout.write(
+                f"{size:>10} {build:>12.0f} {stats:>9.0f} {percentile(suggest, 50):>9.2f} "
+                f"{percentile(suggest, 95):>9.2f} {percentile(offers, 50):>9.2f} {update:>11.3f}"
+            )
+
+        get_ranking_engine().rebuild()
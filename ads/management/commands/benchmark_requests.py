@@ -0,0 +1,73 @@
+import json
+import sys
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from ads.benchmarking import rollback_after, seed_replay_data
+from ads.ranking import get_ranking_engine
+from ads.replay import DEFAULT_STREAM, Replayer, load_stream
+from ads.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Воспроизводит поток запросов ко всем маршрутам и измеряет время ответа и число SQL-запросов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=10_000, help="Число товаров в базе")
+        parser.add_argument("--proposals", type=int, default=1_000, help="Число предложений в каждую сторону")
+        parser.add_argument("--passes", type=int, default=20, help="Сколько раз воспроизвести поток")
+        parser.add_argument("--warmup", type=int, default=1, help="Проходы без замеров для прогрева кэшей")
+        parser.add_argument("--stream", help="NDJSON-файл с потоком запросов; по умолчанию ads.replay.DEFAULT_STREAM")
+        parser.add_argument("--output", help="Сохранить результаты в JSON для сравнения между коммитами")
+        parser.add_argument("--compare", help="JSON с прежними результатами, с которыми сравнить текущие")
+
+    def handle(self, *args, **options):
+        stream = load_stream(options["stream"]) if options["stream"] else DEFAULT_STREAM
+
+        # Все данные создаются в транзакции и откатываются после замеров; журнал медленных запросов
+        # не нужен, время ответа по маршрутам выводится в отчёте
+        with rollback_after(), override_settings(ALLOWED_HOSTS=["testserver"], METRICS_SLOW_REQUEST_MS=sys.maxsize):
+            users, objects = seed_replay_data(options["size"], options["proposals"])
+            get_search_backend().rebuild()
+            get_ranking_engine().rebuild()
+
+            Replayer(users, objects).replay(stream, options["warmup"])
+            replayer = Replayer(users, objects)
+            replayer.replay(stream, options["passes"])
+            routes = replayer.report()
+
+        get_search_backend().rebuild()
+        get_ranking_engine().rebuild()
+
+        results = {
+            "database": connection.vendor,
+            "size": options["size"],
+            "proposals": options["proposals"],
+            "passes": options["passes"],
+            "routes": routes,
+        }
+        self.print_report(routes)
+        if options["compare"]:
+            with open(options["compare"], encoding="utf-8") as file:
+                self.print_comparison(json.load(file)["routes"], routes)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as file:
+                json.dump(results, file, ensure_ascii=False, indent=2, sort_keys=True)
+
+    def print_report(self, routes):
+        self.stdout.write(f"{'маршрут':<52} {'p50':>8} {'p95':>8} {'p99':>8} {'rps':>8} {'SQL':>6} коды")
+        for key, route in routes.items():
+            statuses = ",".join(f"{code}x{count}" for code, count in route["statuses"].items())
+            self.stdout.write(
+                f"{key:<52} {route['p50_ms']:>8.2f} {route['p95_ms']:>8.2f} {route['p99_ms']:>8.2f} "
+                f"{route['rps']:>8.1f} {route['queries']:>6.1f} {statuses}"
+            )
+
+    def print_comparison(self, before, after):
+        self.stdout.write(f"\n{'маршрут':<52} {'p50 было':>10} {'p50 стало':>10} {'SQL было':>9} {'SQL стало':>10}")
+        for key in sorted(before.keys() & after.keys()):
+            old, new = before[key], after[key]
+            latency = f"{old['p50_ms']:>10.2f} {new['p50_ms']:>10.2f}"
+            self.stdout.write(f"{key:<52} {latency} {old['queries']:>9.1f} {new['queries']:>10.1f}")
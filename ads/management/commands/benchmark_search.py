@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from ads.benchmarking import measure, rollback_after, seed_ads
+from ads.models import Ad
+from ads.search import get_search_backend
+from users.models import User
+
+PAGE_SIZE = 15
+
+
+def legacy_search(query):
+    """Прежний поиск AdSearchView: ILIKE по названию и описанию."""
+    queryset = Ad.objects.filter(Q(title__icontains=query) | Q(description__icontains=query)).order_by("-created_at")
+    return queryset.count(), list(queryset[:PAGE_SIZE])
+
+
+def backend_search(query):
+    queryset = get_search_backend().search(Ad.objects.all(), query)
+    return queryset.count(), list(queryset[:PAGE_SIZE])
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время поиска ILIKE и поискового движка на синтетических объявлениях"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 100_000, 1_000_000])
+        parser.add_argument("--queries", nargs="+", default=["ноутбук", "кожаный диван", "гарантия", "фотоап"])
+        parser.add_argument("--repeat", type=int, default=5)
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        self.stdout.write(f"Движок: {backend.__class__.__name__}")
+        self.stdout.write(f"{'объявлений':>12} {'запрос':>16} {'ILIKE, мс':>12} {'движок, мс':>12} {'ускорение':>10}")
+
+        # Все данные создаются в транзакции и откатываются после замеров
+        with rollback_after():
+            user = User.objects.create_user(username="benchmark_search")
+            seeded = 0
+            for size in sorted(options["sizes"]):
+                seed_ads(user, size - seeded, seed=size)
+                seeded = size
+                backend.rebuild()
+                backend_search(options["queries"][0])  # прогрев индекса
+
+                for query in options["queries"]:
+                    before = measure(lambda: legacy_search(query), options["repeat"])
+                    after = measure(lambda: backend_search(query), options["repeat"])
+                    self.stdout.write(f"{size:>12} {query:>16} {before:>12.2f} {after:>12.2f} {before / after:>9.1f}x")
+
+        backend.rebuild()
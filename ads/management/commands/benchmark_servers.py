@@ -0,0 +1,202 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+
+from ads.benchmarking import seed_replay_data
+from ads.replay import percentile
+from users.models import User
+
+# Режимы запуска: приложение, класс процесса gunicorn и значение ADS_ASYNC_VIEWS. Все режимы запускаются
+# gunicorn с одним числом процессов, ASGI - в процессах uvicorn; asgi-sync - синхронные представления под ASGI,
+# чтобы отделить выигрыш асинхронных представлений от разницы между серверами
+MODES = {
+    "wsgi": ("config.wsgi:application", "gthread", ""),
+    "asgi-sync": ("config.asgi:application", "uvicorn_worker.UvicornWorker", ""),
+    "asgi": ("config.asgi:application", "uvicorn_worker.UvicornWorker", "all"),
+}
+# Настройки подключений к базе для сервера: current - как в окружении, new - подключение на каждый запрос,
+# persistent - постоянные подключения, pool - пул psycopg
+CONNECTIONS = {
+    "current": {},
+    "new": {"DB_POOL": "False", "DB_CONN_MAX_AGE": "0"},
+    "persistent": {"DB_POOL": "False", "DB_CONN_MAX_AGE": "600"},
+    "pool": {"DB_POOL": "True"},
+}
+
+
+def parse_choices(value, choices):
+    names = [name.strip() for name in value.split(",") if name.strip()]
+    unknown = set(names) - set(choices)
+    if unknown:
+        raise CommandError(f"Неизвестные значения: {', '.join(sorted(unknown))}")
+    return names
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест страниц для чтения под WSGI и ASGI (gunicorn с процессами uvicorn): пропускная способность "
+        "и задержки p50/p95/p99 при разном числе одновременных запросов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=2_000, help="Число товаров в базе")
+        parser.add_argument("--proposals", type=int, default=200, help="Число предложений в каждую сторону")
+        parser.add_argument("--requests", type=int, default=500, help="Число запросов на каждый уровень нагрузки")
+        parser.add_argument("--concurrency", default="1,10,50", help="Числа одновременных клиентов через запятую")
+        parser.add_argument("--workers", type=int, default=2, help="Число процессов сервера")
+        parser.add_argument("--threads", type=int, default=4, help="Число потоков процесса WSGI")
+        parser.add_argument("--modes", default=",".join(MODES), help="Режимы через запятую: " + ", ".join(MODES))
+        parser.add_argument(
+            "--connections",
+            default="current",
+            help="Подключения к базе через запятую: " + ", ".join(CONNECTIONS),
+        )
+
+    def handle(self, *args, **options):
+        try:
+            import httpx
+        except ImportError:
+            raise CommandError("Для нагрузочного теста нужны пакеты из группы dev: httpx, gunicorn, uvicorn-worker")
+        modes = parse_choices(options["modes"], MODES)
+        profiles = parse_choices(options["connections"], CONNECTIONS)
+        levels = [int(level) for level in options["concurrency"].split(",")]
+
+        # Серверы работают в отдельных процессах, поэтому данные сохраняются в базе и удаляются после замеров
+        users, objects = seed_replay_data(options["size"], options["proposals"])
+        try:
+            client = Client()
+            client.force_login(users["member"])
+            cookies = {settings.SESSION_COOKIE_NAME: client.cookies[settings.SESSION_COOKIE_NAME].value}
+            urls = [
+                reverse("ads:ad-list"),
+                reverse("ads:ad-list") + "?page=2",
+                reverse("ads:not-user-ad-list"),
+                reverse("ads:search") + "?search=ноутбук",
+                reverse("ads:ad-detail", args=[objects["ad"]]),
+            ]
+
+            self.stdout.write(
+                f"{'режим':<10} {'подключения':<12} {'клиентов':>8} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} "
+                f"{'ошибки':>7}"
+            )
+            for mode in modes:
+                for profile in profiles:
+                    with self.serve(httpx, mode, profile, options) as base_url:
+                        for level in levels:
+                            result = asyncio.run(self.load(httpx, base_url, cookies, urls, level, options["requests"]))
+                            self.stdout.write(
+                                f"{mode:<10} {profile:<12} {level:>8} {result['rps']:>8.1f} "
+                                f"{result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {result['p99_ms']:>8.2f} "
+                                f"{result['errors']:>7}"
+                            )
+        finally:
+            User.objects.filter(pk__in=[users["member"].pk, users["other"].pk]).delete()
+
+    def serve(self, httpx, mode, profile, options):
+        application, worker_class, async_views = MODES[mode]
+        port = free_port()
+        command = [
+            "gunicorn",
+            application,
+            f"--worker-class={worker_class}",
+            f"--bind=127.0.0.1:{port}",
+            f"--workers={options['workers']}",
+            f"--threads={options['threads']}",
+            "--log-level=warning",
+        ]
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE,
+            ADS_ASYNC_VIEWS=async_views,
+            ALLOWED_HOSTS="127.0.0.1",
+            METRICS_SLOW_REQUEST_MS=str(sys.maxsize),
+            **CONNECTIONS[profile],
+        )
+        return RunningServer([sys.executable, "-m", *command], env, f"http://127.0.0.1:{port}", httpx)
+
+    async def load(self, httpx, base_url, cookies, urls, concurrency, total):
+        """Выполняет total запросов по кругу по urls, не больше concurrency одновременно."""
+        latencies = []
+        errors = 0
+        numbers = iter(range(total))
+        limits = httpx.Limits(max_connections=concurrency)
+
+        async with httpx.AsyncClient(base_url=base_url, cookies=cookies, limits=limits, timeout=60) as client:
+
+            async def worker():
+                nonlocal errors
+                for number in numbers:
+                    started = time.perf_counter()
+                    try:
+                        response = await client.get(urls[number % len(urls)])
+                        errors += response.status_code != 200
+                    except httpx.HTTPError:
+                        errors += 1
+                    latencies.append((time.perf_counter() - started) * 1000)
+
+            started = time.perf_counter()
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+            elapsed = time.perf_counter() - started
+
+        return {
+            "rps": total / elapsed,
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+            "errors": errors,
+        }
+
+
+class RunningServer:
+    """Запускает сервер в отдельном процессе на время блока with и ждёт, пока он начнёт отвечать."""
+
+    def __init__(self, command, env, base_url, httpx, timeout=30):
+        self.command = command
+        self.env = env
+        self.base_url = base_url
+        self.httpx = httpx
+        self.timeout = timeout
+
+    def __enter__(self):
+        # Вывод сервера пишется в файл: заполненный канал остановил бы процесс сервера
+        self.log = tempfile.TemporaryFile("w+")
+        self.process = subprocess.Popen(self.command, env=self.env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + self.timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                self.log.seek(0)
+                raise CommandError(f"Сервер {self.command[3]} завершился:\n{self.log.read()}")
+            try:
+                self.httpx.get(self.base_url + reverse("ads:ad-list"), timeout=1)
+                return self.base_url
+            except self.httpx.TransportError:
+                time.sleep(0.2)
+        self.stop()
+        raise CommandError(f"Сервер {self.command[3]} не ответил за {self.timeout} с")
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        self.log.close()
@@ -0,0 +1,64 @@
+import sys
+
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from ads.benchmarking import rollback_after, seed_replay_data
+from ads.replay import Replayer
+
+from .benchmark_servers import parse_choices
+
+# Хранилища сессий и кэш пользователя: db - сессия и пользователь читаются из базы на каждый запрос (как раньше),
+# cached_db - сессия из кэша с записью в базу после ответа, signed_cookies - сессия в подписанной cookie
+PROFILES = {
+    "db": {"SESSION_ENGINE": "django.contrib.sessions.backends.db", "USER_CACHE_TIMEOUT": 0},
+    "cached_db": {"SESSION_ENGINE": "config.sessions", "USER_CACHE_TIMEOUT": 60},
+    "signed_cookies": {"SESSION_ENGINE": "django.contrib.sessions.backends.signed_cookies", "USER_CACHE_TIMEOUT": 60},
+}
+# Страницы авторизованного пользователя: каждая читает сессию и пользователя
+STREAM = [
+    {"route": "ads:ad-list", "user": "member"},
+    {"route": "ads:not-user-ad-list", "user": "member"},
+    {"route": "ads:ad-detail", "user": "member", "args": ["ad"]},
+    {"route": "ads:sent-exchange-list", "user": "member"},
+    {"route": "ads:ad-autocomplete", "user": "member", "query": {"scope": "others", "q": "ноут"}},
+]
+
+
+class Command(BaseCommand):
+    help = "Сравнивает число SQL-запросов и время ответа страниц при разных хранилищах сессий и кэше пользователя"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--size", type=int, default=2_000, help="Число товаров в базе")
+        parser.add_argument("--proposals", type=int, default=200, help="Число предложений в каждую сторону")
+        parser.add_argument("--passes", type=int, default=50, help="Сколько раз запросить каждую страницу")
+        parser.add_argument(
+            "--profiles", default=",".join(PROFILES), help="Профили через запятую: " + ", ".join(PROFILES)
+        )
+
+    def handle(self, *args, **options):
+        profiles = parse_choices(options["profiles"], PROFILES)
+        results = {}
+
+        with rollback_after(), override_settings(ALLOWED_HOSTS=["testserver"], METRICS_SLOW_REQUEST_MS=sys.maxsize):
+            users, objects = seed_replay_data(options["size"], options["proposals"])
+            for profile in profiles:
+                # Клиенты создаются внутри override_settings: SessionMiddleware выбирает хранилище при создании
+                with override_settings(**PROFILES[profile]):
+                    Replayer(users, objects).replay(STREAM)
+                    replayer = Replayer(users, objects)
+                    replayer.replay(STREAM, options["passes"])
+                    results[profile] = replayer.report()
+
+        self.stdout.write(f"{'маршрут':<40} {'профиль':<15} {'p50':>8} {'p95':>8} {'SQL':>6} {'-SQL':>6} {'-p50':>8}")
+        baseline = results.get("db")
+        for entry in STREAM:
+            key = Replayer.sample_key(entry)
+            for profile in profiles:
+                route = results[profile][key]
+                saved_queries = baseline[key]["queries"] - route["queries"] if baseline else 0
+                saved_ms = baseline[key]["p50_ms"] - route["p50_ms"] if baseline else 0
+                self.stdout.write(
+                    f"{key:<40} {profile:<15} {route['p50_ms']:>8.2f} {route['p95_ms']:>8.2f} "
+                    f"{route['queries']:>6.1f} {saved_queries:>6.1f} {saved_ms:>8.2f}"
+                )
@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.template.backends.django import DjangoTemplates
+from django.test import RequestFactory
+from django.test.utils import override_settings
+
+from ads.benchmarking import measure, rollback_after, seed_ads
+from ads.models import Ad
+from users.models import User
+
+PAGE_SIZE = 15
+
+# DummyCache ничего не сохраняет, поэтому {% cache %} отрисовывает карточки заново, как до кэширования фрагментов
+NO_FRAGMENT_CACHE = {
+    **settings.CACHES,
+    "template_fragments": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+}
+
+
+def make_engine(cached):
+    """Движок шаблонов с настройками проекта и кэширующим загрузчиком или без него."""
+    options = settings.TEMPLATES[0]
+    loaders = settings.TEMPLATE_LOADERS
+    return DjangoTemplates(
+        {
+            "NAME": "benchmark",
+            "DIRS": options["DIRS"],
+            "APP_DIRS": False,
+            "OPTIONS": {
+                **options["OPTIONS"],
+                "loaders": [("django.template.loaders.cached.Loader", loaders)] if cached else loaders,
+            },
+        }
+    )
+
+
+def get_pages(count):
+    """Контексты страниц списка товаров; запросы к базе выполняются до замеров."""
+    paginator = Paginator(Ad.objects.select_related("user", "category").order_by("id"), PAGE_SIZE)
+    pages = []
+    for number in range(1, count + 1):
+        page = paginator.page(number)
+        page.object_list = list(page.object_list)
+        pages.append(
+            {
+                "object_list": page.object_list,
+                "page_obj": page,
+                "paginator": paginator,
+                "is_paginated": True,
+                "is_cursor_paginated": False,
+            }
+        )
+    return pages
+
+
+class Command(BaseCommand):
+    help = "Сравнивает время отрисовки страницы списка товаров без кэширования шаблонов и с ним"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pages", type=int, default=10)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **options):
+        # Все данные создаются в транзакции и откатываются после замеров
+        with rollback_after():
+            user = User.objects.create_user(username="benchmark_templates")
+            seed_ads(user, options["pages"] * PAGE_SIZE)
+            pages = get_pages(options["pages"])
+            request = RequestFactory().get("/")
+            request.user = user
+
+            def render(engine):
+                template_name = "ads/ad_list.html"
+                for context in pages:
+                    engine.get_template(template_name).render(context, request)
+
+            with override_settings(CACHES=NO_FRAGMENT_CACHE):
+                before = measure(lambda: render(make_engine(cached=False)), options["repeat"])
+
+            engine = make_engine(cached=True)
+            render(engine)  # прогрев загрузчика и кэша фрагментов
+            after = measure(lambda: render(engine), options["repeat"])
+
+        per_page = options["pages"]
+        self.stdout.write(f"{'режим':>32} {'мс на страницу':>16}")
+        self.stdout.write(f"{'без кэша шаблонов и фрагментов':>32} {before / per_page:>16.2f}")
+        self.stdout.write(f"{'кэширующий загрузчик + фрагменты':>32} {after / per_page:>16.2f}")
+        self.stdout.write(f"Ускорение: {before / after:.1f}x")
@@ -0,0 +1,73 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.utils import timezone
+
+from ads.caching import bump_ad_version, bump_list_version
+from ads.images import build_variants, delete_variants
+from ads.models import Ad
+
+
+def build(item):
+    """Выполняется в отдельном процессе: только работа с файлами, без обращений к базе."""
+    pk, name = item
+    try:
+        return pk, build_variants(name), None
+    except (OSError, ValueError) as error:
+        return pk, None, str(error)
+
+
+class Command(BaseCommand):
+    help = "Создаёт уменьшенные копии изображений объявлений в несколько процессов"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--force", action="store_true", help="Пересоздать копии, которые уже есть")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        queryset = Ad.objects.exclude(image_url="").exclude(image_url__isnull=True)
+        if not options["force"]:
+            queryset = queryset.filter(image_variants={})
+        old_variants = dict(queryset.values_list("pk", "image_variants"))
+        items = list(queryset.values_list("pk", "image_url"))
+        if not items:
+            self.stdout.write("Нет изображений для обработки")
+            return
+
+        started = time.perf_counter()
+        if options["workers"] > 1:
+            # Дочерние процессы не должны наследовать открытые соединения родителя
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=options["workers"], initializer=django.setup) as executor:
+                results = list(executor.map(build, items, chunksize=16))
+        else:
+            results = [build(item) for item in items]
+
+        updated = []
+        now = timezone.now()
+        for pk, variants, error in results:
+            if error:
+                self.stderr.write(f"Объявление {pk}: {error}")
+            else:
+                updated.append(Ad(pk=pk, image_variants=variants, updated_at=now))
+        # bulk_update не вызывает сигналы сохранения: поисковый индекс и счётчики не меняются,
+        # а версии кэша карточек и ETag обновляются вручную, как в Ad.refresh_image_variants
+        Ad.objects.bulk_update(updated, ["image_variants", "updated_at"], batch_size=options["batch_size"])
+        for ad in updated:
+            bump_ad_version(ad.pk, now)
+        if updated:
+            bump_list_version()
+        # С --force копии создаются под новыми именами; прежние файлы удаляются только после смены версий
+        for ad in updated:
+            kept = {name for files in ad.image_variants.get("sources", {}).values() for _, name in files}
+            delete_variants(old_variants.get(ad.pk) or {}, exclude=kept)
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(f"Обработано изображений: {len(updated)} из {len(items)} за {elapsed:.1f} с")
+        )
@@ -0,0 +1,159 @@
+import csv
+import io
+import time
+from pathlib import Path
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils._os import safe_join
+
+from ads.caching import bump_list_version
+from ads.importing import CategoryCache, batched, clean_row, detect_format, read_rows
+from ads.models import Ad, AdFacet
+from ads.ranking import get_ranking_engine
+from ads.search import get_search_backend
+from users.models import User
+
+COPY_COLUMNS = [
+    "title",
+    "description",
+    "image_url",
+    "image_variants",
+    "category_id",
+    "condition",
+    "created_at",
+    "updated_at",
+    "user_id",
+]
+
+
+def copy_ads(ads):
+    """Вставляет товары командой COPY: быстрее INSERT, а триггер поискового вектора всё равно срабатывает."""
+    now = timezone.now()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for ad in ads:
+        row = [ad.title, ad.description, ad.image_url or "", "{}", ad.category_id, ad.condition]
+        writer.writerow(row + [timezone.localdate(now), now.isoformat(), ad.user_id])
+    buffer.seek(0)
+
+    sql = f"COPY {Ad._meta.db_table} ({', '.join(COPY_COLUMNS)}) FROM STDIN WITH (FORMAT csv)"
+    with connection.cursor() as cursor:
+        raw_cursor = cursor.cursor
+        if hasattr(raw_cursor, "copy_expert"):
+            raw_cursor.copy_expert(sql, buffer)
+        else:
+            with raw_cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+
+def resolve_users(values):
+    """Сопоставляет значения поля user (id или имя пользователя) с id существующих пользователей."""
+    ids = {value for value in values if value.isdigit()}
+    users = {str(pk): pk for pk in User.objects.filter(pk__in=ids).values_list("pk", flat=True)}
+    users.update(User.objects.filter(username__in=values - ids).values_list("username", "pk"))
+    return users
+
+
+class Command(BaseCommand):
+    help = "Потоково импортирует товары из JSON, NDJSON или CSV пачками bulk_create или COPY"
+
+    def add_arguments(self, parser):
+        parser.add_argument("path")
+        parser.add_argument("--format", choices=["json", "ndjson", "csv"], help="По умолчанию - по расширению файла")
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--copy", action="store_true", help="Вставлять строки командой COPY (PostgreSQL)")
+        parser.add_argument("--images-dir", help="Каталог, из которого копируются изображения в MEDIA_ROOT")
+
+    def handle(self, *args, **options):
+        file_format = options["format"] or detect_format(options["path"])
+        if file_format is None:
+            raise CommandError("Не удалось определить формат файла, укажите --format")
+        if options["copy"] and connection.vendor != "postgresql":
+            raise CommandError("--copy поддерживается только в PostgreSQL")
+
+        self.images_dir = Path(options["images_dir"]) if options["images_dir"] else None
+        self.skipped = 0
+        categories = CategoryCache()
+        imported = 0
+        started = time.perf_counter()
+
+        try:
+            with open(options["path"], encoding="utf-8", newline="") as file:
+                # В памяти одновременно находится только одна пачка записей
+                for batch in batched(read_rows(file, file_format), options["batch_size"]):
+                    ads = self.build_ads(batch, categories)
+                    with transaction.atomic():
+                        if options["copy"]:
+                            copy_ads(ads)
+                        else:
+                            Ad.objects.bulk_create(ads)
+                    imported += len(ads)
+                    if options["verbosity"] > 1:
+                        rate = imported / (time.perf_counter() - started)
+                        self.stdout.write(f"Импортировано {imported}, {rate:.0f} записей/с")
+        except (ValueError, csv.Error) as error:
+            raise CommandError(f"Ошибка чтения файла: {error}. Сохранено товаров до ошибки: {imported}")
+        finally:
+            # Каждая пачка сохраняется в своей транзакции, поэтому после ошибки сохранённые пачки тоже учитываются
+            if imported:
+                self.refresh_derived_data()
+
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Импортировано товаров: {imported}, пропущено: {self.skipped} "
+                f"за {elapsed:.1f} с ({imported / elapsed:.0f} записей/с)"
+            )
+        )
+
+    @staticmethod
+    def refresh_derived_data():
+        """bulk_create и COPY не вызывают сигналы: счётчики, индексы и версии списков обновляются целиком."""
+        AdFacet.rebuild()
+        get_search_backend().rebuild()
+        get_ranking_engine().rebuild()
+        bump_list_version()
+
+    def build_ads(self, batch, categories):
+        cleaned = []
+        for number, row in batch:
+            try:
+                cleaned.append((number, clean_row(row, categories)))
+            except ValueError as error:
+                self.skip(number, error)
+
+        users = resolve_users({fields["user"] for _, fields in cleaned})
+        ads = []
+        for number, fields in cleaned:
+            user = fields.pop("user")
+            if user not in users:
+                self.skip(number, f"пользователь {user} не найден")
+                continue
+            try:
+                fields["image_url"] = self.copy_image(number, fields["image_url"])
+            except SuspiciousFileOperation as error:
+                self.skip(number, f"недопустимый путь изображения: {error}")
+                continue
+            ads.append(Ad(user_id=users[user], **fields))
+        return ads
+
+    def copy_image(self, number, name):
+        """Копирует изображение из --images-dir в хранилище, если его там ещё нет."""
+        if not name or self.images_dir is None or default_storage.exists(name):
+            return name
+        # safe_join не выпускает путь за пределы --images-dir
+        source = Path(safe_join(self.images_dir, name))
+        if not source.is_file():
+            self.stderr.write(f"Запись {number}: изображение {name} не найдено")
+            return ""
+        with source.open("rb") as file:
+            return default_storage.save(name, File(file))
+
+    def skip(self, number, error):
+        self.skipped += 1
+        self.stderr.write(f"Запись {number}: {error}")
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from ads.models import AdProposalCounter, UserProposalCounter
+
+
+class Command(BaseCommand):
+    help = (
+        "Сверяет счётчики предложений пользователей и товаров с таблицей предложений и исправляет расхождения, "
+        "например после массовой загрузки или изменений предложений в обход ORM"
+    )
+
+    def handle(self, *args, **options):
+        for model in (UserProposalCounter, AdProposalCounter):
+            fixed = model.reconcile()
+            self.stdout.write(f"{model._meta.verbose_name_plural}: исправлено строк - {fixed}")
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:39
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+# Поисковый вектор и индексы создаются только в PostgreSQL: в SQLite используется
+# ads.search.InvertedIndexSearchBackend, которому колонка не нужна.
+CREATE_SEARCH_SQL = [
+    """
+    CREATE FUNCTION ads_ad_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER ads_ad_search_vector_trigger
+    BEFORE INSERT OR UPDATE ON ads_ad
+    FOR EACH ROW EXECUTE FUNCTION ads_ad_search_vector_update()
+    """,
+    "UPDATE ads_ad SET search_vector = NULL",
+    "CREATE INDEX ads_ad_search_vector_gin ON ads_ad USING gin (search_vector)",
+]
+
+CREATE_TRIGRAM_SQL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX ads_ad_title_trgm ON ads_ad USING gin (title gin_trgm_ops)",
+]
+
+DROP_SEARCH_SQL = [
+    "DROP INDEX IF EXISTS ads_ad_title_trgm",
+    "DROP INDEX IF EXISTS ads_ad_search_vector_gin",
+    "DROP TRIGGER IF EXISTS ads_ad_search_vector_trigger ON ads_ad",
+    "DROP FUNCTION IF EXISTS ads_ad_search_vector_update()",
+]
+
+
+def create_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in CREATE_SEARCH_SQL:
+        schema_editor.execute(sql)
+
+    # pg_trgm входит в contrib, но может отсутствовать в минимальных сборках PostgreSQL
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")
+        has_trigram = cursor.fetchone() is not None
+    if has_trigram:
+        for sql in CREATE_TRIGRAM_SQL:
+            schema_editor.execute(sql)
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    for sql in DROP_SEARCH_SQL:
+        schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0002_ad_user"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_objects, drop_search_objects),
+    ]
@@ -0,0 +1,44 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:47
+
+import django.db.models.functions.text
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0003_ad_search_vector"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(
+                django.db.models.functions.text.Lower("category"),
+                models.OrderBy(models.F("created_at"), descending=True),
+                name="ads_ad_category_lower_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(fields=["condition", "-created_at"], name="ads_ad_condition_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(fields=["-created_at", "-id"], name="ads_ad_created_at_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(fields=["user", "id"], name="ads_ad_user_id_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(fields=["ad_sender", "-status", "id"], name="ads_proposal_sender_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="exchangeproposal",
+            index=models.Index(fields=["ad_receiver", "-status", "id"], name="ads_proposal_receiver_idx"),
+        ),
+    ]
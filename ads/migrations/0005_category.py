@@ -0,0 +1,51 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0004_hot_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="Category",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("name", models.CharField(max_length=20, verbose_name="Название")),
+                ("key", models.CharField(editable=False, max_length=20, unique=True, verbose_name="Ключ")),
+            ],
+            options={
+                "verbose_name": "Категория",
+                "verbose_name_plural": "Категории",
+                "ordering": ["name"],
+            },
+        ),
+        migrations.RemoveIndex(
+            model_name="ad",
+            name="ads_ad_category_lower_idx",
+        ),
+        migrations.RenameField(
+            model_name="ad",
+            old_name="category",
+            new_name="category_name",
+        ),
+        # Строковая колонка удаляется в 0007; допускаем NULL, чтобы миграции можно было откатить
+        migrations.AlterField(
+            model_name="ad",
+            name="category_name",
+            field=models.CharField(max_length=20, null=True, verbose_name="Категория"),
+        ),
+        migrations.AddField(
+            model_name="ad",
+            name="category",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ads",
+                to="ads.category",
+                verbose_name="Категория",
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+from django.db import migrations
+
+
+def normalize(name):
+    return " ".join(name.split()).casefold()
+
+
+def categories_from_strings(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    Category = apps.get_model("ads", "Category")
+    db = schema_editor.connection.alias
+
+    categories = {}
+    for name in Ad.objects.using(db).order_by("category_name").values_list("category_name", flat=True).distinct():
+        key = normalize(name)
+        if key not in categories:
+            categories[key], _ = Category.objects.using(db).get_or_create(
+                key=key, defaults={"name": " ".join(name.split())}
+            )
+        Ad.objects.using(db).filter(category_name=name).update(category=categories[key])
+
+
+def categories_to_strings(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    Category = apps.get_model("ads", "Category")
+    db = schema_editor.connection.alias
+
+    for category in Category.objects.using(db):
+        Ad.objects.using(db).filter(category=category).update(category_name=category.name)
+
+
+# Перенос данных вынесен в отдельную миграцию: PostgreSQL не позволяет менять схему ads_ad
+# в одной транзакции с обновлением строк, у которых есть отложенные проверки внешних ключей.
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0005_category"),
+    ]
+
+    operations = [
+        migrations.RunPython(categories_from_strings, categories_to_strings),
+    ]
@@ -0,0 +1,83 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def rebuild_facets(apps, schema_editor):
+    Ad = apps.get_model("ads", "Ad")
+    AdFacet = apps.get_model("ads", "AdFacet")
+    db = schema_editor.connection.alias
+
+    counts = Ad.objects.using(db).order_by().values("category_id", "condition").annotate(ad_count=models.Count("id"))
+    AdFacet.objects.using(db).bulk_create([AdFacet(**row) for row in counts])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0006_ad_category_data"),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name="ad",
+            name="category_name",
+        ),
+        migrations.AlterField(
+            model_name="ad",
+            name="category",
+            field=models.ForeignKey(
+                on_delete=django.db.models.deletion.PROTECT,
+                related_name="ads",
+                to="ads.category",
+                verbose_name="Категория",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="ad",
+            index=models.Index(fields=["category", "-created_at"], name="ads_ad_category_idx"),
+        ),
+        migrations.CreateModel(
+            name="AdFacet",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                (
+                    "condition",
+                    models.CharField(
+                        choices=[
+                            ("new", "новый"),
+                            ("used", "б/у"),
+                            ("display", "витринный"),
+                            ("discounted", "уцененный"),
+                            ("refurbished", "восстановленный"),
+                            ("incomplete", "недоукомплектованный"),
+                            ("expiring", "заканчивается срок годности"),
+                            ("returned", "продается повторно"),
+                            ("other", "другое"),
+                        ],
+                        max_length=11,
+                        verbose_name="Состояние",
+                    ),
+                ),
+                ("ad_count", models.PositiveIntegerField(default=0, verbose_name="Число товаров")),
+                (
+                    "category",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="facets",
+                        to="ads.category",
+                        verbose_name="Категория",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Счётчик товаров",
+                "verbose_name_plural": "Счётчики товаров",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("category", "condition"), name="ads_adfacet_category_condition_uniq"
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(rebuild_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 16:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0007_ad_category_required"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="ad",
+            name="image_variants",
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name="Копии изображения"),
+        ),
+    ]
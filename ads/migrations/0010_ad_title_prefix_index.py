@@ -0,0 +1,28 @@
+from django.db import migrations
+
+# Индекс по началу названия для подсказок в формах предложений (ads.search.filter_title_prefix).
+# Сортировка "C" позволяет одному индексу обслуживать и LIKE 'префикс%', и ORDER BY.
+# В SQLite сопоставления "C" нет, там подсказки обходятся без индекса.
+CREATE_INDEX_SQL = 'CREATE INDEX ads_ad_title_prefix_idx ON ads_ad ((UPPER(title) COLLATE "C"), id)'
+DROP_INDEX_SQL = "DROP INDEX IF EXISTS ads_ad_title_prefix_idx"
+
+
+def create_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(CREATE_INDEX_SQL)
+
+
+def drop_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(DROP_INDEX_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0009_ad_updated_at"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_prefix_index, drop_prefix_index),
+    ]
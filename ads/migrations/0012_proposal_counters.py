@@ -0,0 +1,91 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def count_proposals(apps, schema_editor):
+    ExchangeProposal = apps.get_model("ads", "ExchangeProposal")
+    UserProposalCounter = apps.get_model("ads", "UserProposalCounter")
+    AdProposalCounter = apps.get_model("ads", "AdProposalCounter")
+    db = schema_editor.connection.alias
+    proposals = ExchangeProposal.objects.using(db).order_by()
+
+    users = {}
+    waiting = proposals.filter(status="waiting")
+    for name, owner in (("waiting_received", "ad_receiver__user_id"), ("waiting_sent", "ad_sender__user_id")):
+        for user_id, number in waiting.values_list(owner).annotate(number=models.Count("id")):
+            users.setdefault(user_id, {})[name] = number
+    UserProposalCounter.objects.using(db).bulk_create(
+        [UserProposalCounter(user_id=user_id, **counts) for user_id, counts in users.items()], batch_size=1000
+    )
+
+    ads = {}
+    for queryset in (
+        proposals.values_list("ad_sender_id"),
+        proposals.exclude(ad_receiver=models.F("ad_sender")).values_list("ad_receiver_id"),
+    ):
+        for ad_id, number in queryset.annotate(number=models.Count("id")):
+            ads[ad_id] = ads.get(ad_id, 0) + number
+    AdProposalCounter.objects.using(db).bulk_create(
+        [AdProposalCounter(ad_id=ad_id, proposal_count=number) for ad_id, number in ads.items()], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0011_idempotencykey"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="AdProposalCounter",
+            fields=[
+                (
+                    "ad",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="proposal_counter",
+                        serialize=False,
+                        to="ads.ad",
+                        verbose_name="Товар",
+                    ),
+                ),
+                ("proposal_count", models.PositiveIntegerField(default=0, verbose_name="Число предложений")),
+            ],
+            options={
+                "verbose_name": "Счётчик предложений товара",
+                "verbose_name_plural": "Счётчики предложений товаров",
+            },
+        ),
+        migrations.CreateModel(
+            name="UserProposalCounter",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="proposal_counter",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                        verbose_name="Пользователь",
+                    ),
+                ),
+                (
+                    "waiting_received",
+                    models.PositiveIntegerField(default=0, verbose_name="Полученные, ожидают ответа"),
+                ),
+                ("waiting_sent", models.PositiveIntegerField(default=0, verbose_name="Отправленные, ожидают ответа")),
+            ],
+            options={
+                "verbose_name": "Счётчик предложений пользователя",
+                "verbose_name_plural": "Счётчики предложений пользователей",
+            },
+        ),
+        migrations.RunPython(count_proposals, migrations.RunPython.noop),
+    ]
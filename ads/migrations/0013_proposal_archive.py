@@ -0,0 +1,54 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:49
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ads", "0012_proposal_counters"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedExchangeProposal",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False, verbose_name="ID")),
+                ("comment", models.TextField(blank=True, null=True, verbose_name="Комментарий")),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[("waiting", "ожидает"), ("accepted", "принята"), ("declined", "отклонена")],
+                        max_length=8,
+                        verbose_name="Статус",
+                    ),
+                ),
+                ("created_at", models.DateField(verbose_name="Дата создания")),
+                ("archived_at", models.DateTimeField(auto_now_add=True, verbose_name="Дата переноса в архив")),
+                (
+                    "ad_receiver",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_receiving",
+                        to="ads.ad",
+                        verbose_name="Получение",
+                    ),
+                ),
+                (
+                    "ad_sender",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_sending",
+                        to="ads.ad",
+                        verbose_name="Отправление",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Архивное предложение",
+                "verbose_name_plural": "Архивные предложения",
+                "ordering": ["created_at"],
+            },
+        ),
+    ]
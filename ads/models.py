@@ -1,13 +1,60 @@
-from django.db import models
+from django.contrib.postgres.search import SearchVectorField
+from django.core.files.storage import default_storage
+from django.db import models, transaction
+from django.db.models import Count, F
+from django.db.models.functions import Greatest
+from django.utils import timezone
 
 from users.models import User
 
+from .caching import bump_ad_version, drop_proposal_badges, to_version
+from .images import build_variants, delete_variants
+
+
+class CategoryManager(models.Manager):
+    def get_by_natural_key(self, name):
+        return self.get(key=Category.normalize(name))
+
+    def get_for_name(self, name):
+        """Возвращает категорию с таким названием без учёта регистра, создавая её при необходимости."""
+        category, _ = self.get_or_create(key=Category.normalize(name), defaults={"name": " ".join(name.split())})
+        return category
+
+
+class Category(models.Model):
+    name = models.CharField(max_length=20, verbose_name="Название")
+    # Название в нижнем регистре без лишних пробелов: по нему категории ищутся без учёта регистра
+    key = models.CharField(max_length=20, unique=True, editable=False, verbose_name="Ключ")
+
+    objects = CategoryManager()
+
+    def __str__(self):
+        return self.name
+
+    def natural_key(self):
+        return (self.name,)
+
+    def save(self, *args, **kwargs):
+        self.key = self.normalize(self.name)
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def normalize(name):
+        return " ".join(name.split()).casefold()
+
+    class Meta:
+        verbose_name = "Категория"
+        verbose_name_plural = "Категории"
+        ordering = ["name"]
+
 
 class Ad(models.Model):
     title = models.CharField(max_length=60, verbose_name="Название")
     description = models.TextField(verbose_name="Описание")
     image_url = models.ImageField(upload_to="ads/", blank=True, null=True, verbose_name="Изображение")
-    category = models.CharField(max_length=20, verbose_name="Категория")
+    # Уменьшенные копии изображения, см. ads.images.build_variants
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, verbose_name="Копии изображения")
+    category = models.ForeignKey(Category, on_delete=models.PROTECT, related_name="ads", verbose_name="Категория")
 
     CONDITION_CHOICES = [
         ("new", "новый"),
@@ -23,33 +70,456 @@ class Ad(models.Model):
 
     condition = models.CharField(max_length=11, choices=CONDITION_CHOICES, verbose_name="Состояние")
     created_at = models.DateField(auto_now_add=True, verbose_name="Дата создания")
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата изменения")
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="ads", verbose_name="Создатель")
+    # Заполняется триггером в PostgreSQL, см. ads.search.PostgresSearchBackend
+    search_vector = SearchVectorField(null=True, editable=False)
 
     def __str__(self):
         return self.title
 
+    def refresh_image_variants(self):
+        """Пересоздаёт копии изображения и сохраняет их описание одним UPDATE, не вызывая сигналы сохранения."""
+        old_variants = self.image_variants
+        self.image_variants = build_variants(self.image_url.name) if self.image_url else {}
+        self.updated_at = timezone.now()
+        Ad.objects.filter(pk=self.pk).update(image_variants=self.image_variants, updated_at=self.updated_at)
+        bump_ad_version(self.pk, self.updated_at)
+
+        # Новые копии сохранены под свободными именами, поэтому удаляются только файлы прежних
+        kept = {name for files in self.image_variants.get("sources", {}).values() for _, name in files}
+        delete_variants(old_variants, exclude=kept)
+
+    @property
+    def cache_version(self):
+        """Версия для ключей кэша фрагментов, совпадает с версией ads.caching."""
+        return to_version(self.updated_at)
+
+    def get_srcset(self, extension):
+        return ", ".join(
+            f"{default_storage.url(name)} {width}w" for width, name in self.image_variants["sources"][extension]
+        )
+
+    @property
+    def webp_srcset(self):
+        return self.get_srcset("webp")
+
+    @property
+    def jpeg_srcset(self):
+        return self.get_srcset("jpeg")
+
+    @property
+    def image_fallback_url(self):
+        """Копия JPEG шириной не меньше 640px (или самая большая) для браузеров без srcset."""
+        files = self.image_variants["sources"]["jpeg"]
+        name = next((name for width, name in files if width >= 640), files[-1][1])
+        return default_storage.url(name)
+
+    @property
+    def image_placeholder(self):
+        return self.image_variants.get("placeholder", "")
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сохранённые в базе категория и состояние нужны, чтобы пересчитать AdFacet при изменении товара
+        instance._loaded_facet = (instance.__dict__.get("category_id"), instance.__dict__.get("condition"))
+        return instance
+
     class Meta:
         verbose_name = "Товар"
         verbose_name_plural = "Товары"
         ordering = ["created_at"]
+        indexes = [
+            # Фильтры и сортировки AdSearchView и списков товаров
+            models.Index(fields=["category", "-created_at"], name="ads_ad_category_idx"),
+            models.Index(fields=["condition", "-created_at"], name="ads_ad_condition_idx"),
+            models.Index(fields=["-created_at", "-id"], name="ads_ad_created_at_idx"),
+            models.Index(fields=["user", "id"], name="ads_ad_user_id_idx"),
+        ]
+
+
+PROPOSAL_STATUSES = [("waiting", "ожидает"), ("accepted", "принята"), ("declined", "отклонена")]
 
 
 class ExchangeProposal(models.Model):
     ad_sender = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="sending", verbose_name="Отправление")
     ad_receiver = models.ForeignKey(Ad, on_delete=models.CASCADE, related_name="receiving", verbose_name="Получение")
     comment = models.TextField(blank=True, null=True, verbose_name="Комментарий")
-    status = models.CharField(
-        max_length=8,
-        choices=[("waiting", "ожидает"), ("accepted", "принята"), ("declined", "отклонена")],
-        default="waiting",
-        verbose_name="Статус",
-    )
+    status = models.CharField(max_length=8, choices=PROPOSAL_STATUSES, default="waiting", verbose_name="Статус")
     created_at = models.DateField(auto_now_add=True, verbose_name="Дата создания")
 
     def __str__(self):
         return f"Предложение номер {self.pk}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Сохранённые в базе товары и статус нужны, чтобы перенести счётчики предложений при изменении
+        instance._loaded_counters = tuple(
+            instance.__dict__.get(name) for name in ("ad_sender_id", "ad_receiver_id", "status")
+        )
+        return instance
+
+    def save(self, *args, **kwargs):
+        # Счётчики предложений обновляются сигналом post_save в той же транзакции, что и само предложение
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+
+    def resolve(self, status, user, key=""):
+        """
+        Принимает или отклоняет ожидающее предложение в одной транзакции; возвращает False для повтора по ключу.
+
+        При принятии оба товара блокируются SELECT FOR UPDATE (в порядке pk, чтобы встречные принятия не
+        взаимоблокировались), а все остальные ожидающие предложения с этими товарами отклоняются одним UPDATE.
+        Повтор запроса с тем же ключом идемпотентности не меняет данные; ключ, использованный для другого действия,
+        и предложение, которое уже не ожидает ответа, приводят к ExchangeConflict.
+        """
+        from .cycles import get_cycle_engine
+        from .events import publish_proposal_event
+
+        ad_ids = sorted({self.ad_sender_id, self.ad_receiver_id})
+        with transaction.atomic():
+            if status == "accepted":
+                list(Ad.objects.select_for_update().filter(pk__in=ad_ids).order_by("pk").values_list("pk"))
+            proposal = ExchangeProposal.objects.select_for_update().get(pk=self.pk)
+
+            if key:
+                used = IdempotencyKey.objects.filter(user=user, key=key).first()
+                if used is not None:
+                    if used.proposal_id == self.pk and used.status == status:
+                        self.status = proposal.status
+                        return False
+                    raise ExchangeConflict("Ключ идемпотентности уже использован для другого действия")
+            if proposal.status != "waiting":
+                raise ExchangeConflict("На предложение уже ответили")
+            if sorted({proposal.ad_sender_id, proposal.ad_receiver_id}) != ad_ids:
+                raise ExchangeConflict("Предложение изменилось, повторите действие")
+
+            if status == "accepted":
+                competing = ExchangeProposal.objects.filter(
+                    models.Q(ad_sender__in=ad_ids) | models.Q(ad_receiver__in=ad_ids), status="waiting"
+                ).exclude(pk=self.pk)
+                declined = {
+                    pk: row
+                    for pk, *row in competing.values_list(
+                        "pk", "ad_sender_id", "ad_sender__user_id", "ad_receiver_id", "ad_receiver__user_id"
+                    )
+                }
+                edges = {(sender, receiver) for _, sender, _, receiver in declined.values()}
+                # Массовый UPDATE не вызывает сигналы, поэтому счётчики ожидающих предложений уменьшаются, а события
+                # отклонённых предложений публикуются здесь, граф циклов обновляется после фиксации транзакции
+                if competing.update(status="declined"):
+                    change_proposal_counters(removed=[(*row, "waiting") for row in declined.values()], totals=False)
+                    for pk, (_, sender, _, receiver) in declined.items():
+                        publish_proposal_event("updated", pk, "declined", (sender, receiver))
+                    transaction.on_commit(lambda: get_cycle_engine().refresh_edges(edges))
+
+            self._loaded_counters = (proposal.ad_sender_id, proposal.ad_receiver_id, proposal.status)
+            self.status = status
+            self.save(update_fields=["status"])
+            if key:
+                IdempotencyKey.objects.create(user=user, key=key, proposal=self, status=status)
+        return True
+
     class Meta:
         verbose_name = "Предложение"
         verbose_name_plural = "Предложения"
         ordering = ["created_at"]
+        indexes = [
+            # Списки отправленных и полученных предложений сортируются по статусу
+            models.Index(fields=["ad_sender", "-status", "id"], name="ads_proposal_sender_idx"),
+            models.Index(fields=["ad_receiver", "-status", "id"], name="ads_proposal_receiver_idx"),
+        ]
+
+
+class ExchangeConflict(Exception):
+    """Предложение нельзя принять или отклонить: оно уже решено или ключ идемпотентности занят."""
+
+
+class IdempotencyKey(models.Model):
+    """Ключ запроса на принятие или отклонение предложения: повтор с тем же ключом не выполняется повторно."""
+
+    key = models.CharField(max_length=64, verbose_name="Ключ")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="+", verbose_name="Пользователь")
+    proposal = models.ForeignKey(
+        ExchangeProposal, on_delete=models.CASCADE, related_name="+", verbose_name="Предложение"
+    )
+    status = models.CharField(max_length=8, verbose_name="Статус")
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = "Ключ идемпотентности"
+        verbose_name_plural = "Ключи идемпотентности"
+        constraints = [
+            models.UniqueConstraint(fields=["user", "key"], name="ads_idempotencykey_user_key_uniq"),
+        ]
+
+
+class ArchivedExchangeProposal(models.Model):
+    """
+    Принятое или отклонённое предложение, перенесённое из ExchangeProposal командой archive_proposals, с тем же
+    первичным ключом и полями. Списки предложений читают только ExchangeProposal, страница предложения и архив
+    пользователя находят и перенесённые.
+    """
+
+    id = models.BigIntegerField(primary_key=True, verbose_name="ID")
+    ad_sender = models.ForeignKey(
+        Ad, on_delete=models.CASCADE, related_name="archived_sending", verbose_name="Отправление"
+    )
+    ad_receiver = models.ForeignKey(
+        Ad, on_delete=models.CASCADE, related_name="archived_receiving", verbose_name="Получение"
+    )
+    comment = models.TextField(blank=True, null=True, verbose_name="Комментарий")
+    status = models.CharField(max_length=8, choices=PROPOSAL_STATUSES, verbose_name="Статус")
+    created_at = models.DateField(verbose_name="Дата создания")
+    archived_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата переноса в архив")
+
+    def __str__(self):
+        return f"Предложение номер {self.pk}"
+
+    class Meta:
+        verbose_name = "Архивное предложение"
+        verbose_name_plural = "Архивные предложения"
+        ordering = ["created_at"]
+
+
+class AdFacet(models.Model):
+    """Число товаров в паре (категория, состояние); поддерживается сигналами ads.signals при изменении товаров."""
+
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name="facets", verbose_name="Категория")
+    condition = models.CharField(max_length=11, choices=Ad.CONDITION_CHOICES, verbose_name="Состояние")
+    ad_count = models.PositiveIntegerField(default=0, verbose_name="Число товаров")
+
+    def __str__(self):
+        return f"{self.category}, {self.get_condition_display()}: {self.ad_count}"
+
+    @classmethod
+    def change(cls, category_id, condition, delta):
+        """Изменяет счётчик пары на delta одним UPDATE, создавая строку при первом товаре пары."""
+        with transaction.atomic():
+            updated = cls.objects.filter(category_id=category_id, condition=condition).update(
+                ad_count=F("ad_count") + delta
+            )
+            if not updated and delta > 0:
+                facet, created = cls.objects.get_or_create(
+                    category_id=category_id, condition=condition, defaults={"ad_count": delta}
+                )
+                if not created:
+                    cls.objects.filter(pk=facet.pk).update(ad_count=F("ad_count") + delta)
+
+    @classmethod
+    def recount(cls, category_id, condition):
+        """Пересчитывает счётчик одной пары по таблице товаров."""
+        count = Ad.objects.filter(category_id=category_id, condition=condition).count()
+        cls.objects.update_or_create(category_id=category_id, condition=condition, defaults={"ad_count": count})
+
+    @classmethod
+    def totals_rows(cls):
+        return cls.objects.filter(ad_count__gt=0).values_list("category__name", "condition", "ad_count")
+
+    @staticmethod
+    def sum_totals(rows):
+        categories = {}
+        conditions = {}
+        for name, condition, ad_count in rows:
+            categories[name] = categories.get(name, 0) + ad_count
+            conditions[condition] = conditions.get(condition, 0) + ad_count
+        return sorted(categories.items()), conditions
+
+    @classmethod
+    def totals(cls):
+        """Счётчики для фильтров поиска: [(категория, число)] и {состояние: число} по одному запросу."""
+        return cls.sum_totals(cls.totals_rows())
+
+    @classmethod
+    async def atotals(cls):
+        """Асинхронный вариант totals."""
+        return cls.sum_totals([row async for row in cls.totals_rows()])
+
+    @classmethod
+    def rebuild(cls):
+        """Пересчитывает все счётчики, например после массовой загрузки товаров."""
+        counts = Ad.objects.order_by().values("category_id", "condition").annotate(ad_count=models.Count("id"))
+        with transaction.atomic():
+            cls.objects.all().delete()
+            cls.objects.bulk_create(cls(**row) for row in counts)
+
+    class Meta:
+        verbose_name = "Счётчик товаров"
+        verbose_name_plural = "Счётчики товаров"
+        constraints = [
+            models.UniqueConstraint(fields=["category", "condition"], name="ads_adfacet_category_condition_uniq"),
+        ]
+
+
+class ProposalCounter(models.Model):
+    """
+    Счётчики предложений, которые хранятся отдельно от таблицы предложений и меняются в одной транзакции с ней:
+    сигналами ads.signals, в ExchangeProposal.resolve и после массовых вставок. reconcile() сверяет их с таблицей.
+    """
+
+    counter_fields: tuple[str, ...] = ()
+
+    @classmethod
+    def change(cls, deltas):
+        """
+        Изменяет счётчики: deltas - {pk: {поле: изменение}}. Недостающие строки создаются одним INSERT, строки
+        с одинаковыми изменениями обновляются одним UPDATE.
+        """
+        groups = {}
+        for pk, fields in deltas.items():
+            fields = tuple(sorted((name, delta) for name, delta in fields.items() if delta))
+            if pk is not None and fields:
+                groups.setdefault(fields, []).append(pk)
+        if not groups:
+            return
+
+        created = [cls(pk=pk) for fields, pks in groups.items() if any(delta > 0 for _, delta in fields) for pk in pks]
+        # Счётчики меняются в транзакции изменения предложений, отдельная точка сохранения не нужна
+        with transaction.atomic(savepoint=False):
+            cls.objects.bulk_create(created, ignore_conflicts=True)
+            for fields, pks in groups.items():
+                # Счётчик не уходит ниже нуля, даже если разошёлся с таблицей предложений до reconcile()
+                cls.objects.filter(pk__in=pks).update(**{name: Greatest(F(name) + delta, 0) for name, delta in fields})
+        cls.changed([pk for pks in groups.values() for pk in pks])
+
+    @classmethod
+    def changed(cls, pks):
+        """Вызывается после изменения счётчиков с первичными ключами pks."""
+
+    @classmethod
+    def count(cls, pks=None):
+        """Значения счётчиков по таблице предложений: {pk: {поле: значение}}, только для pks, если они заданы."""
+        raise NotImplementedError
+
+    @classmethod
+    def reconcile(cls, pks=None):
+        """
+        Исправляет счётчики (все или с первичными ключами pks), разошедшиеся с таблицей предложений; возвращает
+        число исправленных строк.
+        """
+        counters = cls.objects.all() if pks is None else cls.objects.filter(pk__in=pks)
+        with transaction.atomic():
+            # Строки блокируются до подсчёта, поэтому изменения незафиксированных транзакций применятся после сверки
+            stored = {counter.pk: counter for counter in counters.select_for_update()}
+            actual = cls.count(pks)
+            created, updated = [], []
+            for pk in actual.keys() | stored.keys():
+                values = {name: actual.get(pk, {}).get(name, 0) for name in cls.counter_fields}
+                counter = stored.get(pk)
+                if counter is None:
+                    created.append(cls(pk=pk, **values))
+                elif any(getattr(counter, name) != value for name, value in values.items()):
+                    for name, value in values.items():
+                        setattr(counter, name, value)
+                    updated.append(counter)
+            cls.objects.bulk_create(created, batch_size=1000)
+            cls.objects.bulk_update(updated, cls.counter_fields, batch_size=1000)
+        cls.changed([counter.pk for counter in created + updated])
+        return len(created) + len(updated)
+
+    class Meta:
+        abstract = True
+
+
+class UserProposalCounter(ProposalCounter):
+    """Ожидающие ответа предложения пользователя: значки в шапке списков товаров."""
+
+    user = models.OneToOneField(
+        User, on_delete=models.CASCADE, primary_key=True, related_name="proposal_counter", verbose_name="Пользователь"
+    )
+    waiting_received = models.PositiveIntegerField(default=0, verbose_name="Полученные, ожидают ответа")
+    waiting_sent = models.PositiveIntegerField(default=0, verbose_name="Отправленные, ожидают ответа")
+
+    counter_fields = ("waiting_received", "waiting_sent")
+
+    def __str__(self):
+        return f"{self.user}: {self.waiting_received} / {self.waiting_sent}"
+
+    @classmethod
+    def changed(cls, pks):
+        drop_proposal_badges(pks)
+
+    @classmethod
+    def count(cls, pks=None):
+        counts = {}
+        waiting = ExchangeProposal.objects.filter(status="waiting").order_by()
+        for name, owner in (("waiting_received", "ad_receiver__user_id"), ("waiting_sent", "ad_sender__user_id")):
+            proposals = waiting if pks is None else waiting.filter(**{f"{owner}__in": pks})
+            for user_id, number in proposals.values_list(owner).annotate(number=Count("id")):
+                counts.setdefault(user_id, {})[name] = number
+        return counts
+
+    class Meta:
+        verbose_name = "Счётчик предложений пользователя"
+        verbose_name_plural = "Счётчики предложений пользователей"
+
+
+class AdProposalCounter(ProposalCounter):
+    """Число предложений с товаром, отправленных и полученных, с любым статусом, в том числе архивных."""
+
+    ad = models.OneToOneField(
+        Ad, on_delete=models.CASCADE, primary_key=True, related_name="proposal_counter", verbose_name="Товар"
+    )
+    proposal_count = models.PositiveIntegerField(default=0, verbose_name="Число предложений")
+
+    counter_fields = ("proposal_count",)
+
+    def __str__(self):
+        return f"{self.ad}: {self.proposal_count}"
+
+    @classmethod
+    def count(cls, pks=None):
+        counts = {}
+        # Перенос в архив не меняет число предложений товара
+        for model in (ExchangeProposal, ArchivedExchangeProposal):
+            proposals = model.objects.order_by()
+            senders = proposals if pks is None else proposals.filter(ad_sender__in=pks)
+            receivers = proposals if pks is None else proposals.filter(ad_receiver__in=pks)
+            # Предложение товара самому себе считается один раз, как и в change_proposal_counters
+            for queryset in (
+                senders.values_list("ad_sender_id"),
+                receivers.exclude(ad_receiver=F("ad_sender")).values_list("ad_receiver_id"),
+            ):
+                for ad_id, number in queryset.annotate(number=Count("id")):
+                    counts.setdefault(ad_id, {"proposal_count": 0})["proposal_count"] += number
+        return counts
+
+    class Meta:
+        verbose_name = "Счётчик предложений товара"
+        verbose_name_plural = "Счётчики предложений товаров"
+
+
+def change_proposal_counters(added=(), removed=(), totals=True):
+    """
+    Переносит в счётчики добавленные и удалённые предложения: кортежи (товар отправителя, отправитель, товар
+    получателя, получатель, статус). Смена статуса или товара - удаление прежнего состояния и добавление нового;
+    totals=False оставляет без изменений числа предложений товаров.
+    """
+    users = {}
+    ads = {}
+    for sign, proposals in ((1, added), (-1, removed)):
+        for ad_sender_id, sender_id, ad_receiver_id, receiver_id, status in proposals:
+            if status == "waiting":
+                for user_id, name in ((sender_id, "waiting_sent"), (receiver_id, "waiting_received")):
+                    fields = users.setdefault(user_id, {})
+                    fields[name] = fields.get(name, 0) + sign
+            if totals:
+                for ad_id in {ad_sender_id, ad_receiver_id}:
+                    ads[ad_id] = ads.get(ad_id, 0) + sign
+    UserProposalCounter.change(users)
+    AdProposalCounter.change({ad_id: {"proposal_count": delta} for ad_id, delta in ads.items()})
+
+
+def reconcile_proposal_counters(user_ids=None, ad_ids=None):
+    """
+    Сверяет счётчики предложений с таблицей предложений: все или только пользователей user_ids и товаров ad_ids.
+    Возвращает число исправленных строк.
+    """
+    if user_ids is None and ad_ids is None:
+        return UserProposalCounter.reconcile() + AdProposalCounter.reconcile()
+    return UserProposalCounter.reconcile(user_ids or []) + AdProposalCounter.reconcile(ad_ids or [])
@@ -0,0 +1,147 @@
+import base64
+import binascii
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+
+CURSOR_MODE = "cursor"
+
+
+class CursorPage:
+    """Страница keyset-пагинации: в отличие от django.core.paginator.Page не знает общего числа страниц."""
+
+    def __init__(self, object_list, paginator, after, next_cursor):
+        self.object_list = object_list
+        self.paginator = paginator
+        self.after = after
+        self.next_cursor = next_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.after is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+class CursorPaginator:
+    """
+    Keyset-пагинация по ключу сортировки.
+
+    Следующая страница выбирается условием "ключ строки больше ключа последней строки предыдущей страницы",
+    поэтому запрос не выполняет COUNT(*) и OFFSET, и далёкие страницы стоят столько же, сколько первая.
+    """
+
+    def __init__(self, queryset, per_page, ordering):
+        ordering = list(ordering)
+        if not {"id", "-id", "pk", "-pk"} & set(ordering):
+            ordering.append("id")
+        self.queryset = queryset.order_by(*ordering)
+        self.per_page = per_page
+        self.ordering = ordering
+
+    @staticmethod
+    def encode_cursor(values):
+        data = json.dumps(values, cls=DjangoJSONEncoder, separators=(",", ":")).encode()
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    def decode_cursor(self, cursor):
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        except (binascii.Error, ValueError):
+            raise Http404("Неверный курсор страницы")
+        if not isinstance(values, list) or len(values) != len(self.ordering):
+            raise Http404("Неверный курсор страницы")
+        # Курсор приходит от клиента: значения приводятся к типам полей сортировки, иначе фильтр упадёт с ошибкой
+        try:
+            values = [self.get_field(field).to_python(value) for field, value in zip(self.ordering, values)]
+        except (ValidationError, TypeError, ValueError):
+            raise Http404("Неверный курсор страницы")
+        if None in values:
+            raise Http404("Неверный курсор страницы")
+        return values
+
+    def get_field(self, field):
+        name = field.lstrip("-")
+        opts = self.queryset.model._meta
+        return opts.pk if name == "pk" else opts.get_field(name)
+
+    def get_key(self, obj):
+        return [getattr(obj, field.lstrip("-")) for field in self.ordering]
+
+    def keyset_filter(self, values):
+        """Условие "строка идёт после values" для произвольных направлений сортировки."""
+        condition = Q()
+        for position, field in enumerate(self.ordering):
+            lookup = "lt" if field.startswith("-") else "gt"
+            step = Q(**{f"{field.lstrip('-')}__{lookup}": values[position]})
+            for previous, value in zip(self.ordering[:position], values[:position]):
+                step &= Q(**{previous.lstrip("-"): value})
+            condition |= step
+        return condition
+
+    def get_page_queryset(self, after):
+        queryset = self.queryset
+        if after:
+            queryset = queryset.filter(self.keyset_filter(self.decode_cursor(after)))
+        # Лишняя строка показывает, есть ли следующая страница, без подсчёта всех строк
+        limit = self.per_page + 1
+        return queryset[:limit]
+
+    def make_page(self, object_list, after):
+        per_page = self.per_page
+        next_cursor = None
+        if len(object_list) > per_page:
+            object_list = object_list[:per_page]
+            next_cursor = self.encode_cursor(self.get_key(object_list[-1]))
+        return CursorPage(object_list, self, after or None, next_cursor)
+
+    def page(self, after=None):
+        return self.make_page(list(self.get_page_queryset(after)), after)
+
+    async def apage(self, after=None):
+        """Асинхронный вариант page: строки загружаются асинхронным ORM."""
+        return self.make_page([obj async for obj in self.get_page_queryset(after)], after)
+
+
+class CursorPaginationMixin:
+    """
+    Добавляет ListView режим keyset-пагинации по параметру ?after=.
+
+    Режим включается настройкой ADS_PAGINATION = "cursor" или атрибутом pagination_mode представления.
+    """
+
+    pagination_mode = None
+    cursor_param = "after"
+
+    def get_pagination_mode(self):
+        return self.pagination_mode or settings.ADS_PAGINATION
+
+    def get_cursor_ordering(self):
+        ordering = self.get_ordering() or ["id"]
+        return [ordering] if isinstance(ordering, str) else ordering
+
+    def paginate_queryset(self, queryset, page_size):
+        if self.get_pagination_mode() != CURSOR_MODE:
+            return super().paginate_queryset(queryset, page_size)
+
+        paginator = CursorPaginator(queryset, page_size, self.get_cursor_ordering())
+        page = paginator.page(self.request.GET.get(self.cursor_param))
+        return paginator, page, page.object_list, page.has_other_pages()
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["is_cursor_paginated"] = self.get_pagination_mode() == CURSOR_MODE
+        return context
@@ -0,0 +1,37 @@
+from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
+from django.db.models import BooleanField, ExpressionWrapper, Q
+
+
+class OwnerRequiredMixin(LoginRequiredMixin, UserPassesTestMixin):
+    """
+    Доступ к объекту только для его владельцев с одной загрузкой объекта на запрос.
+
+    owner_fields - пути к пользователю-владельцу (подходит любой из них), related_fields - связи для select_related.
+    Права вычисляются в том же запросе, что и объект (аннотация is_owner), поэтому чужой объект стоит одного
+    запроса, а отсутствующий по-прежнему даёт 404. Объект запоминается на представлении, и проверка прав
+    в test_func не загружает его повторно.
+    """
+
+    owner_fields: tuple[str, ...] = ("user",)
+    related_fields: tuple[str, ...] = ()
+
+    def get_queryset(self):
+        is_owner = Q()
+        for field in self.owner_fields:
+            is_owner |= Q(**{field: self.request.user.pk})
+        return (
+            super()
+            .get_queryset()
+            .select_related(*self.related_fields)
+            .annotate(is_owner=ExpressionWrapper(is_owner, output_field=BooleanField()))
+        )
+
+    def get_object(self, queryset=None):
+        if queryset is not None:
+            return super().get_object(queryset)
+        if "_owned_object" not in self.__dict__:
+            self._owned_object = super().get_object()
+        return self._owned_object
+
+    def test_func(self):
+        return self.get_object().is_owner
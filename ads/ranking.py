@@ -0,0 +1,393 @@
+import functools
+import threading
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Count, Q
+
+from .caching import bump_shared_version, get_shared_version
+from .models import Ad, ArchivedExchangeProposal, ExchangeProposal
+from .search import DESCRIPTION_WEIGHT, TITLE_WEIGHT, stem, tokenize
+
+# Размерность вектора текста: основы слов хешируются в столбцы, 128 float32 - 512 байт на товар
+TEXT_DIMENSIONS = 128
+# Веса слагаемых оценки пары (свой товар, чужой товар)
+TEXT_WEIGHT = 1.0
+CATEGORY_WEIGHT = 0.5
+CONDITION_WEIGHT = 0.25
+ACCEPT_WEIGHT = 0.25
+# Доли принятия сглаживаются к PRIOR_RATE так, как будто было ещё PRIOR_COUNT решённых предложений
+PRIOR_RATE = 0.5
+PRIOR_COUNT = 5
+# Предел размера блока матрицы оценок, чтобы пользователь с сотнями товаров не занимал сотни мегабайт
+MAX_BLOCK_CELLS = 4_000_000
+# Пары подбираются по последним добавленным товарам пользователя, чтобы время не росло с числом его товаров
+MAX_OFFERED_ADS = 20
+INITIAL_CAPACITY = 1024
+# Версии в общем кэше: признаков товаров (меняется при сохранении и удалении товара) и долей принятия
+# (при решении по предложению) в любом процессе
+RANKING_VERSION_KEY = "ads:ranking:version"
+RANKING_STATS_VERSION_KEY = "ads:ranking:stats-version"
+
+CONDITIONS = {value: position for position, (value, _) in enumerate(Ad.CONDITION_CHOICES)}
+
+
+def hashed_terms(title, description):
+    """Веса столбцов вектора текста: каждая основа слова попадает в столбец по своему хешу."""
+    weights = defaultdict(float)
+    for text, weight in ((title, TITLE_WEIGHT), (description or "", DESCRIPTION_WEIGHT)):
+        for token in tokenize(text):
+            weights[zlib.crc32(stem(token).encode()) % TEXT_DIMENSIONS] += weight
+    return weights
+
+
+def normalize_columns(matrix):
+    """Нормирует столбцы на единичную длину, чтобы их скалярное произведение было косинусной близостью."""
+    norms = np.linalg.norm(matrix, axis=0, keepdims=True)
+    np.divide(matrix, norms, out=matrix, where=norms > 0)
+
+
+def smoothed_rates(accepted, decided):
+    return (accepted + PRIOR_RATE * PRIOR_COUNT) / (decided + PRIOR_COUNT)
+
+
+def top_k(scores, k):
+    """Индексы k наибольших конечных значений в развёрнутой матрице, по убыванию."""
+    flat = scores.ravel()
+    k = min(k, flat.size)
+    if k <= 0:
+        return np.empty(0, np.intp)
+    cut = flat.size - k
+    best = np.argpartition(flat, cut)[cut:]
+    best = best[np.argsort(-flat[best], kind="stable")]
+    return best[np.isfinite(flat[best])]
+
+
+class AdFeatures:
+    """
+    Признаки товаров в массивах NumPy; rows - позиция товара в массивах.
+
+    Векторы текста хранятся по измерениям (TEXT_DIMENSIONS x ёмкость): вектор товара разрежен, и для оценки
+    достаточно нескольких непрерывных строк матрицы. Позиции удалённых товаров помечаются неактивными
+    и занимаются новыми товарами; массивы растут удвоением.
+    """
+
+    ARRAYS = ("text", "ad", "user", "category", "condition", "rate", "active")
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.text = np.zeros((TEXT_DIMENSIONS, capacity), np.float32)
+        self.ad = np.zeros(capacity, np.int64)
+        self.user = np.zeros(capacity, np.int64)
+        self.category = np.zeros(capacity, np.intp)
+        self.condition = np.zeros(capacity, np.intp)
+        # Доля предложений, принятых владельцем товара, см. AcceptStats.receiver_rates
+        self.rate = np.full(capacity, PRIOR_RATE, np.float32)
+        self.active = np.zeros(capacity, bool)
+        self.rows = {}
+        self.free = []
+        self.size = 0
+
+    def __len__(self):
+        return len(self.rows)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Строит признаки по строкам (id, user_id, category_id, condition, title, description) одним проходом."""
+        features = cls()
+        term_columns, term_rows, term_weights = [], [], []
+        for ad_id, user_id, category_id, condition, title, description in rows:
+            row = features.allocate(ad_id)
+            features.set_row(row, ad_id, user_id, category_id, condition)
+            for dimension, weight in hashed_terms(title, description).items():
+                term_columns.append(row)
+                term_rows.append(dimension)
+                term_weights.append(weight)
+        terms = (np.asarray(term_rows, np.intp), np.asarray(term_columns, np.intp))
+        np.add.at(features.text, terms, np.asarray(term_weights, np.float32))
+        normalize_columns(features.text[:, : features.size])
+        return features
+
+    def allocate(self, ad_id):
+        row = self.rows.get(ad_id)
+        if row is None:
+            if self.free:
+                row = self.free.pop()
+            else:
+                if self.size == len(self.ad):
+                    self.grow()
+                row = self.size
+                self.size += 1
+            self.rows[ad_id] = row
+        return row
+
+    def grow(self):
+        capacity = len(self.ad)
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            grown = np.zeros((*array.shape[:-1], capacity * 2), array.dtype)
+            grown[..., :capacity] = array
+            setattr(self, name, grown)
+
+    def set_row(self, row, ad_id, user_id, category_id, condition):
+        self.ad[row] = ad_id
+        self.user[row] = user_id
+        self.category[row] = category_id
+        self.condition[row] = CONDITIONS.get(condition, len(CONDITIONS))
+        self.rate[row] = PRIOR_RATE
+        self.active[row] = True
+
+    def set(self, ad):
+        """Записывает признаки товара и возвращает его позицию."""
+        row = self.allocate(ad.pk)
+        self.set_row(row, ad.pk, ad.user_id, ad.category_id, ad.condition)
+        vector = np.zeros(TEXT_DIMENSIONS, np.float32)
+        for dimension, weight in hashed_terms(ad.title, ad.description).items():
+            vector[dimension] = weight
+        norm = np.linalg.norm(vector)
+        self.text[:, row] = vector / norm if norm else vector
+        return row
+
+    def remove(self, ad_id):
+        row = self.rows.pop(ad_id, None)
+        if row is not None:
+            self.active[row] = False
+            self.free.append(row)
+
+
+class AcceptStats:
+    """
+    Сглаженные доли принятых предложений среди решённых: по парам категорий и парам состояний
+    (отправляемый товар, запрашиваемый товар) и по получателям.
+    """
+
+    def __init__(self):
+        # Решённые предложения, перенесённые в архив, тоже учитываются
+        tables = [
+            ExchangeProposal.objects.exclude(status="waiting").order_by(),
+            ArchivedExchangeProposal.objects.order_by(),
+        ]
+        counts = {"accepted": Count("id", filter=Q(status="accepted")), "decided": Count("id")}
+
+        def grouped(*fields):
+            return [row for decided in tables for row in decided.values_list(*fields).annotate(**counts)]
+
+        # Категории пользователи создают свободно, поэтому таблица строится только по категориям решённых предложений:
+        # category_ids - их id по возрастанию, последняя строка и столбец - для всех остальных категорий
+        category_rows = grouped("ad_sender__category_id", "ad_receiver__category_id")
+        self.category_ids = np.array(
+            sorted({category_id for row in category_rows for category_id in row[:2]}), np.int64
+        )
+        positions = {int(category_id): position for position, category_id in enumerate(self.category_ids)}
+        self.category = self.pair_rates(
+            category_rows, len(self.category_ids) + 1, lambda category_id: positions[category_id]
+        )
+        self.condition = self.pair_rates(
+            grouped("ad_sender__condition", "ad_receiver__condition"),
+            len(CONDITIONS) + 1,
+            lambda condition: CONDITIONS.get(condition, len(CONDITIONS)),
+        )
+
+        totals = defaultdict(lambda: [0, 0])
+        for user_id, accepted, total in grouped("ad_receiver__user_id"):
+            totals[user_id][0] += accepted
+            totals[user_id][1] += total
+        receivers = sorted((user_id, accepted, total) for user_id, (accepted, total) in totals.items())
+        self.users = np.array([user_id for user_id, _, _ in receivers], np.int64)
+        self.rates = smoothed_rates(
+            np.array([accepted for _, accepted, _ in receivers], np.float32),
+            np.array([total for _, _, total in receivers], np.float32),
+        )
+
+    @staticmethod
+    def pair_rates(rows, size, index):
+        accepted = np.zeros((size, size), np.float32)
+        decided = np.zeros((size, size), np.float32)
+        for sender, receiver, accepted_count, decided_count in rows:
+            accepted[index(sender), index(receiver)] += accepted_count
+            decided[index(sender), index(receiver)] += decided_count
+        return smoothed_rates(accepted, decided)
+
+    def pair_scores(self, offered, requested):
+        """
+        Взвешенные доли принятия по категориям и состояниям для всех пар; offered и requested - пары массивов
+        (категории, состояния) отправляемых и запрашиваемых товаров.
+        """
+        (offered_category, offered_condition), (requested_category, requested_condition) = offered, requested
+        # np.take по строкам таблицы заметно быстрее двумерной выборки np.ix_ на сотнях тысяч столбцов
+        category = np.take(
+            self.category[self.category_positions(offered_category)], self.category_positions(requested_category), 1
+        )
+        condition = np.take(self.condition[offered_condition], requested_condition, 1)
+        return CATEGORY_WEIGHT * category + CONDITION_WEIGHT * condition
+
+    def category_positions(self, category_ids):
+        """Позиции категорий в таблице category; категории без решённых предложений попадают в последнюю."""
+        other = len(self.category_ids)
+        if not other:
+            return np.zeros(len(category_ids), np.intp)
+        positions = np.minimum(np.searchsorted(self.category_ids, category_ids), other - 1)
+        return np.where(self.category_ids[positions] == category_ids, positions, other)
+
+    def receiver_rates(self, user_ids):
+        if not len(self.users):
+            return np.full(len(user_ids), PRIOR_RATE, np.float32)
+        positions = np.minimum(np.searchsorted(self.users, user_ids), len(self.users) - 1)
+        return np.where(self.users[positions] == user_ids, self.rates[positions], PRIOR_RATE)
+
+
+class RankingEngine:
+    """
+    Подбирает пары (свой товар, чужой товар) для предложения обмена.
+
+    Оценка пары складывается из косинусной близости текстов, доли принятых предложений между их категориями
+    и состояниями и доли предложений, принятых владельцем чужого товара. Признаки товаров хранятся в матрицах
+    NumPy: строятся при первом обращении и обновляются сигналами ads.signals в текущем процессе.
+    Доли принятия пересчитываются после того, как предложение принято или отклонено. Изменения в других процессах
+    видны по версиям RANKING_VERSION_KEY и RANKING_STATS_VERSION_KEY в общем кэше: устаревшие данные строятся заново.
+    """
+
+    def __init__(self):
+        self.features = None
+        self.stats = None
+        self.version = None
+        self.stats_version = None
+        self.lock = threading.Lock()
+
+    def _get_features(self):
+        # Версия читается до загрузки строк: изменение во время загрузки вызовет ещё одно построение
+        version = get_shared_version(RANKING_VERSION_KEY)
+        if self.features is None or self.version != version:
+            rows = Ad.objects.values_list("id", "user_id", "category_id", "condition", "title", "description")
+            self.features = AdFeatures.from_rows(rows.order_by().iterator(chunk_size=2000))
+            self.version = version
+            self.stats = None
+        return self.features
+
+    def _get_stats(self):
+        version = get_shared_version(RANKING_STATS_VERSION_KEY)
+        if self.stats is None or self.stats_version != version:
+            self.stats = AcceptStats()
+            self.stats_version = version
+            # Доли принятия владельцев кэшируются по позициям товаров, чтобы не искать их при каждом подборе
+            size = self.features.size
+            self.features.rate[:size] = self.stats.receiver_rates(self.features.user[:size])
+        return self.stats
+
+    def score(self, offered, requested):
+        """Матрица оценок: строки - отправляемые товары, столбцы - запрашиваемые (массивы позиций или срез)."""
+        features = self.features
+        vectors = features.text[:, offered]
+        columns = features.text[:, requested]
+        scores = np.empty((len(offered), columns.shape[1]), np.float32)
+        for position in range(len(offered)):
+            # Вектор текста разрежен: умножаются только его ненулевые измерения
+            used = np.flatnonzero(vectors[:, position])
+            np.dot(TEXT_WEIGHT * vectors[used, position], columns[used], out=scores[position])
+
+        scores += self.stats.pair_scores(
+            (features.category[offered], features.condition[offered]),
+            (features.category[requested], features.condition[requested]),
+        )
+        scores += ACCEPT_WEIGHT * features.rate[requested]
+        return scores
+
+    def own_rows(self, user_id):
+        features = self.features
+        return np.flatnonzero(features.active[: features.size] & (features.user[: features.size] == user_id))
+
+    def rank_offers(self, user_id, requested_ad_id):
+        """Id товаров пользователя, которые лучше всего предложить в обмен на товар requested_ad_id."""
+        with self.lock:
+            features = self._get_features()
+            self._get_stats()
+            requested = features.rows.get(requested_ad_id)
+            offered = self.own_rows(user_id)
+            if requested is None or not len(offered):
+                return []
+            scores = self.score(offered, [requested])[:, 0]
+            return features.ad[offered[np.argsort(-scores, kind="stable")]].tolist()
+
+    def suggest(self, user_id, limit=10):
+        """
+        Лучшие пары [(id своего товара, id чужого товара, оценка)] по убыванию оценки
+        среди MAX_OFFERED_ADS последних товаров пользователя.
+        """
+        with self.lock:
+            features = self._get_features()
+            self._get_stats()
+            offered = self.own_rows(user_id)
+            if not len(offered) or not features.size:
+                return []
+            newest = np.argsort(features.ad[offered])[-MAX_OFFERED_ADS:]
+            offered = offered[newest]
+
+            # Запрашиваемые - все позиции матриц срезом без копирования; свои и удалённые товары исключаются маской
+            columns = slice(0, features.size)
+            excluded = ~features.active[columns] | (features.user[columns] == user_id)
+            block = max(1, MAX_BLOCK_CELLS // features.size)
+            candidates = []
+            for start in range(0, len(offered), block):
+                stop = start + block
+                rows = offered[start:stop]
+                scores = self.score(rows, columns)
+                scores[:, excluded] = -np.inf
+                for position in top_k(scores, limit):
+                    row, column = divmod(int(position), features.size)
+                    candidates.append((float(scores[row, column]), int(rows[row]), column))
+
+            candidates.sort(key=lambda candidate: -candidate[0])
+            return [
+                (int(features.ad[offered_row]), int(features.ad[column]), score)
+                for score, offered_row, column in candidates[:limit]
+            ]
+
+    def _apply_change(self, apply=None):
+        """
+        Отмечает изменение товаров в общем кэше и применяет его к матрицам процесса, если после их построения других
+        изменений не было; иначе матрицы строятся заново при следующем подборе.
+        """
+        version = bump_shared_version(RANKING_VERSION_KEY)
+        with self.lock:
+            if self.features is None:
+                return
+            if version != self.version + 1:
+                self.features = None
+                return
+            if apply is not None:
+                apply(self.features)
+            self.version = version
+
+    def _record_change(self, apply):
+        self._apply_change(apply)
+        # Другие процессы могли перестроить матрицы до фиксации транзакции и не увидеть изменение
+        transaction.on_commit(self._apply_change, robust=True)
+
+    def update_ad(self, ad):
+        def apply(features):
+            row = features.set(ad)
+            if self.stats is not None:
+                features.rate[row] = self.stats.receiver_rates(np.array([ad.user_id]))[0]
+
+        self._record_change(apply)
+
+    def remove_ad(self, ad_id):
+        self._record_change(lambda features: features.remove(ad_id))
+
+    def refresh_proposal(self, proposal):
+        """Принятое или отклонённое предложение меняет доли принятия: они пересчитываются при следующем подборе."""
+        if proposal.status != "waiting":
+            bump_shared_version(RANKING_STATS_VERSION_KEY)
+            transaction.on_commit(lambda: bump_shared_version(RANKING_STATS_VERSION_KEY), robust=True)
+
+    def rebuild(self):
+        bump_shared_version(RANKING_VERSION_KEY)
+        with self.lock:
+            self.features = None
+            self.stats = None
+
+
+@functools.cache
+def get_ranking_engine():
+    return RankingEngine()
@@ -0,0 +1,147 @@
+import json
+import math
+import time
+from collections import defaultdict
+
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+# Поток запросов по умолчанию: все маршруты ads/urls.py и users/urls.py, анонимные и авторизованные.
+# Каждая запись описывает один запрос; args - имена объектов из сида (см. Replayer.objects).
+DEFAULT_STREAM = [
+    {"route": "ads:ad-list", "user": "anonymous"},
+    {"route": "ads:ad-list", "user": "anonymous", "query": {"page": 2}},
+    {"route": "ads:search", "user": "anonymous", "query": {"search": "ноутбук"}},
+    {"route": "ads:search", "user": "anonymous", "query": {"category": "Электроника", "condition": "new"}},
+    {"route": "users:login", "user": "anonymous"},
+    {"route": "users:register", "user": "anonymous"},
+    {
+        "route": "users:login",
+        "method": "POST",
+        "user": "anonymous",
+        "data": {"username": "benchmark_member", "password": "benchmark"},
+        "fresh_session": True,
+    },
+    {"route": "ads:ad-list", "user": "member"},
+    {"route": "ads:not-user-ad-list", "user": "member"},
+    {"route": "ads:user-ad-list", "user": "member"},
+    {"route": "ads:search", "user": "member", "query": {"search": "кожаный диван"}},
+    {"route": "ads:ad-detail", "user": "member", "args": ["ad"]},
+    {"route": "ads:ad-detail", "user": "member", "args": ["own_ad"]},
+    {"route": "ads:ad-create", "user": "member"},
+    {
+        "route": "ads:ad-create",
+        "method": "POST",
+        "user": "member",
+        "data": {"title": "Велосипед", "description": "Горный", "category": "Спорт", "condition": "used"},
+    },
+    {"route": "ads:ad-update", "user": "member", "args": ["own_ad"]},
+    {"route": "ads:ad-delete", "user": "member", "args": ["own_ad"]},
+    {"route": "ads:ad-autocomplete", "user": "member", "query": {"scope": "others", "q": "ноут"}},
+    {"route": "ads:ad-autocomplete", "user": "member", "query": {"scope": "own", "page": 2}},
+    {"route": "ads:sent-exchange-list", "user": "member"},
+    {"route": "ads:received-exchange-list", "user": "member"},
+    {"route": "ads:exchange-archive", "user": "member"},
+    {"route": "ads:exchange-cycles", "user": "member"},
+    {"route": "ads:exchange-detail", "user": "member", "args": ["sent_proposal"]},
+    {"route": "ads:exchange-create", "user": "member"},
+    {"route": "ads:exchange-update", "user": "member", "args": ["sent_proposal"]},
+    {"route": "ads:exchange-delete", "user": "member", "args": ["sent_proposal"]},
+    {"route": "ads:exchange-accept", "method": "POST", "user": "member", "args": ["received_proposal"]},
+    {"route": "ads:exchange-decline", "method": "POST", "user": "member", "args": ["received_proposal"]},
+    {"route": "ads:proposal-events", "user": "member"},
+    {"route": "users:logout", "method": "POST", "user": "member", "fresh_session": True},
+]
+
+
+def load_stream(path):
+    """Читает записанный поток запросов: по одному JSON-объекту в строке, как в DEFAULT_STREAM."""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentile(values, percent):
+    """Процентиль методом ближайшего ранга."""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
+
+
+class Replayer:
+    """
+    Воспроизводит поток запросов через тестовый клиент Django и собирает время ответа и число SQL-запросов
+    по каждому маршруту.
+
+    users - пользователи по именам из поля "user" записи ("anonymous" - без входа), objects - id объектов,
+    подставляемых в аргументы маршрутов.
+    """
+
+    def __init__(self, users, objects):
+        self.users = users
+        self.objects = objects
+        self.clients = {}
+        self.samples = defaultdict(lambda: {"latency": [], "queries": [], "bytes": [], "statuses": defaultdict(int)})
+
+    @staticmethod
+    def sample_key(entry):
+        """Ключ замера: метод, маршрут и пользователь, а также метка записи (label), если она задана."""
+        key = f"{entry.get('method', 'GET')} {entry['route']} {entry.get('user', 'anonymous')}"
+        return f"{key} {entry['label']}" if "label" in entry else key
+
+    def make_client(self, user):
+        client = Client(raise_request_exception=False)
+        if self.users.get(user) is not None:
+            client.force_login(self.users[user])
+        return client
+
+    def get_client(self, entry):
+        user = entry.get("user", "anonymous")
+        if entry.get("fresh_session"):
+            # Вход и выход меняют сессию, поэтому такие запросы выполняются отдельным клиентом
+            return self.make_client(user)
+        if user not in self.clients:
+            self.clients[user] = self.make_client(user)
+        return self.clients[user]
+
+    def replay(self, stream, passes=1):
+        for _ in range(passes):
+            for entry in stream:
+                self.request(entry)
+
+    def request(self, entry):
+        method = entry.get("method", "GET")
+        # Маршруты API принимают именованные аргументы: значение - имя объекта из objects или сама строка (версия)
+        args = [self.objects[name] for name in entry.get("args", [])]
+        kwargs = {key: self.objects.get(value, value) for key, value in entry.get("kwargs", {}).items()}
+        path = reverse(entry["route"], args=args or None, kwargs=kwargs or None)
+        client = self.get_client(entry)
+        data = entry.get("query") if method == "GET" else entry.get("data")
+
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            response = client.generic(method, path) if data is None else getattr(client, method.lower())(path, data)
+            elapsed = (time.perf_counter() - started) * 1000
+
+        sample = self.samples[self.sample_key(entry)]
+        sample["latency"].append(elapsed)
+        sample["queries"].append(len(queries))
+        sample["bytes"].append(len(response.content))
+        sample["statuses"][str(response.status_code)] += 1
+
+    def report(self):
+        """Сводка по маршрутам: процентили времени ответа в мс, запросов в секунду и SQL-запросов на запрос."""
+        routes = {}
+        for key, sample in sorted(self.samples.items()):
+            latency = sample["latency"]
+            routes[key] = {
+                "requests": len(latency),
+                "p50_ms": round(percentile(latency, 50), 3),
+                "p95_ms": round(percentile(latency, 95), 3),
+                "p99_ms": round(percentile(latency, 99), 3),
+                "rps": round(len(latency) / (sum(latency) / 1000), 1),
+                "queries": round(sum(sample["queries"]) / len(latency), 2),
+                "bytes": round(sum(sample["bytes"]) / len(latency)),
+                "statuses": dict(sorted(sample["statuses"].items())),
+            }
+        return routes
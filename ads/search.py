@@ -0,0 +1,313 @@
+import bisect
+import functools
+import math
+import re
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramWordSimilarity
+from django.db import connections
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Collate, Upper
+from django.utils.module_loading import import_string
+
+from .models import Category
+
+POSTGRES_BACKEND = "ads.search.PostgresSearchBackend"
+INVERTED_INDEX_BACKEND = "ads.search.InvertedIndexSearchBackend"
+
+SEARCH_CONFIG = "russian"
+TITLE_WEIGHT = 1.0
+DESCRIPTION_WEIGHT = 0.4
+TRIGRAM_WEIGHT = 0.3
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Окончания для упрощённого стемминга русских и английских слов (от длинных к коротким)
+ENDINGS = sorted(
+    (
+        "иями ями ами ией ием иях ость ости ов ев ей ой ий ый ая яя ое ее ые ие ых их ом ем ам ям ах ях ую юю ия ию "
+        "а я о е и ы у ю ь ing es ed s"
+    ).split(),
+    key=len,
+    reverse=True,
+)
+MIN_STEM_LENGTH = 3
+
+
+def tokenize(text):
+    """Разбивает текст на слова в нижнем регистре."""
+    return TOKEN_RE.findall(text.lower().replace("ё", "е"))
+
+
+def stem(word):
+    """Отбрасывает окончание слова, оставляя основу не короче MIN_STEM_LENGTH символов."""
+    for ending in ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM_LENGTH:
+            return word[: -len(ending)]
+    return word
+
+
+def filter_title_prefix(queryset, prefix):
+    """
+    Товары, название которых начинается с prefix без учёта регистра, по алфавиту.
+
+    В PostgreSQL условие и сортировка записаны через выражение индекса ads_ad_title_prefix_idx
+    (UPPER(title) COLLATE "C", id, см. миграцию 0010): страница подсказок читается из индекса без сортировки.
+    """
+    if connections[queryset.db].vendor == "postgresql":
+        queryset = queryset.alias(title_key=Collate(Upper("title"), "C"))
+        if prefix:
+            queryset = queryset.filter(title_key__startswith=Upper(Value(prefix)))
+        return queryset.order_by("title_key", "id")
+    if prefix:
+        queryset = queryset.filter(title__istartswith=prefix)
+    return queryset.order_by(Upper("title"), "id")
+
+
+def filter_search_queryset(queryset, params):
+    """
+    Фильтры страницы поиска по параметрам ?category= и ?condition=; возвращает товары и поисковый запрос ?search=.
+
+    Без поискового запроса товары отсортированы от новых к старым, с запросом их сортирует поисковый движок
+    по релевантности. Общая часть ads.views.AdSearchView и ads.async_views.AdSearchView.
+    """
+    category = params.get("category")
+    condition = params.get("condition")
+    search_query = params.get("search")
+
+    if category:
+        queryset = queryset.filter(category__key=Category.normalize(category))
+    if condition:
+        queryset = queryset.filter(condition=condition)
+    if not search_query:
+        queryset = queryset.order_by("-created_at", "-id")
+    return queryset, search_query
+
+
+class BaseSearchBackend:
+    """Базовый класс поискового движка по объявлениям."""
+
+    def search(self, queryset, query):
+        """
+        Возвращает результаты из queryset, подходящие под запрос, по убыванию релевантности.
+
+        Результат - queryset или последовательность с методом count() и срезами, пригодная для Paginator.
+        """
+        raise NotImplementedError
+
+    def index_ad(self, ad):
+        """Обновляет индекс после сохранения объявления."""
+
+    def remove_ad(self, ad_id):
+        """Удаляет объявление из индекса."""
+
+    def rebuild(self):
+        """Перестраивает индекс целиком (например, после массовой загрузки)."""
+
+
+class PostgresSearchBackend(BaseSearchBackend):
+    """
+    Полнотекстовый поиск PostgreSQL.
+
+    Поле Ad.search_vector поддерживается триггером (см. миграцию 0003) и покрыто GIN-индексом.
+    Слова запроса ищутся по префиксу, а опечатки и части слов в названии
+    дополнительно находятся триграммами, если установлено расширение pg_trgm.
+    """
+
+    def __init__(self, using="default"):
+        self.using = using
+        self._has_trigram = None
+
+    @property
+    def has_trigram(self):
+        if self._has_trigram is None:
+            with connections[self.using].cursor() as cursor:
+                cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+                self._has_trigram = cursor.fetchone() is not None
+        return self._has_trigram
+
+    def search(self, queryset, query):
+        tokens = tokenize(query)
+        if not tokens:
+            return queryset.none()
+
+        # Токены состоят только из \w, поэтому безопасны для синтаксиса to_tsquery
+        ts_query = SearchQuery(" & ".join(f"{token}:*" for token in tokens), config=SEARCH_CONFIG, search_type="raw")
+        rank = SearchRank(F("search_vector"), ts_query, weights=[0.1, 0.2, DESCRIPTION_WEIGHT, TITLE_WEIGHT])
+        condition = Q(search_vector=ts_query)
+
+        if self.has_trigram:
+            phrase = " ".join(tokens)
+            condition |= Q(title__trigram_word_similar=phrase)
+            rank = rank + Coalesce(TrigramWordSimilarity(phrase, "title"), Value(0.0)) * TRIGRAM_WEIGHT
+
+        return queryset.filter(condition).annotate(rank=rank).order_by("-rank", "-created_at", "-id")
+
+
+class InvertedIndex:
+    """Инвертированный индекс в памяти: основа слова -> {id объявления: вес}."""
+
+    def __init__(self):
+        self.postings = defaultdict(dict)
+        self.documents = {}
+        self._vocabulary = []
+        self._vocabulary_dirty = False
+
+    def __len__(self):
+        return len(self.documents)
+
+    def add(self, ad_id, title, description):
+        self.remove(ad_id)
+        weights = defaultdict(float)
+        for token in tokenize(title):
+            weights[stem(token)] += TITLE_WEIGHT
+        for token in tokenize(description or ""):
+            weights[stem(token)] += DESCRIPTION_WEIGHT
+        for term, weight in weights.items():
+            if term not in self.postings:
+                self._vocabulary_dirty = True
+            self.postings[term][ad_id] = weight
+        self.documents[ad_id] = list(weights)
+
+    def remove(self, ad_id):
+        for term in self.documents.pop(ad_id, ()):
+            postings = self.postings[term]
+            postings.pop(ad_id, None)
+            if not postings:
+                del self.postings[term]
+                self._vocabulary_dirty = True
+
+    @property
+    def vocabulary(self):
+        if self._vocabulary_dirty:
+            self._vocabulary = sorted(self.postings)
+            self._vocabulary_dirty = False
+        return self._vocabulary
+
+    def _prefix_terms(self, prefix):
+        vocabulary = self.vocabulary
+        position = bisect.bisect_left(vocabulary, prefix)
+        while position < len(vocabulary) and vocabulary[position].startswith(prefix):
+            yield vocabulary[position]
+            position += 1
+
+    def _term_scores(self, token):
+        """Оценки документов для одного слова запроса: точное совпадение основы или совпадение по префиксу."""
+        scores = defaultdict(float)
+        exact = stem(token)
+        for term in {exact, *self._prefix_terms(token)}:
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + len(self.documents) / len(postings))
+            factor = 1.0 if term == exact else 0.5
+            for ad_id, weight in postings.items():
+                scores[ad_id] += weight * idf * factor
+        return scores
+
+    def search(self, query, limit=None):
+        """Возвращает список (id, оценка), содержащих все слова запроса, по убыванию оценки."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+
+        result = None
+        for token in sorted(set(tokens), key=len, reverse=True):
+            scores = self._term_scores(token)
+            if result is None:
+                result = scores
+            else:
+                result = {ad_id: score + scores[ad_id] for ad_id, score in result.items() if ad_id in scores}
+            if not result:
+                return []
+
+        ranked = sorted(result.items(), key=lambda item: (-item[1], -item[0]))
+        return ranked[:limit] if limit else ranked
+
+
+class RankedResults:
+    """Объекты queryset в порядке заранее отранжированного списка id; загружается только запрошенный срез."""
+
+    def __init__(self, queryset, ranked_ids):
+        self.queryset = queryset
+        self.model = queryset.model
+        self.ranked_ids = ranked_ids
+        self._ids = None
+
+    @property
+    def ids(self):
+        # Фильтры queryset (категория, состояние) применяются одним запросом к отранжированным id
+        if self._ids is None:
+            allowed = set(self.queryset.filter(pk__in=self.ranked_ids).values_list("pk", flat=True))
+            self._ids = [pk for pk in self.ranked_ids if pk in allowed]
+        return self._ids
+
+    def count(self):
+        return len(self.ids)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __getitem__(self, key):
+        ids = self.ids[key] if isinstance(key, slice) else [self.ids[key]]
+        objects = self.queryset.order_by().in_bulk(ids)
+        result = [objects[pk] for pk in ids if pk in objects]
+        return result if isinstance(key, slice) else result[0]
+
+
+class InvertedIndexSearchBackend(BaseSearchBackend):
+    """
+    Поиск по инвертированному индексу на чистом Python.
+
+    Предназначен для SQLite и тестов: индекс строится при первом поиске и
+    обновляется сигналами сохранения/удаления объявлений в текущем процессе.
+    """
+
+    def __init__(self):
+        self.index = None
+        self.lock = threading.Lock()
+
+    def _get_index(self):
+        with self.lock:
+            if self.index is None:
+                from .models import Ad
+
+                index = InvertedIndex()
+                for ad_id, title, description in Ad.objects.values_list("id", "title", "description").iterator(
+                    chunk_size=2000
+                ):
+                    index.add(ad_id, title, description)
+                self.index = index
+            return self.index
+
+    def search(self, queryset, query):
+        ranked = self._get_index().search(query, limit=settings.ADS_SEARCH_MAX_RESULTS)
+        return RankedResults(queryset, [ad_id for ad_id, _ in ranked])
+
+    def index_ad(self, ad):
+        with self.lock:
+            if self.index is not None:
+                self.index.add(ad.pk, ad.title, ad.description)
+
+    def remove_ad(self, ad_id):
+        with self.lock:
+            if self.index is not None:
+                self.index.remove(ad_id)
+
+    def rebuild(self):
+        with self.lock:
+            self.index = None
+
+
+@functools.cache
+def get_search_backend():
+    """Возвращает движок из настройки ADS_SEARCH_BACKEND, а если она пуста - подходящий для базы данных."""
+    path = settings.ADS_SEARCH_BACKEND
+    if not path:
+        path = POSTGRES_BACKEND if connections["default"].vendor == "postgresql" else INVERTED_INDEX_BACKEND
+    return import_string(path)()
@@ -0,0 +1,106 @@
+from rest_framework import serializers
+
+from .models import Ad, Category, ExchangeProposal
+
+
+class SparseFieldsMixin:
+    """
+    Оставляет в ответе только поля из параметра ?fields=id,title (sparse fieldsets).
+
+    Поля отбрасываются только при чтении: в запросах на запись сериализатор принимает все поля.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get("request")
+        if request is None or request.method not in ("GET", "HEAD"):
+            return
+        requested = {name.strip() for name in request.query_params.get("fields", "").split(",") if name.strip()}
+        if not requested:
+            return
+        unknown = requested - set(self.fields)
+        if unknown:
+            raise serializers.ValidationError({"fields": f"Неизвестные поля: {', '.join(sorted(unknown))}"})
+        for name in set(self.fields) - requested:
+            self.fields.pop(name)
+
+
+class CategoryField(serializers.Field):
+    """Категория передаётся названием и сопоставляется с Category без учёта регистра, как в AdForm."""
+
+    default_error_messages = {"invalid": "Укажите название категории до 20 символов"}
+
+    def to_representation(self, value):
+        return value.name
+
+    def to_internal_value(self, data):
+        if not isinstance(data, str) or not data.strip() or len(data) > Category._meta.get_field("name").max_length:
+            self.fail("invalid")
+        # Категория создаётся при сохранении (AdSerializer.create/update), а не при проверке данных
+        return " ".join(data.split())
+
+
+class AdSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """Товар: категория передаётся названием, а связи - идентификаторами."""
+
+    category = CategoryField()
+    image = serializers.ImageField(source="image_url", read_only=True)
+
+    class Meta:
+        model = Ad
+        fields = ["id", "title", "description", "category", "condition", "image", "user", "created_at", "updated_at"]
+        read_only_fields = ["user"]
+
+    def resolve_category(self, validated_data):
+        if "category" in validated_data:
+            validated_data["category"] = Category.objects.get_for_name(validated_data["category"])
+        return validated_data
+
+    def create(self, validated_data):
+        return super().create(self.resolve_category(validated_data))
+
+    def update(self, instance, validated_data):
+        return super().update(instance, self.resolve_category(validated_data))
+
+
+class ExchangeProposalSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    """
+    Предложение обмена: товары передаются идентификаторами.
+
+    Товары читаются из context["ads"] (словарь id -> Ad), если представление загрузило их заранее одним
+    запросом для пакета предложений, иначе - по одному запросу на предложение.
+    """
+
+    ad_sender = serializers.IntegerField(source="ad_sender_id")
+    ad_receiver = serializers.IntegerField(source="ad_receiver_id")
+
+    class Meta:
+        model = ExchangeProposal
+        fields = ["id", "ad_sender", "ad_receiver", "comment", "status", "created_at"]
+        read_only_fields = ["status"]
+
+    def get_ad(self, pk):
+        ads = self.context.get("ads")
+        if ads is not None:
+            return ads.get(pk)
+        return Ad.objects.only("id", "user_id").filter(pk=pk).first()
+
+    def validate(self, attrs):
+        user = self.context["request"].user
+        sender_id = attrs.get("ad_sender_id", getattr(self.instance, "ad_sender_id", None))
+        receiver_id = attrs.get("ad_receiver_id", getattr(self.instance, "ad_receiver_id", None))
+        errors = {}
+        if "ad_sender_id" in attrs:
+            sender = self.get_ad(sender_id)
+            if sender is None or sender.user_id != user.pk:
+                errors["ad_sender"] = "Предложить можно только свой товар"
+        if "ad_receiver_id" in attrs:
+            if self.instance is not None and receiver_id != self.instance.ad_receiver_id:
+                errors["ad_receiver"] = "Запрошенный товар нельзя изменить"
+            else:
+                receiver = self.get_ad(receiver_id)
+                if receiver is None or receiver.user_id == user.pk:
+                    errors["ad_receiver"] = "Запросить можно только чужой товар"
+        if errors:
+            raise serializers.ValidationError(errors)
+        return attrs
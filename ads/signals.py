@@ -0,0 +1,172 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .caching import bump_ad_version
+from .cycles import get_cycle_engine
+from .events import publish_proposal_event
+from .models import (
+    Ad,
+    AdFacet,
+    ArchivedExchangeProposal,
+    ExchangeProposal,
+    change_proposal_counters,
+    reconcile_proposal_counters,
+)
+from .ranking import get_ranking_engine
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=Ad)
+def index_ad(sender, instance, **kwargs):
+    """Обновляет поисковый индекс после сохранения товара."""
+    get_search_backend().index_ad(instance)
+
+
+@receiver(post_delete, sender=Ad)
+def remove_ad_from_index(sender, instance, **kwargs):
+    """Удаляет товар из поискового индекса."""
+    get_search_backend().remove_ad(instance.pk)
+
+
+@receiver(post_save, sender=Ad)
+def update_facets_on_save(sender, instance, created, raw, **kwargs):
+    """Переносит товар между счётчиками AdFacet, если изменились категория или состояние."""
+    current = (instance.category_id, instance.condition)
+    loaded = getattr(instance, "_loaded_facet", None)
+
+    if raw:
+        # При загрузке фикстур прежнее состояние строки неизвестно, поэтому пара пересчитывается целиком
+        AdFacet.recount(*current)
+    elif created:
+        AdFacet.change(*current, 1)
+    elif loaded is None:
+        AdFacet.recount(*current)
+    elif loaded != current:
+        AdFacet.change(*loaded, -1)
+        AdFacet.change(*current, 1)
+    instance._loaded_facet = current
+
+
+@receiver(post_save, sender=Ad)
+def update_ranking_features(sender, instance, **kwargs):
+    """Обновляет строку товара в матрицах признаков подбора пар для обмена."""
+    get_ranking_engine().update_ad(instance)
+
+
+@receiver(post_delete, sender=Ad)
+def remove_ranking_features(sender, instance, **kwargs):
+    get_ranking_engine().remove_ad(instance.pk)
+
+
+@receiver(post_delete, sender=Ad)
+def update_facets_on_delete(sender, instance, **kwargs):
+    """Уменьшает счётчик AdFacet удалённого товара."""
+    AdFacet.change(*getattr(instance, "_loaded_facet", (instance.category_id, instance.condition)), -1)
+
+
+@receiver(post_save, sender=Ad)
+def bump_version_on_save(sender, instance, **kwargs):
+    """Сбрасывает ETag страницы товара и списков товаров."""
+    bump_ad_version(instance.pk, instance.updated_at)
+
+
+@receiver(post_delete, sender=Ad)
+def bump_version_on_delete(sender, instance, **kwargs):
+    bump_ad_version(instance.pk)
+
+
+@receiver(post_save, sender=ExchangeProposal)
+@receiver(post_delete, sender=ExchangeProposal)
+def update_cycle_graph(sender, instance, **kwargs):
+    """Обновляет граф предложений, по которому подбираются циклы обмена."""
+    get_cycle_engine().refresh_proposal(instance)
+
+
+@receiver(post_save, sender=ExchangeProposal)
+@receiver(post_delete, sender=ExchangeProposal)
+def update_accept_stats(sender, instance, **kwargs):
+    """Сбрасывает доли принятых предложений, по которым ранжируются пары для обмена."""
+    get_ranking_engine().refresh_proposal(instance)
+
+
+def counter_rows(instance, states):
+    """
+    Кортежи для change_proposal_counters по состояниям предложения (товар отправителя, товар получателя, статус).
+    Владельцы товаров берутся из загруженных вместе с предложением товаров, остальные - одним запросом; найденные
+    владельцы запоминаются в предложении для следующих обработчиков сигналов.
+    """
+    owners = instance.__dict__.setdefault("_ad_owners", {})
+    owners.update(
+        (ad.pk, ad.user_id)
+        for ad in (instance._state.fields_cache.get(name) for name in ("ad_sender", "ad_receiver"))
+        if ad is not None
+    )
+    missing = {ad_id for ad_sender_id, ad_receiver_id, _ in states for ad_id in (ad_sender_id, ad_receiver_id)}
+    missing -= owners.keys()
+    if missing:
+        owners.update(Ad.objects.filter(pk__in=missing).values_list("pk", "user_id"))
+    return [
+        (ad_sender_id, owners.get(ad_sender_id), ad_receiver_id, owners.get(ad_receiver_id), status)
+        for ad_sender_id, ad_receiver_id, status in states
+    ]
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def update_proposal_counters_on_save(sender, instance, created, raw, **kwargs):
+    """Переносит предложение между счётчиками UserProposalCounter и AdProposalCounter."""
+    current = (instance.ad_sender_id, instance.ad_receiver_id, instance.status)
+    loaded = getattr(instance, "_loaded_counters", None)
+
+    if created and not raw:
+        change_proposal_counters(added=counter_rows(instance, [current]))
+    elif raw or loaded is None or None in loaded:
+        # Прежнее состояние неизвестно (фикстуры, объект из bulk_create или с отложенными полями), поэтому
+        # счётчики затронутых пользователей и товаров пересчитываются по таблице предложений
+        rows = counter_rows(instance, [current, loaded] if loaded and None not in loaded else [current])
+        reconcile_proposal_counters(
+            user_ids={user_id for row in rows for user_id in (row[1], row[3])},
+            ad_ids={ad_id for row in rows for ad_id in (row[0], row[2])},
+        )
+    elif loaded != current:
+        change_proposal_counters(added=counter_rows(instance, [current]), removed=counter_rows(instance, [loaded]))
+    instance._loaded_counters = current
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def update_proposal_counters_on_delete(sender, instance, **kwargs):
+    loaded = getattr(instance, "_loaded_counters", None)
+    if loaded is None or None in loaded:
+        loaded = (instance.ad_sender_id, instance.ad_receiver_id, instance.status)
+    change_proposal_counters(removed=counter_rows(instance, [loaded]))
+
+
+@receiver(post_delete, sender=ArchivedExchangeProposal)
+def update_counters_on_archived_delete(sender, instance, **kwargs):
+    """
+    Архивное предложение удаляется вместе с одним из товаров: уменьшает число предложений второго товара
+    и сбрасывает доли принятия.
+    """
+    change_proposal_counters(removed=[(instance.ad_sender_id, None, instance.ad_receiver_id, None, instance.status)])
+    get_ranking_engine().refresh_proposal(instance)
+
+
+def participants(instance):
+    """Отправитель и получатель предложения."""
+    _, sender_id, _, receiver_id, _ = counter_rows(instance, [(instance.ad_sender_id, instance.ad_receiver_id, None)])[
+        0
+    ]
+    return sender_id, receiver_id
+
+
+@receiver(post_save, sender=ExchangeProposal)
+def publish_proposal_saved(sender, instance, created, raw, **kwargs):
+    """Отправляет событие нового или изменённого предложения в потоки отправителя и получателя."""
+    if not raw:
+        publish_proposal_event(
+            "created" if created else "updated", instance.pk, instance.status, participants(instance)
+        )
+
+
+@receiver(post_delete, sender=ExchangeProposal)
+def publish_proposal_deleted(sender, instance, **kwargs):
+    publish_proposal_event("deleted", instance.pk, instance.status, participants(instance))
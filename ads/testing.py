@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Примесь к TestCase для проверки числа SQL-запросов представления.
+
+    Представление запрашивается на данных растущего размера: число запросов не должно
+    превышать бюджет и не должно зависеть от количества объектов на странице (N+1).
+    """
+
+    query_budget_sizes = (1, 5, 15)
+
+    def assertQueryBudget(self, url, budget, populate, sizes=None, data=None):
+        """populate(size) доводит число объектов в данных до size перед очередным запросом."""
+        # Первый запрос прогревает кэши процесса (типы содержимого, проверки движков и т.п.)
+        populate(min(sizes or self.query_budget_sizes))
+        self.client.get(url, data)
+
+        counts = {}
+        queries = {}
+        for size in sizes or self.query_budget_sizes:
+            populate(size)
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(url, data)
+            self.assertEqual(response.status_code, 200)
+            counts[size] = len(context)
+            queries[size] = "\n".join(query["sql"] for query in context.captured_queries)
+
+        largest = max(counts, key=counts.get)
+        self.assertLessEqual(
+            counts[largest],
+            budget,
+            f"{url}: {counts[largest]} запросов при бюджете {budget}:\n{queries[largest]}",
+        )
+        self.assertEqual(
+            len(set(counts.values())),
+            1,
+            f"{url}: число запросов растёт с размером данных {counts}:\n{queries[largest]}",
+        )
+
+
+class PrimaryDatabaseTestRunner(DiscoverRunner):
+    """
+    Запускает тесты с чтением только с основной базы.
+
+    У реплик из DB_REPLICAS в тестах свои пустые тестовые базы, поэтому чтение с них включают только тесты
+    маршрутизатора реплик (override_settings(DATABASE_REPLICAS=...)).
+    """
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self.replicas = settings.DATABASE_REPLICAS
+        settings.DATABASE_REPLICAS = []
+
+    def teardown_test_environment(self, **kwargs):
+        settings.DATABASE_REPLICAS = self.replicas
+        super().teardown_test_environment(**kwargs)
@@ -1,9 +1,70 @@
-from django.test import TestCase
-from django.urls import reverse
+import asyncio
+import datetime
+import gzip
+import importlib
+import json
+import os
+import random
+import shutil
+import socket
+import tempfile
+import threading
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-from ads.models import Ad, ExchangeProposal
+import brotli
+import numpy as np
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import close_old_connections, connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, get_resolver, resolve, reverse
+from PIL import Image
+
+import ads.urls
+import config.urls
+from ads import async_views, views
+from ads.archiving import archive_cutoff, archive_resolved_proposals
+from ads.benchmarking import analyze, get_categories, make_ad
+from ads.caching import bump_shared_version, get_ad_version
+from ads.cycles import CYCLES_VERSION_KEY, ProposalGraph, get_cycle_engine
+from ads.events import EventStreamApplication, SocketBroker, get_event_broker
+from ads.images import build_variants
+from ads.importing import iter_json
+from ads.models import (
+    Ad,
+    AdFacet,
+    AdProposalCounter,
+    ArchivedExchangeProposal,
+    Category,
+    ExchangeConflict,
+    ExchangeProposal,
+    IdempotencyKey,
+    UserProposalCounter,
+    reconcile_proposal_counters,
+)
+from ads.pagination import CursorPaginator
+from ads.ranking import RANKING_VERSION_KEY, AcceptStats, AdFeatures, get_ranking_engine
+from ads.search import InvertedIndex, get_search_backend
+from ads.testing import QueryBudgetMixin
+from config.metrics import DB_QUERIES, REGISTRY, install_query_recorder, render_metrics
+from config.replicas import ReplicaMonitor, ReplicaRouter, get_replica_monitor, pin_key
+from config.sessions import SessionMiddleware, SessionStore
+from users.backends import user_cache_key
 from users.models import User
 
+# Бюджеты запросов считаются с сессией и пользователем из базы: с кэшем их число зависит от того, прогрет ли кэш
+DATABASE_SESSIONS = {"SESSION_ENGINE": "django.contrib.sessions.backends.db", "USER_CACHE_TIMEOUT": 0}
+
 
 class AdTestCase(TestCase):
 
@@ -15,7 +76,7 @@ class AdTestCase(TestCase):
         self.ad = Ad.objects.create(
             title="Test title",
             description="Test description",
-            category="Test category",
+            category=Category.objects.get_for_name("Test category"),
             condition="other",
             user=self.user,
         )
@@ -83,14 +144,14 @@ class ExchangeProposalTestCase(TestCase):
         self.ad1 = Ad.objects.create(
             title="Test title 1",
             description="Test description 1",
-            category="Test category 1",
+            category=Category.objects.get_for_name("Test category 1"),
             condition="other",
             user=self.user1,
         )
         self.ad2 = Ad.objects.create(
             title="Test title 2",
             description="Test description 2",
-            category="Test category 2",
+            category=Category.objects.get_for_name("Test category 2"),
             condition="new",
             user=self.user2,
         )
@@ -161,4 +222,1933 @@ class ExchangeProposalTestCase(TestCase):
         response = self.client.post(reverse("ads:exchange-decline", args=[self.ep.id]))
         self.assertEqual(response.status_code, 302)
         self.ep.refresh_from_db()
-        self.assertEqual(self.ep.status, "declined")
\ No newline at end of file
+        self.assertEqual(self.ep.status, "declined")
+
+
+class ExchangeResolveTestCase(TestCase):
+    def setUp(self):
+        self.category = Category.objects.get_for_name("Электроника")
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.ad = self.create_ad(self.owner)
+        self.bidders = [User.objects.create_user(username=f"bidder{index}", password="password") for index in range(3)]
+        self.proposals = [
+            ExchangeProposal.objects.create(ad_sender=self.create_ad(bidder), ad_receiver=self.ad)
+            for bidder in self.bidders
+        ]
+        self.client.force_login(self.owner)
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            title="Ноутбук", description="Описание", category=self.category, condition="used", user=user
+        )
+
+    def statuses(self):
+        return [proposal.status for proposal in ExchangeProposal.objects.order_by("pk")]
+
+    def test_accept_declines_competing_proposals(self):
+        """Принятие отклоняет остальные ожидающие предложения с обоими товарами одним UPDATE."""
+        first, second, third = self.proposals
+        # Предложение, где товар второй стороны обмена отдаётся третьему пользователю, тоже конкурирует
+        unrelated = ExchangeProposal.objects.create(
+            ad_sender=self.create_ad(self.bidders[0]), ad_receiver=self.create_ad(self.bidders[1])
+        )
+        outgoing = ExchangeProposal.objects.create(ad_sender=second.ad_sender, ad_receiver=self.create_ad(self.owner))
+
+        get_cycle_engine().rebuild()
+        self.addCleanup(get_cycle_engine().rebuild)
+        graph = get_cycle_engine()._get_graph()
+        self.assertIn(self.owner.pk, graph.incoming)
+
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.assertTrue(second.resolve("accepted", self.owner))
+        updates = [query["sql"] for query in queries if query["sql"].startswith('UPDATE "ads_exchangeproposal"')]
+        self.assertEqual(len(updates), 2)
+
+        statuses = dict(ExchangeProposal.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[second.pk], "accepted")
+        self.assertEqual(statuses[first.pk], "declined")
+        self.assertEqual(statuses[third.pk], "declined")
+        self.assertEqual(statuses[outgoing.pk], "declined")
+        self.assertEqual(statuses[unrelated.pk], "waiting")
+        # Рёбра отклонённых предложений удаляются из графа после фиксации транзакции
+        self.assertNotIn(self.owner.pk, graph.incoming)
+        self.assertEqual(graph.outgoing[self.bidders[0].pk], {self.bidders[1].pk: 1})
+
+        with self.assertRaises(ExchangeConflict):
+            first.resolve("accepted", self.owner)
+        with self.assertRaises(ExchangeConflict):
+            second.resolve("declined", self.owner)
+
+    def test_idempotency_key(self):
+        """Повтор с тем же ключом ничего не меняет, а ключ другого действия отклоняется."""
+        first, second, _ = self.proposals
+        url = reverse("ads:exchange-accept", args=[first.pk])
+        response = self.client.post(url, {"idempotency_key": "retry"})
+        self.assertRedirects(response, reverse("ads:exchange-detail", args=[first.pk]))
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="retry")
+        self.assertRedirects(response, reverse("ads:exchange-detail", args=[first.pk]))
+        self.assertEqual(IdempotencyKey.objects.get().proposal, first)
+        self.assertEqual(self.statuses(), ["accepted", "declined", "declined"])
+        self.assertEqual(len(list(get_messages(response.wsgi_request))), 0)
+
+        first.refresh_from_db()
+        self.assertFalse(first.resolve("accepted", self.owner, "retry"))
+        with self.assertRaises(ExchangeConflict):
+            first.resolve("declined", self.owner, "retry")
+        with self.assertRaises(ExchangeConflict):
+            second.resolve("declined", self.owner, "retry")
+
+        # Повтор без ключа уже решённого предложения сообщает об ошибке и не меняет статус
+        response = self.client.post(url)
+        self.assertRedirects(response, reverse("ads:exchange-detail", args=[first.pk]))
+        self.assertEqual(
+            [str(message) for message in get_messages(response.wsgi_request)], ["На предложение уже ответили"]
+        )
+        self.assertEqual(self.statuses(), ["accepted", "declined", "declined"])
+
+    def test_detail_form_key(self):
+        """Формы принятия и отклонения отправляют ключ, новый при каждом показе страницы."""
+        url = reverse("ads:exchange-detail", args=[self.proposals[0].pk])
+        first = self.client.get(url).context["idempotency_key"]
+        response = self.client.get(url)
+        self.assertNotEqual(response.context["idempotency_key"], first)
+        self.assertContains(response, f'name="idempotency_key" value="{response.context["idempotency_key"]}"', count=2)
+
+
+@skipUnless(connection.vendor == "postgresql", "Блокировки строк проверяются только в PostgreSQL")
+class ExchangeResolveConcurrencyTestCase(TransactionTestCase):
+    """Одновременные принятия и отклонения в отдельных соединениях с базой."""
+
+    threads = 8
+
+    def setUp(self):
+        category = Category.objects.get_for_name("Электроника")
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.users = [User.objects.create_user(username=f"user{index}") for index in range(self.threads)]
+        self.ads = [
+            Ad.objects.create(title="Ноутбук", description="Описание", category=category, condition="used", user=user)
+            for user in [self.owner] + self.users
+        ]
+
+    def run_concurrently(self, calls):
+        """Выполняет вызовы в потоках одновременно; возвращает результаты и исключения в порядке вызовов."""
+        barrier = threading.Barrier(len(calls))
+        results = [None] * len(calls)
+
+        def run(position, call):
+            try:
+                barrier.wait()
+                results[position] = call()
+            except Exception as error:
+                results[position] = error
+            finally:
+                close_old_connections()
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=item) for item in enumerate(calls)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_accepts(self):
+        """Из предложений за один товар принимается ровно одно, остальные отклоняются."""
+        for _ in range(5):
+            ExchangeProposal.objects.all().delete()
+            ad = self.ads[0]
+            proposals = [ExchangeProposal.objects.create(ad_sender=other, ad_receiver=ad) for other in self.ads[1:]]
+            # Встречные предложения: товар владельца отдаётся другим пользователям, принимают они
+            proposals += [ExchangeProposal.objects.create(ad_sender=ad, ad_receiver=other) for other in self.ads[1:3]]
+            calls = [
+                (lambda proposal=proposal: proposal.resolve("accepted", proposal.ad_receiver.user))
+                for proposal in proposals
+            ]
+            calls += [lambda: proposals[0].resolve("declined", self.owner)]
+
+            results = self.run_concurrently(calls)
+            self.assertEqual(
+                results.count(True) + sum(isinstance(result, ExchangeConflict) for result in results), len(calls)
+            )
+            statuses = list(ExchangeProposal.objects.values_list("status", flat=True))
+            self.assertEqual(statuses.count("accepted"), results[:-1].count(True))
+            self.assertEqual(statuses.count("accepted"), 1)
+            self.assertEqual(statuses.count("waiting"), 0)
+
+    def test_concurrent_retries(self):
+        """Повторы одного запроса с тем же ключом применяются один раз."""
+        proposal = ExchangeProposal.objects.create(ad_sender=self.ads[1], ad_receiver=self.ads[0])
+        results = self.run_concurrently([lambda: proposal.resolve("accepted", self.owner, "retry")] * self.threads)
+        self.assertEqual(sorted(results), [False] * (self.threads - 1) + [True])
+        self.assertEqual(IdempotencyKey.objects.count(), 1)
+        proposal.refresh_from_db()
+        self.assertEqual(proposal.status, "accepted")
+
+
+class ProposalCounterTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.get_for_name("Электроника")
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.bidder = User.objects.create_user(username="bidder", password="password")
+        self.ad = self.create_ad(self.owner)
+        self.bidder_ads = [self.create_ad(self.bidder) for _ in range(2)]
+        self.proposals = [ExchangeProposal.objects.create(ad_sender=ad, ad_receiver=self.ad) for ad in self.bidder_ads]
+        self.client.force_login(self.owner)
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            title="Ноутбук", description="Описание", category=self.category, condition="used", user=user
+        )
+
+    def assertCounters(self, user, waiting_received, waiting_sent):
+        counter = UserProposalCounter.objects.get(user=user)
+        self.assertEqual((counter.waiting_received, counter.waiting_sent), (waiting_received, waiting_sent))
+        # Счётчики совпадают с таблицей предложений: сверке нечего исправлять
+        self.assertEqual(reconcile_proposal_counters(), 0)
+
+    def test_counters_follow_proposals(self):
+        self.assertCounters(self.owner, 2, 0)
+        self.assertCounters(self.bidder, 0, 2)
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.ad).proposal_count, 2)
+
+        # Принятие отклоняет второе предложение массовым UPDATE
+        self.proposals[0].resolve("accepted", self.owner)
+        self.assertCounters(self.owner, 0, 0)
+        self.assertCounters(self.bidder, 0, 0)
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.ad).proposal_count, 2)
+
+        proposal = ExchangeProposal.objects.get(pk=self.proposals[1].pk)
+        proposal.status = "waiting"
+        proposal.ad_sender = self.create_ad(self.bidder)
+        proposal.save()
+        self.assertCounters(self.owner, 1, 0)
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.bidder_ads[1]).proposal_count, 0)
+
+        self.ad.delete()
+        self.assertCounters(self.owner, 0, 0)
+        self.assertCounters(self.bidder, 0, 0)
+        self.assertFalse(AdProposalCounter.objects.filter(ad_id=self.ad.pk).exists())
+
+    def test_reconcile_command(self):
+        UserProposalCounter.objects.filter(user=self.owner).update(waiting_received=7)
+        AdProposalCounter.objects.filter(ad=self.ad).delete()
+        output = StringIO()
+        call_command("reconcile_proposal_counters", stdout=output)
+        self.assertIn("исправлено строк - 1", output.getvalue())
+        self.assertCounters(self.owner, 2, 0)
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.ad).proposal_count, 2)
+
+    def test_header_badges(self):
+        """Значки в шапке берутся из счётчиков без запросов к предложениям, новое предложение меняет ETag."""
+        url = reverse("ads:ad-list")
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertContains(response, '<span class="badge bg-danger">2</span>', html=True)
+        self.assertFalse([query for query in queries if "ads_exchangeproposal" in query["sql"]])
+        etag = response.headers["ETag"]
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+
+        ExchangeProposal.objects.create(ad_sender=self.create_ad(self.bidder), ad_receiver=self.ad)
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertContains(response, '<span class="badge bg-danger">3</span>', html=True)
+        self.assertNotContains(self.client_class().get(url), "Полученные предложения")
+
+
+class ProposalArchiveTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.category = Category.objects.get_for_name("Электроника")
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.bidder = User.objects.create_user(username="bidder", password="password")
+        self.ad = self.create_ad(self.owner)
+        self.bidder_ad = self.create_ad(self.bidder)
+        statuses = ["accepted", "declined", "waiting", "declined", "accepted"]
+        self.proposals = [
+            ExchangeProposal.objects.create(
+                ad_sender=self.bidder_ad, ad_receiver=self.ad, status=status, comment=f"Комментарий {number}"
+            )
+            for number, status in enumerate(statuses)
+        ]
+        # Последнее предложение создано недавно, остальные - раньше срока переноса в архив
+        old = [proposal.pk for proposal in self.proposals[:-1]]
+        ExchangeProposal.objects.filter(pk__in=old).update(created_at=archive_cutoff() - datetime.timedelta(days=1))
+        IdempotencyKey.objects.create(key="key", user=self.owner, proposal=self.proposals[0], status="accepted")
+        self.archived = [self.proposals[0].pk, self.proposals[1].pk, self.proposals[3].pk]
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            title="Ноутбук", description="Описание", category=self.category, condition="used", user=user
+        )
+
+    def test_archive_command(self):
+        """Переносятся только старые решённые предложения, счётчики предложений и доли принятия не меняются."""
+        stats = AcceptStats()
+        output = StringIO()
+        call_command("archive_proposals", batch_size=2, verbosity=2, stdout=output)
+        self.assertIn("перенесено 2", output.getvalue())
+        self.assertIn(f"всего перенесено: 3, последний ключ: {self.archived[-1]}", output.getvalue())
+
+        self.assertQuerySetEqual(
+            ExchangeProposal.objects.order_by("pk").values_list("pk", flat=True),
+            [self.proposals[2].pk, self.proposals[4].pk],
+        )
+        archived = ArchivedExchangeProposal.objects.get(pk=self.proposals[1].pk)
+        self.assertEqual(
+            (archived.ad_sender, archived.ad_receiver, archived.status, archived.comment),
+            (self.bidder_ad, self.ad, "declined", "Комментарий 1"),
+        )
+        self.assertEqual(archived.created_at, archive_cutoff() - datetime.timedelta(days=1))
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.ad).proposal_count, 5)
+        self.assertEqual(reconcile_proposal_counters(), 0)
+        archived_stats = AcceptStats()
+        self.assertEqual(archived_stats.users.tolist(), stats.users.tolist())
+        self.assertEqual(archived_stats.rates.tolist(), stats.rates.tolist())
+        self.assertEqual(archived_stats.category.tolist(), stats.category.tolist())
+
+        # Удаление товара удаляет его архивные предложения и уменьшает счётчик второго товара
+        self.ad.delete()
+        self.assertFalse(ArchivedExchangeProposal.objects.exists())
+        self.assertEqual(AdProposalCounter.objects.get(ad=self.bidder_ad).proposal_count, 0)
+        self.assertEqual(reconcile_proposal_counters(), 0)
+
+    def test_resume(self):
+        """Перенос ограниченным числом пачек продолжается с последнего перенесённого ключа."""
+        cutoff = archive_cutoff()
+        last, moved = archive_resolved_proposals(cutoff, batch_size=1, max_batches=2)
+        self.assertEqual((last, moved), (self.archived[1], 2))
+        self.assertEqual(archive_resolved_proposals(cutoff, after=last), (self.archived[2], 1))
+        self.assertEqual(archive_resolved_proposals(cutoff), (0, 0))
+        self.assertEqual(sorted(ArchivedExchangeProposal.objects.values_list("pk", flat=True)), self.archived)
+
+    def test_read_path(self):
+        """Страница предложения и архив пользователя находят перенесённые предложения."""
+        archive_resolved_proposals(archive_cutoff())
+        url = reverse("ads:exchange-detail", args=[self.archived[0]])
+
+        self.client.force_login(self.bidder)
+        response = self.client.get(url)
+        self.assertContains(response, "в архиве с")
+        self.assertNotContains(response, "Редактировать")
+        self.assertEqual(self.client.get(reverse("ads:exchange-update", args=[self.archived[0]])).status_code, 404)
+        response = self.client.get(reverse("ads:exchange-archive"))
+        self.assertContains(response, "Архив предложений обмена")
+        self.assertEqual([proposal.pk for proposal in response.context["object_list"]], self.archived[::-1])
+
+        stranger = User.objects.create_user(username="stranger", password="password")
+        self.client.force_login(stranger)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertFalse(self.client.get(reverse("ads:exchange-archive")).context["object_list"])
+        self.assertEqual(self.client.get(reverse("ads:exchange-detail", args=[0])).status_code, 404)
+
+
+class AdSearchTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test_user", password="password")
+        get_search_backend().rebuild()
+        self.laptop = Ad.objects.create(
+            title="Ноутбук Asus ZenBook",
+            description="Ультрабук в отличном состоянии",
+            category=Category.objects.get_for_name("Электроника"),
+            condition="used",
+            user=self.user,
+        )
+        self.bag = Ad.objects.create(
+            title="Сумка",
+            description="Подходит для ноутбука до 15 дюймов",
+            category=Category.objects.get_for_name("Аксессуары"),
+            condition="new",
+            user=self.user,
+        )
+        self.sofa = Ad.objects.create(
+            title="Кожаный диван",
+            description="Диван из натуральной кожи",
+            category=Category.objects.get_for_name("Мебель"),
+            condition="used",
+            user=self.user,
+        )
+
+    def search(self, **params):
+        response = self.client.get(reverse("ads:search"), params)
+        self.assertEqual(response.status_code, 200)
+        return list(response.context["ads"])
+
+    def test_search_word_forms(self):
+        """Поиск находит другие формы слова и ставит совпадения в названии выше."""
+        self.assertEqual(self.search(search="ноутбуки"), [self.laptop, self.bag])
+
+    def test_search_partial_word(self):
+        """Поиск по началу слова."""
+        self.assertEqual(self.search(search="ноут"), [self.laptop, self.bag])
+        self.assertEqual(self.search(search="дива"), [self.sofa])
+
+    def test_search_all_words(self):
+        """Найденный товар содержит все слова запроса."""
+        self.assertEqual(self.search(search="кожаный диван"), [self.sofa])
+        self.assertEqual(self.search(search="кожаный ноутбук"), [])
+
+    def test_search_with_filters(self):
+        """Поиск сочетается с фильтрами по категории и состоянию."""
+        self.assertEqual(self.search(search="ноутбук", category="аксессуары"), [self.bag])
+        self.assertEqual(self.search(search="ноутбук", condition="used"), [self.laptop])
+
+    def test_search_index_follows_changes(self):
+        """Индекс обновляется при изменении и удалении товара."""
+        self.sofa.title = "Кресло"
+        self.sofa.description = "Мягкое кресло"
+        self.sofa.save()
+        self.bag.delete()
+        self.assertEqual(self.search(search="кресло"), [self.sofa])
+        self.assertEqual(self.search(search="диван"), [])
+        self.assertEqual(self.search(search="ноутбук"), [self.laptop])
+
+    def test_inverted_index(self):
+        """Инвертированный индекс на Python ранжирует совпадения в названии выше."""
+        index = InvertedIndex()
+        index.add(1, "Сумка", "для ноутбука")
+        index.add(2, "Ноутбук", "")
+        self.assertEqual([ad_id for ad_id, _ in index.search("ноутбуки")], [2, 1])
+        index.remove(2)
+        self.assertEqual([ad_id for ad_id, _ in index.search("ноут")], [1])
+
+
+@override_settings(ADS_PAGINATION="cursor")
+class CursorPaginationTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.other = User.objects.create_user(username="other_user", password="password")
+        category = Category.objects.get_for_name("Category")
+        self.ads = [
+            Ad.objects.create(
+                title=f"Title {i}", description="Description", category=category, condition="new", user=self.user
+            )
+            for i in range(20)
+        ]
+        self.other_ad = Ad.objects.create(
+            title="Other title", description="Description", category=category, condition="new", user=self.other
+        )
+        self.client.force_login(self.user)
+
+    def collect_pages(self, url, context_name="object_list"):
+        """Проходит по всем страницам списка по ссылкам ?after= и возвращает их содержимое."""
+        pages = []
+        params = {}
+        while True:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([query for query in queries if "COUNT(" in query["sql"]])
+            pages.append(list(response.context[context_name]))
+            page = response.context["page_obj"]
+            if not page.has_next():
+                return pages
+            self.assertContains(response, f"?after={page.next_cursor}")
+            params = {"after": page.next_cursor}
+
+    def test_ad_list_pages(self):
+        """Keyset-пагинация проходит все товары по порядку id без COUNT(*)."""
+        pages = self.collect_pages(reverse("ads:ad-list"))
+        self.assertEqual([len(page) for page in pages], [15, 6])
+        self.assertEqual(sum(pages, []), self.ads + [self.other_ad])
+
+    def test_user_ad_list_pages(self):
+        """Списки своих и чужих товаров тоже пагинируются курсором."""
+        self.assertEqual(sum(self.collect_pages(reverse("ads:user-ad-list")), []), self.ads)
+        self.assertEqual(sum(self.collect_pages(reverse("ads:not-user-ad-list")), []), [self.other_ad])
+
+    def test_exchange_list_pages(self):
+        """Предложения сортируются по статусу и id, курсор учитывает обе колонки."""
+        proposals = [
+            ExchangeProposal.objects.create(ad_sender=ad, ad_receiver=self.other_ad, status=status)
+            for ad, status in zip(self.ads, ["waiting", "accepted", "declined"] * 7)
+        ]
+        pages = self.collect_pages(reverse("ads:sent-exchange-list"))
+        self.assertEqual([len(page) for page in pages], [15, 5])
+        self.assertEqual(sum(pages, []), sorted(proposals, key=lambda proposal: proposal.status, reverse=True))
+
+    def test_invalid_cursor(self):
+        """Испорченный курсор даёт 404."""
+        response = self.client.get(reverse("ads:ad-list"), {"after": "not-a-cursor"})
+        self.assertEqual(response.status_code, 404)
+
+    def test_tampered_cursor(self):
+        """Курсор правильного формата, но со значениями не того типа, тоже даёт 404, а не ошибку сервера."""
+        for values in (["x"], [None], [[1]]):
+            cursor = CursorPaginator.encode_cursor(values)
+            response = self.client.get(reverse("ads:ad-list"), {"after": cursor})
+            self.assertEqual(response.status_code, 404)
+        cursor = CursorPaginator.encode_cursor(["x", 1])
+        response = self.client.get(reverse("ads:sent-exchange-list"), {"after": cursor})
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(**DATABASE_SESSIONS)
+class QueryBudgetTestCase(QueryBudgetMixin, TestCase):
+    """Число запросов страниц не зависит от количества товаров и предложений на них."""
+
+    def setUp(self):
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.own_ad = self.create_ad(self.user)
+        self.client.force_login(self.user)
+
+    def create_ad(self, user):
+        return Ad.objects.create(
+            title=f"Ноутбук {user.username}",
+            description="Description",
+            category=Category.objects.get_for_name("Category"),
+            condition="new",
+            user=user,
+        )
+
+    def create_other_ad(self):
+        return self.create_ad(User.objects.create_user(username=f"user_{User.objects.count()}"))
+
+    def populate_ads(self, size):
+        while Ad.objects.exclude(user=self.user).count() < size:
+            self.create_other_ad()
+
+    def populate_own_ads(self, size):
+        while self.user.ads.count() < size:
+            self.create_ad(self.user)
+
+    def populate_sent(self, size):
+        while ExchangeProposal.objects.filter(ad_sender__user=self.user).count() < size:
+            ExchangeProposal.objects.create(ad_sender=self.create_ad(self.user), ad_receiver=self.create_other_ad())
+
+    def populate_received(self, size):
+        while ExchangeProposal.objects.filter(ad_receiver__user=self.user).count() < size:
+            ExchangeProposal.objects.create(ad_sender=self.create_other_ad(), ad_receiver=self.create_ad(self.user))
+
+    def test_ad_lists(self):
+        # Сессия и пользователь, COUNT(*) и страница
+        self.assertQueryBudget(reverse("ads:ad-list"), 4, self.populate_ads)
+        self.assertQueryBudget(reverse("ads:not-user-ad-list"), 4, self.populate_ads)
+        self.assertQueryBudget(reverse("ads:user-ad-list"), 4, self.populate_own_ads)
+
+    def test_search(self):
+        # Сессия и пользователь, результаты поиска, страница и категории для фильтра
+        self.assertQueryBudget(reverse("ads:search"), 5, self.populate_ads)
+        self.assertQueryBudget(reverse("ads:search"), 5, self.populate_ads, data={"search": "ноутбук"})
+
+    def test_exchange_lists(self):
+        self.assertQueryBudget(reverse("ads:sent-exchange-list"), 4, self.populate_sent)
+        self.assertQueryBudget(reverse("ads:received-exchange-list"), 4, self.populate_received)
+
+    def test_exchange_forms(self):
+        # Сессия и пользователь, проверка наличия своих товаров и подходящие пары; списки товаров не загружаются
+        self.assertQueryBudget(reverse("ads:exchange-create"), 4, self.populate_ads)
+        self.populate_sent(1)
+        proposal = ExchangeProposal.objects.get()
+        # Сессия, пользователь, предложение вместе с проверкой прав и выбранный товар
+        self.assertQueryBudget(reverse("ads:exchange-update", args=[proposal.pk]), 4, self.populate_own_ads)
+        self.assertQueryBudget(reverse("ads:ad-autocomplete"), 3, self.populate_ads, data={"scope": "others"})
+
+    def test_details(self):
+        ad = self.create_other_ad()
+        with self.assertNumQueries(3):
+            self.client.get(reverse("ads:ad-detail", args=[ad.pk]))
+        self.populate_sent(1)
+        proposal = ExchangeProposal.objects.get()
+        # Предложение, оба товара и их авторы загружаются вместе с проверкой прав одним запросом
+        with self.assertNumQueries(3):
+            self.client.get(reverse("ads:exchange-detail", args=[proposal.pk]))
+
+    def test_foreign_objects(self):
+        """Чужой объект стоит одного запроса после сессии и пользователя, отсутствующий даёт 404."""
+        ad = self.create_other_ad()
+        proposal = ExchangeProposal.objects.create(ad_sender=ad, ad_receiver=self.create_other_ad())
+        received = ExchangeProposal.objects.create(ad_sender=self.own_ad, ad_receiver=ad)
+        responses = [
+            ("ads:ad-update", ad, 302),
+            ("ads:ad-delete", ad, 403),
+            ("ads:exchange-detail", proposal, 403),
+            ("ads:exchange-update", proposal, 302),
+            ("ads:exchange-delete", proposal, 403),
+            ("ads:exchange-accept", received, 302),
+            ("ads:exchange-decline", received, 302),
+        ]
+        for name, obj, status_code in responses:
+            with self.subTest(name), self.assertNumQueries(3):
+                self.assertEqual(self.client.get(reverse(name, args=[obj.pk])).status_code, status_code)
+            self.assertEqual(self.client.get(reverse(name, args=[0])).status_code, 404)
+        received.refresh_from_db()
+        self.assertEqual(received.status, "waiting")
+
+
+@skipUnless(connection.vendor == "postgresql", "Планы запросов проверяются только в PostgreSQL")
+@override_settings(ADS_PAGINATION="cursor")
+class QueryPlanTestCase(TestCase):
+    """
+    Запросы представлений к большим таблицам используют индексы, а не последовательное чтение.
+
+    EXPLAIN выполняется с enable_seqscan = off: на тестовом объёме планировщик вправе предпочесть Seq Scan,
+    но если он остаётся в плане и при запрете, значит, подходящего индекса для запроса нет.
+    """
+
+    HOT_TABLES = ("ads_ad", "ads_exchangeproposal")
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = random.Random(0)
+        users = User.objects.bulk_create([User(username=f"plan_user_{i}") for i in range(200)])
+        categories = get_categories()
+        Ad.objects.bulk_create([make_ad(rng, rng.choice(users), categories) for _ in range(20_000)])
+        ads = list(Ad.objects.only("id"))
+        ExchangeProposal.objects.bulk_create(
+            [
+                ExchangeProposal(ad_sender=rng.choice(ads), ad_receiver=rng.choice(ads), status=status)
+                for status in rng.choices(["waiting", "accepted", "declined"], k=20_000)
+            ]
+        )
+        analyze()
+        cls.user = users[0]
+        cls.ad = cls.user.ads.first()
+        cls.proposal = ExchangeProposal.objects.filter(ad_sender__user=cls.user).first()
+
+    def setUp(self):
+        self.client.force_login(self.user)
+
+    def assertNoSeqScan(self, url, data=None):
+        """Выполняет EXPLAIN для каждого запроса представления к HOT_TABLES."""
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url, data)
+        self.assertEqual(response.status_code, 200)
+
+        for query in context.captured_queries:
+            sql = query["sql"]
+            if not any(f'"{table}"' in sql for table in self.HOT_TABLES):
+                continue
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+                cursor.execute(f"EXPLAIN {sql}")
+                plan = "\n".join(row[0] for row in cursor.fetchall())
+                cursor.execute("RESET enable_seqscan")
+            for table in self.HOT_TABLES:
+                self.assertNotRegex(plan, rf"Seq Scan on {table}\b", sql)
+
+    def test_ad_lists(self):
+        self.assertNoSeqScan(reverse("ads:ad-list"))
+        after = self.client.get(reverse("ads:ad-list")).context["page_obj"].next_cursor
+        self.assertNoSeqScan(reverse("ads:ad-list"), {"after": after})
+        self.assertNoSeqScan(reverse("ads:user-ad-list"))
+        self.assertNoSeqScan(reverse("ads:not-user-ad-list"))
+
+    def test_search(self):
+        self.assertNoSeqScan(reverse("ads:search"), {"category": "мебель"})
+        self.assertNoSeqScan(reverse("ads:search"), {"condition": "display"})
+        self.assertNoSeqScan(reverse("ads:search"), {"search": "гитара"})
+
+    def test_exchange_lists(self):
+        self.assertNoSeqScan(reverse("ads:sent-exchange-list"))
+        self.assertNoSeqScan(reverse("ads:received-exchange-list"))
+
+    def test_details(self):
+        self.assertNoSeqScan(reverse("ads:ad-detail", args=[self.ad.pk]))
+        self.assertNoSeqScan(reverse("ads:exchange-detail", args=[self.proposal.pk]))
+
+
+class CategoryFacetTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.electronics = Category.objects.get_for_name("Электроника")
+        self.ad = Ad.objects.create(
+            title="Ноутбук", description="Description", category=self.electronics, condition="used", user=self.user
+        )
+        Ad.objects.create(
+            title="Смартфон", description="Description", category=self.electronics, condition="new", user=self.user
+        )
+        self.client.force_login(self.user)
+
+    def facets(self):
+        return set(AdFacet.objects.filter(ad_count__gt=0).values_list("category__name", "condition", "ad_count"))
+
+    def test_category_lookup(self):
+        """Категории сопоставляются без учёта регистра и лишних пробелов."""
+        self.assertEqual(Category.objects.get_for_name("  электроника "), self.electronics)
+        self.assertEqual(Category.objects.count(), 1)
+
+    def test_invalid_form_creates_no_category(self):
+        """Форма с ошибкой в другом поле не создаёт категорию."""
+        data = {"title": "", "description": "Description", "category": "Мебель", "condition": "new"}
+        response = self.client.post(reverse("ads:ad-create"), data)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(Category.objects.filter(key="мебель").exists())
+
+        data["title"] = "Стул"
+        self.client.post(reverse("ads:ad-create"), data)
+        self.assertEqual(Ad.objects.get(title="Стул").category.name, "Мебель")
+
+    def test_facets_follow_changes(self):
+        """Счётчики меняются при создании, изменении и удалении товаров."""
+        self.assertEqual(self.facets(), {("Электроника", "used", 1), ("Электроника", "new", 1)})
+
+        data = {"title": "Ноутбук", "description": "Description", "category": "мебель", "condition": "new"}
+        self.client.post(reverse("ads:ad-update", args=[self.ad.pk]), data)
+        self.assertEqual(self.facets(), {("Электроника", "new", 1), ("мебель", "new", 1)})
+
+        data["category"] = "ЭЛЕКТРОНИКА"
+        self.client.post(reverse("ads:ad-create"), data)
+        self.assertEqual(self.facets(), {("Электроника", "new", 2), ("мебель", "new", 1)})
+
+        self.client.post(reverse("ads:ad-delete", args=[self.ad.pk]))
+        self.assertEqual(self.facets(), {("Электроника", "new", 2)})
+
+        AdFacet.rebuild()
+        self.assertEqual(self.facets(), {("Электроника", "new", 2)})
+
+    def test_search_sidebar(self):
+        """Фильтры поиска показывают счётчики и не читают таблицу товаров целиком."""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse("ads:search"))
+        self.assertEqual(response.context["categories"], [("Электроника", 2)])
+        self.assertIn(("used", "б/у", 1), response.context["condition_choices"])
+        self.assertContains(response, "Электроника (2)")
+        self.assertFalse([query for query in queries if "DISTINCT" in query["sql"]])
+
+
+class AdImageTestCase(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.client.force_login(self.user)
+
+    @staticmethod
+    def make_image(name="photo.png", size=(1200, 800)):
+        buffer = BytesIO()
+        Image.new("RGB", size, "orange").save(buffer, "PNG")
+        return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+    def test_upload_builds_variants(self):
+        """При загрузке изображения создаются уменьшенные копии, а список показывает их через srcset."""
+        data = {"title": "Ноутбук", "description": "Description", "category": "электроника", "condition": "new"}
+        self.client.post(reverse("ads:ad-create"), {**data, "image_url": self.make_image()})
+
+        ad = Ad.objects.get()
+        self.assertEqual([width for width, _ in ad.image_variants["sources"]["webp"]], [320, 640, 960])
+        self.assertTrue(ad.image_placeholder.startswith("data:image/jpeg;base64,"))
+        for files in ad.image_variants["sources"].values():
+            for width, name in files:
+                self.assertTrue(default_storage.exists(name))
+                with default_storage.open(name) as file:
+                    self.assertEqual(Image.open(file).width, width)
+
+        response = self.client.get(reverse("ads:ad-list"))
+        self.assertContains(response, 'type="image/webp"')
+        self.assertContains(response, "320w")
+        self.assertContains(response, 'loading="lazy"')
+
+        # Замена изображения удаляет копии прежнего
+        old_names = [name for files in ad.image_variants["sources"].values() for _, name in files]
+        self.client.post(reverse("ads:ad-update", args=[ad.pk]), {**data, "image_url": self.make_image("new.png")})
+        ad.refresh_from_db()
+        self.assertEqual(len(ad.image_variants["sources"]["jpeg"]), 3)
+        self.assertFalse([name for name in old_names if default_storage.exists(name)])
+
+    def test_small_image_is_not_upscaled(self):
+        default_storage.save("ads/small.png", self.make_image(size=(200, 100)))
+        ad = Ad.objects.create(
+            title="Книга",
+            description="Description",
+            category=Category.objects.get_for_name("книги"),
+            condition="used",
+            user=self.user,
+            image_url="ads/small.png",
+        )
+        ad.refresh_image_variants()
+        self.assertEqual(ad.image_variants["sources"]["jpeg"][0][0], 200)
+
+    def test_variants_do_not_overwrite_other_images(self):
+        """Копии изображений с одинаковым именем и разными расширениями не затирают друг друга."""
+        png = build_variants(default_storage.save("ads/photo.png", self.make_image()))
+        jpg = build_variants(default_storage.save("ads/photo.jpg", self.make_image()))
+        png_names = [name for files in png["sources"].values() for _, name in files]
+        jpg_names = [name for files in jpg["sources"].values() for _, name in files]
+        self.assertIn("ads/variants/photo-png-320.webp", png_names)
+        self.assertFalse(set(png_names) & set(jpg_names))
+        self.assertTrue(all(default_storage.exists(name) for name in png_names + jpg_names))
+
+    def test_backfill_command(self):
+        """Команда создаёт копии для объявлений, загруженных раньше."""
+        category = Category.objects.get_for_name("электроника")
+        for number in range(3):
+            name = default_storage.save(f"ads/photo{number}.png", self.make_image())
+            Ad.objects.create(
+                title="Ноутбук",
+                description="Description",
+                category=category,
+                condition="new",
+                user=self.user,
+                image_url=name,
+            )
+        Ad.objects.create(
+            title="Без фото", description="Description", category=category, condition="new", user=self.user
+        )
+
+        output = StringIO()
+        ad = Ad.objects.exclude(image_url="").first()
+        version = get_ad_version(ad.pk)
+        call_command("build_image_variants", workers=1, stdout=output)
+        self.assertIn("3 из 3", output.getvalue())
+        self.assertFalse(Ad.objects.exclude(image_url="").filter(image_variants={}).exists())
+        # Карточки и ETag в кэше ссылаются на прежние копии, поэтому версия товара меняется
+        self.assertNotEqual(get_ad_version(ad.pk), version)
+        self.assertGreater(Ad.objects.get(pk=ad.pk).updated_at, ad.updated_at)
+
+        # Повторный запуск пропускает объявления, для которых копии уже есть
+        call_command("build_image_variants", workers=1, stdout=output)
+        self.assertIn("Нет изображений для обработки", output.getvalue())
+
+        # Пересоздание копий удаляет прежние файлы
+        variants = Ad.objects.exclude(image_variants={}).values_list("image_variants", flat=True)
+        old_names = [name for item in variants for files in item["sources"].values() for _, name in files]
+        call_command("build_image_variants", workers=1, force=True, stdout=output)
+        self.assertFalse([name for name in old_names if default_storage.exists(name)])
+
+
+class ConditionalGetTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.ad = Ad.objects.create(
+            title="Ноутбук",
+            description="Description",
+            category=Category.objects.get_for_name("электроника"),
+            condition="new",
+            user=self.user,
+        )
+        self.client.force_login(self.user)
+
+    def test_detail_not_modified(self):
+        """Повторный запрос с тем же ETag получает 304 без запросов к товару и отрисовки шаблона."""
+        url = reverse("ads:ad-detail", args=[self.ad.pk])
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertIn("no-cache", response.headers["Cache-Control"])
+        self.assertIn("Last-Modified", response.headers)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertFalse(response.content)
+        self.assertFalse([query for query in queries if "ads_ad" in query["sql"]])
+
+        self.ad.title = "Ноутбук Asus"
+        self.ad.save()
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers["ETag"], etag)
+
+    def test_detail_version_restored_from_database(self):
+        """После очистки кэша версия восстанавливается по updated_at, и ETag не меняется."""
+        url = reverse("ads:ad-detail", args=[self.ad.pk])
+        etag = self.client.get(url).headers["ETag"]
+        cache.clear()
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+        self.assertEqual(self.client.get(reverse("ads:ad-detail", args=[0])).status_code, 404)
+
+    def test_list_version_changes(self):
+        url = reverse("ads:ad-list")
+        response = self.client.get(url)
+        etag = response.headers["ETag"]
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 304)
+
+        last_modified = response.headers["Last-Modified"]
+        self.assertEqual(self.client.get(url, headers={"if-modified-since": last_modified}).status_code, 304)
+
+        self.client.post(reverse("ads:ad-delete", args=[self.ad.pk]))
+        response = self.client.get(url, headers={"if-none-match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotContains(response, "Ноутбук")
+
+    def test_etag_depends_on_user(self):
+        """Страницы содержат имя пользователя, поэтому другой пользователь не получает чужую копию."""
+        url = reverse("ads:ad-list")
+        etag = self.client.get(url).headers["ETag"]
+        self.client.force_login(User.objects.create_user(username="other_user", password="password"))
+        self.assertEqual(self.client.get(url, headers={"if-none-match": etag}).status_code, 200)
+
+
+class AdCardCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.ad = Ad.objects.create(
+            title="Ноутбук",
+            description="Description",
+            category=Category.objects.get_for_name("электроника"),
+            condition="new",
+            user=self.user,
+        )
+
+    def test_card_cached_until_ad_changes(self):
+        """Карточка берётся из кэша, пока товар не сохранён заново."""
+        url = reverse("ads:ad-list")
+        self.assertContains(self.client.get(url), "Ноутбук")
+
+        # update() не меняет версию товара, поэтому в списке остаётся кэшированная карточка
+        Ad.objects.filter(pk=self.ad.pk).update(title="Планшет")
+        self.assertContains(self.client.get(url), "Ноутбук")
+        self.assertContains(self.client.get(reverse("ads:search")), "Ноутбук")
+
+        self.ad.refresh_from_db()
+        self.ad.save()
+        self.assertContains(self.client.get(url), "Планшет")
+        self.assertNotContains(self.client.get(url), "Ноутбук")
+
+
+class ImportAdsTestCase(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.user = User.objects.create_user(username="test_user", password="password")
+
+    def write(self, name, content):
+        path = f"{self.directory}/{name}"
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(content)
+        return path
+
+    def import_ads(self, path, **options):
+        output, errors = StringIO(), StringIO()
+        call_command("import_ads", path, stdout=output, stderr=errors, **options)
+        return output.getvalue(), errors.getvalue()
+
+    def test_iter_json_streams_items(self):
+        """Элементы массива читаются по частям, даже если не помещаются в буфер."""
+        items = [{"title": "Ноутбук", "fields": {"text": "x" * 50}}, {"title": "Диван"}, [1, 2]]
+        with open("ads_fixture.json", encoding="utf-8") as file:
+            fixture = list(iter_json(file, chunk_size=7))
+        self.assertEqual(list(iter_json(StringIO(json.dumps(items, indent=2)), chunk_size=7)), items)
+        self.assertEqual(len(fixture), 23)
+
+    def test_import_fixture(self):
+        """Фикстура Django импортируется без loaddata: товары привязываются к существующим пользователям."""
+        with open("ads_fixture.json", encoding="utf-8") as file:
+            fixture = json.load(file)
+        for item in fixture:
+            if item["model"] == "ads.ad":
+                item["fields"]["user"] = self.user.pk
+                item["fields"]["image_url"] = ""
+        output, errors = self.import_ads(self.write("ads.json", json.dumps(fixture)), batch_size=3)
+
+        self.assertIn("Импортировано товаров: 10, пропущено: 0", output)
+        self.assertEqual(Ad.objects.filter(user=self.user).count(), 10)
+        self.assertEqual(sum(AdFacet.objects.values_list("ad_count", flat=True)), 10)
+        self.assertTrue(get_search_backend().search(Ad.objects.all(), "ноутбук").count())
+
+    def test_invalid_rows_are_skipped(self):
+        content = "title,description,category,condition,user\n"
+        content += "Ноутбук,Description,Электроника,new,test_user\n"
+        content += f"Диван,Description,Мебель,used,{self.user.pk}\n"
+        content += "Книга,Description,Книги,broken,test_user\n"
+        content += "Стол,Description,Мебель,new,unknown_user\n"
+        output, errors = self.import_ads(self.write("ads.csv", content))
+
+        self.assertIn("Импортировано товаров: 2, пропущено: 2", output)
+        self.assertIn("Запись 3: неизвестное состояние 'broken'", errors)
+        self.assertIn("Запись 4: пользователь unknown_user не найден", errors)
+        self.assertEqual(set(Ad.objects.values_list("title", flat=True)), {"Ноутбук", "Диван"})
+
+    def test_committed_batches_are_indexed_after_error(self):
+        """Ошибка чтения не откатывает сохранённые пачки, и они попадают в счётчики."""
+        row = {"description": "D", "category": "Электроника", "condition": "new", "user": "test_user"}
+        lines = [json.dumps({"title": f"Ноутбук {number}", **row}) for number in range(3)] + ["{"]
+        with self.assertRaisesMessage(CommandError, "Сохранено товаров до ошибки: 2"):
+            self.import_ads(self.write("ads.ndjson", "\n".join(lines)), batch_size=2)
+
+        self.assertEqual(Ad.objects.count(), 2)
+        self.assertEqual(sum(AdFacet.objects.values_list("ad_count", flat=True)), 2)
+
+    def test_unsafe_image_paths_are_skipped(self):
+        row = {"description": "D", "category": "Электроника", "condition": "new", "user": "test_user"}
+        rows = [
+            {"title": "Ноутбук", "image_url": "../../etc/passwd", **row},
+            {"title": "Диван", "image_url": "/etc/passwd", **row},
+            {"title": "Стол", "image_url": ["ads/photo.png"], **row},
+            {"title": "Книга", "image_url": "ads/" + "x" * 100 + ".png", **row},
+        ]
+        path = self.write("ads.ndjson", "\n".join(json.dumps(row) for row in rows))
+        output, errors = self.import_ads(path, images_dir=self.directory)
+
+        self.assertIn("Импортировано товаров: 0, пропущено: 4", output)
+        self.assertIn("Запись 1: недопустимый путь изображения '../../etc/passwd'", errors)
+        self.assertIn("Запись 3: некорректное изображение", errors)
+        self.assertFalse(Ad.objects.exists())
+
+    def test_images_are_copied(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        images = f"{self.directory}/images"
+        os.makedirs(f"{images}/ads")
+        Image.new("RGB", (10, 10)).save(f"{images}/ads/photo.png")
+
+        rows = [
+            {
+                "title": "Ноутбук",
+                "description": "D",
+                "category": "Электроника",
+                "condition": "new",
+                "user": "test_user",
+            },
+            {"title": "Диван", "description": "D", "category": "Мебель", "condition": "new", "user": "test_user"},
+        ]
+        rows[0]["image_url"] = "ads/photo.png"
+        rows[1]["image_url"] = "ads/missing.png"
+        path = self.write("ads.ndjson", "\n".join(json.dumps(row) for row in rows))
+        with override_settings(MEDIA_ROOT=media_root):
+            output, errors = self.import_ads(path, images_dir=images)
+            self.assertTrue(default_storage.exists("ads/photo.png"))
+
+        self.assertIn("изображение ads/missing.png не найдено", errors)
+        self.assertEqual(Ad.objects.get(title="Ноутбук").image_url.name, "ads/photo.png")
+        self.assertFalse(Ad.objects.get(title="Диван").image_url)
+
+    @skipUnless(connection.vendor == "postgresql", "COPY есть только в PostgreSQL")
+    def test_import_with_copy(self):
+        row = {"description": "D", "category": "Электроника", "condition": "new", "user": self.user.pk}
+        rows = [json.dumps({"title": f"Ноутбук {number}", **row}) for number in range(5)]
+        output, errors = self.import_ads(self.write("ads.ndjson", "\n".join(rows)), copy=True)
+
+        self.assertIn("Импортировано товаров: 5", output)
+        self.assertEqual(Ad.objects.filter(search_vector__isnull=False).count(), 5)
+        self.assertEqual(AdFacet.objects.get().ad_count, 5)
+
+
+class RequestReplayTestCase(TestCase):
+    def test_replay_covers_all_routes(self):
+        """Поток по умолчанию обращается ко всем маршрутам ads и users без ошибок сервера."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        output = f"{directory}/results.json"
+        call_command("benchmark_requests", size=30, proposals=5, passes=1, output=output, stdout=StringIO())
+
+        with open(output, encoding="utf-8") as file:
+            routes = json.load(file)["routes"]
+        replayed = {key.split()[1] for key in routes}
+        for namespace in ["ads", "users"]:
+            patterns = get_resolver().namespace_dict[namespace][1].url_patterns
+            self.assertLessEqual({f"{namespace}:{pattern.name}" for pattern in patterns}, replayed)
+
+        for key, route in routes.items():
+            self.assertFalse([code for code in route["statuses"] if code.startswith("5")], key)
+            self.assertGreaterEqual(route["p99_ms"], route["p50_ms"])
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        for histogram in REGISTRY:
+            histogram.clear()
+        self.user = User.objects.create_user(username="test_user", password="password")
+        Ad.objects.create(
+            title="Ноутбук",
+            description="Description",
+            category=Category.objects.get_for_name("электроника"),
+            condition="new",
+            user=self.user,
+        )
+
+    @override_settings(METRICS_ALLOW_LOCAL=True)
+    def test_metrics_endpoint(self):
+        """Запросы попадают в гистограммы по имени представления, /metrics отдаёт их в формате Prometheus."""
+        self.client.get(reverse("ads:ad-list"))
+        self.client.get(reverse("ads:ad-list"))
+        response = self.client.get(reverse("metrics"))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain; version=0.0.4"))
+        metrics = response.content.decode()
+        self.assertIn("# TYPE django_request_duration_seconds histogram", metrics)
+        self.assertIn('django_request_duration_seconds_count{view="ads:ad-list",method="GET",status="200"} 2', metrics)
+        self.assertIn('django_request_db_queries_bucket{view="ads:ad-list",le="+Inf"} 2', metrics)
+        self.assertIn('django_template_render_seconds_count{view="ads:ad-list"} 2', metrics)
+        self.assertIn('django_response_size_bytes_count{view="ads:ad-list"} 2', metrics)
+
+    def test_histogram_buckets_are_cumulative(self):
+        self.client.get(reverse("ads:ad-list"))
+        lines = [line for line in render_metrics().splitlines() if line.startswith("django_request_db_queries_bucket")]
+        counts = [int(line.rsplit(" ", 1)[1]) for line in lines]
+        self.assertEqual(counts, sorted(counts))
+        self.assertEqual(counts[0], 0)
+
+    def test_metrics_closed_without_token(self):
+        """Без токена локальный адрес не даёт доступа, пока это не разрешено явно: за прокси он у всех запросов."""
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+
+    @override_settings(METRICS_TOKEN="secret", METRICS_ALLOW_LOCAL=True)
+    def test_metrics_token(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 403)
+        response = self.client.get(reverse("metrics"), headers={"authorization": "Bearer secret"})
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(METRICS_SLOW_REQUEST_MS=0)
+    def test_slow_requests_are_logged(self):
+        with self.assertLogs("config.metrics", "WARNING") as logs:
+            self.client.get(reverse("ads:ad-list"))
+        self.assertIn("Медленный запрос GET /ads/ (ads:ad-list)", logs.output[0])
+        self.assertIn("SELECT", logs.output[0])
+
+
+class ExchangeCycleTestCase(TestCase):
+    def setUp(self):
+        get_cycle_engine().rebuild()
+        self.addCleanup(get_cycle_engine().rebuild)
+        category = Category.objects.get_for_name("электроника")
+        self.users = []
+        self.ads = []
+        for name in ["anna", "boris", "vera", "gleb"]:
+            user = User.objects.create_user(username=name, password="password")
+            self.users.append(user)
+            self.ads.append(
+                Ad.objects.create(
+                    title=f"Товар {name}", description="D", category=category, condition="new", user=user
+                )
+            )
+
+    def propose(self, sender, receiver, status="waiting"):
+        return ExchangeProposal.objects.create(
+            ad_sender=self.ads[sender], ad_receiver=self.ads[receiver], status=status
+        )
+
+    def test_graph_finds_cycles_by_length(self):
+        graph = ProposalGraph()
+        for source, target in [(1, 2), (2, 1), (2, 3), (3, 1), (3, 4), (4, 5), (5, 1), (1, 1)]:
+            graph.set_edge(source, target, 1)
+        self.assertEqual(graph.find_cycles(1, max_length=4), [(1, 2), (1, 2, 3)])
+        self.assertEqual(graph.find_cycles(1, max_length=5), [(1, 2), (1, 2, 3), (1, 2, 3, 4, 5)])
+        self.assertEqual(graph.find_cycles(1, max_length=5, limit=1), [(1, 2)])
+
+        graph.set_edge(2, 1, 0)
+        self.assertEqual(graph.find_cycles(2, max_length=3), [(2, 3, 1)])
+        self.assertEqual(len(graph), 6)
+
+    def test_suggest_three_party_cycle(self):
+        """Анна хочет товар Бориса, Борис - товар Веры, Вера - товар Анны."""
+        anna, boris, vera, gleb = self.users
+        first = self.propose(0, 1)
+        self.propose(1, 2)
+        self.assertEqual(get_cycle_engine().suggest(anna), [])
+
+        # Граф уже построен и дополняется сигналами
+        last = self.propose(2, 0)
+        cycles = get_cycle_engine().suggest(anna)
+        self.assertEqual(len(cycles), 1)
+        self.assertEqual(cycles[0][0], first)
+        self.assertEqual([proposal.ad_receiver.user for proposal in cycles[0]], [boris, vera, anna])
+        self.assertEqual(len(get_cycle_engine().suggest(vera)), 1)
+
+        # Принятое или отклонённое предложение больше не участвует в цепочках
+        last.status = "declined"
+        last.save()
+        self.assertEqual(get_cycle_engine().suggest(anna), [])
+
+    def test_changes_from_other_processes(self):
+        """Предложение, созданное в другом процессе, попадает в граф по версии в общем кэше."""
+        anna = self.users[0]
+        self.propose(0, 1)
+        self.assertEqual(get_cycle_engine().suggest(anna), [])
+
+        # Другой процесс: строка появляется без сигналов этого процесса, меняется только версия в кэше
+        ExchangeProposal.objects.bulk_create([ExchangeProposal(ad_sender=self.ads[1], ad_receiver=self.ads[0])])
+        self.assertEqual(get_cycle_engine().suggest(anna), [])
+        bump_shared_version(CYCLES_VERSION_KEY)
+        self.assertEqual(len(get_cycle_engine().suggest(anna)), 1)
+
+    def test_deleted_ad_removes_edges(self):
+        anna = self.users[0]
+        self.propose(0, 1)
+        self.propose(1, 0)
+        self.assertEqual(len(get_cycle_engine().suggest(anna)), 1)
+        self.ads[1].delete()
+        self.assertEqual(get_cycle_engine().suggest(anna), [])
+
+    def test_cycles_page(self):
+        self.propose(0, 1)
+        self.propose(1, 3)
+        self.propose(3, 0)
+        self.client.force_login(self.users[0])
+        response = self.client.get(reverse("ads:exchange-cycles"))
+        self.assertContains(response, "Участников: 3")
+        self.assertContains(response, "Товар gleb")
+
+
+class ExchangeRankingTestCase(TestCase):
+    def setUp(self):
+        get_ranking_engine().rebuild()
+        self.addCleanup(get_ranking_engine().rebuild)
+        self.anna, self.boris, self.vera = [
+            User.objects.create_user(username=name, password="password") for name in ["anna", "boris", "vera"]
+        ]
+
+    def create_ad(self, user, title, description="", category="Электроника", condition="new"):
+        return Ad.objects.create(
+            title=title,
+            description=description,
+            category=Category.objects.get_for_name(category),
+            condition=condition,
+            user=user,
+        )
+
+    def test_features_reuse_rows(self):
+        features = AdFeatures(capacity=2)
+        ads = [
+            Ad(pk=pk, title=f"Товар {pk}", description="", category_id=1, condition="new", user_id=1)
+            for pk in [1, 2, 3]
+        ]
+        for ad in ads:
+            features.set(ad)
+        self.assertEqual((len(features), features.size, len(features.ad)), (3, 3, 4))
+
+        features.remove(2)
+        features.set(Ad(pk=4, title="Новый", description="", category_id=1, condition="used", user_id=2))
+        self.assertEqual((len(features), features.size), (3, 3))
+        self.assertEqual(features.rows[4], 1)
+        self.assertAlmostEqual(float(features.text[:, 1] @ features.text[:, 1]), 1.0, places=5)
+
+    def test_rank_offers_by_text(self):
+        chair = self.create_ad(self.anna, "Кресло офисное", "Удобное кресло")
+        laptop = self.create_ad(self.anna, "Ноутбук игровой", "Мощный ноутбук")
+        wanted = self.create_ad(self.boris, "Ноутбук рабочий", "Лёгкий ноутбук")
+        self.assertEqual(get_ranking_engine().rank_offers(self.anna.pk, wanted.pk), [laptop.pk, chair.pk])
+        self.assertEqual(get_ranking_engine().rank_offers(self.anna.pk, 0), [])
+
+    def test_accept_rates_change_ranking(self):
+        book = self.create_ad(self.anna, "Гитара", category="Книги")
+        sofa = self.create_ad(self.anna, "Гитара", category="Мебель")
+        wanted = self.create_ad(self.boris, "Гитара")
+        self.assertEqual(get_ranking_engine().rank_offers(self.anna.pk, wanted.pk), [book.pk, sofa.pk])
+
+        # Предложения книг за электронику отклоняют, а мебели - принимают; доли пересчитываются после решения
+        target = self.create_ad(self.boris, "Телевизор")
+        for category, status in [("Книги", "declined"), ("Мебель", "accepted")]:
+            for _ in range(3):
+                proposal = ExchangeProposal.objects.create(
+                    ad_sender=self.create_ad(self.vera, "Стол", category=category), ad_receiver=target
+                )
+                proposal.status = status
+                proposal.save()
+        self.assertEqual(get_ranking_engine().rank_offers(self.anna.pk, wanted.pk), [sofa.pk, book.pk])
+
+        # Размер таблицы по категориям зависит от категорий решённых предложений, а не от наибольшего id
+        other = Category.objects.create(pk=10**6, name="Новая")
+        stats = AcceptStats()
+        self.assertEqual(stats.category.shape, (4, 4))
+        self.assertEqual(stats.category_positions(np.array([other.pk, target.category_id])).tolist()[0], 3)
+
+    def test_suggest_follows_changes(self):
+        laptop = self.create_ad(self.anna, "Ноутбук", "Игровой ноутбук")
+        self.create_ad(self.boris, "Палатка", "Туристическая палатка")
+        self.assertEqual(len(get_ranking_engine().suggest(self.anna.pk)), 1)
+
+        # Матрицы уже построены и дополняются сигналами
+        similar = self.create_ad(self.vera, "Ноутбук", "Игровой ноутбук")
+        pairs = get_ranking_engine().suggest(self.anna.pk)
+        self.assertEqual([pair[:2] for pair in pairs][0], (laptop.pk, similar.pk))
+        self.assertGreater(pairs[0][2], pairs[1][2])
+        self.assertEqual(len(get_ranking_engine().suggest(self.anna.pk, limit=1)), 1)
+
+        similar.delete()
+        self.assertNotIn(similar.pk, [pair[1] for pair in get_ranking_engine().suggest(self.anna.pk)])
+        self.assertEqual(get_ranking_engine().suggest(self.boris.pk)[0][1], laptop.pk)
+        self.assertEqual(get_ranking_engine().suggest(User.objects.create_user(username="gleb").pk), [])
+
+    def test_changes_from_other_processes(self):
+        """Товар, созданный в другом процессе, попадает в матрицы по версии в общем кэше."""
+        laptop = self.create_ad(self.anna, "Ноутбук", "Игровой ноутбук")
+        self.assertEqual(get_ranking_engine().suggest(self.anna.pk), [])
+
+        # Другой процесс: строка появляется без сигналов этого процесса, меняется только версия в кэше
+        category = Category.objects.get_for_name("Электроника")
+        [other] = Ad.objects.bulk_create(
+            [Ad(title="Ноутбук", description="Игровой ноутбук", category=category, condition="new", user=self.boris)]
+        )
+        self.assertEqual(get_ranking_engine().suggest(self.anna.pk), [])
+        bump_shared_version(RANKING_VERSION_KEY)
+        self.assertEqual([pair[:2] for pair in get_ranking_engine().suggest(self.anna.pk)], [(laptop.pk, other.pk)])
+
+    def test_create_page_ranks_own_ads(self):
+        chair = self.create_ad(self.anna, "Кресло", "Удобное кресло")
+        laptop = self.create_ad(self.anna, "Ноутбук", "Игровой ноутбук")
+        wanted = self.create_ad(self.boris, "Ноутбук", "Рабочий ноутбук")
+        self.client.force_login(self.anna)
+
+        response = self.client.get(reverse("ads:exchange-create"), {"ad_receiver": wanted.pk})
+        form = response.context["form"]
+        self.assertEqual(form.initial, {"ad_sender": laptop.pk, "ad_receiver": wanted.pk})
+        self.assertEqual(response.context["suggestions"][0], (laptop, wanted))
+        self.assertContains(response, f"?ad_sender={laptop.pk}&amp;ad_receiver={wanted.pk}")
+
+        # Свои товары в подсказках упорядочены по оценке пары с выбранным чужим товаром
+        response = self.client.get(reverse("ads:ad-autocomplete"), {"scope": "own", "receiver": wanted.pk})
+        self.assertEqual([item["id"] for item in response.json()["results"]], [laptop.pk, chair.pk])
+
+
+@override_settings(ADS_AUTOCOMPLETE_PAGE_SIZE=2, ADS_AUTOCOMPLETE_MAX_RESULTS=3)
+class AdAutocompleteTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="anna", password="password")
+        self.other = User.objects.create_user(username="boris", password="password")
+        category = Category.objects.get_for_name("Электроника")
+        self.ads = {}
+        for title, user in [
+            ("iPhone 12", self.other),
+            ("iphone 13", self.other),
+            ("IPHONE 14", self.other),
+            ("iPhone 15", self.other),
+            ("Ноутбук", self.other),
+            ("iPhone 11", self.user),
+        ]:
+            self.ads[title] = Ad.objects.create(
+                title=title, description="", category=category, condition="new", user=user
+            )
+        self.client.force_login(self.user)
+
+    def autocomplete(self, **params):
+        response = self.client.get(reverse("ads:ad-autocomplete"), params)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        return [item["text"] for item in data["results"]], data["more"]
+
+    def test_prefix_pages_and_cap(self):
+        self.assertEqual(self.autocomplete(scope="others", q=" IPHONE "), (["iPhone 12", "iphone 13"], True))
+        # Результатов больше трёх не отдаётся, даже если подходящих товаров больше
+        self.assertEqual(self.autocomplete(scope="others", q="iphone", page=2), (["IPHONE 14"], False))
+        self.assertEqual(self.autocomplete(scope="others", q="iphone", page=3), ([], False))
+        self.assertEqual(self.autocomplete(scope="others", q="Ноут"), (["Ноутбук"], False))
+        self.assertEqual(self.autocomplete(scope="own"), (["iPhone 11"], False))
+
+    def test_invalid_requests(self):
+        for params in [{}, {"scope": "all"}, {"scope": "own", "page": "0"}, {"scope": "own", "page": "x"}]:
+            self.assertEqual(self.client.get(reverse("ads:ad-autocomplete"), params).status_code, 400)
+        self.client.logout()
+        self.assertEqual(self.client.get(reverse("ads:ad-autocomplete"), {"scope": "own"}).status_code, 403)
+
+    def test_forms_render_only_selected_ads(self):
+        own, other = self.ads["iPhone 11"], self.ads["Ноутбук"]
+        response = self.client.get(reverse("ads:exchange-create"), {"ad_sender": own.pk, "ad_receiver": other.pk})
+        self.assertContains(response, "<option", count=4)
+        self.assertContains(response, f'<option value="{other.pk}" selected>Ноутбук</option>', html=True)
+        self.assertContains(response, 'data-autocomplete-scope="others"')
+        self.assertContains(response, "js/autocomplete.js")
+
+        proposal = ExchangeProposal.objects.create(ad_sender=own, ad_receiver=other)
+        response = self.client.get(reverse("ads:exchange-update", args=[proposal.pk]))
+        self.assertContains(response, "<option", count=2)
+        self.assertContains(response, f'data-autocomplete-receiver="{other.pk}"')
+
+        response = self.client.post(
+            reverse("ads:exchange-create"), {"ad_sender": own.pk, "ad_receiver": self.ads["iPhone 12"].pk}
+        )
+        self.assertEqual(response.status_code, 302)
+        response = self.client.post(reverse("ads:exchange-create"), {"ad_sender": other.pk, "ad_receiver": own.pk})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.context["form"].errors)
+
+
+@override_settings(**DATABASE_SESSIONS)
+class ApiTestCase(QueryBudgetMixin, TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="api_user", password="password")
+        self.other = User.objects.create_user(username="api_other", password="password")
+        self.category = Category.objects.get_for_name("Электроника")
+        self.own_ad = self.create_ad(self.user, "Ноутбук")
+        self.other_ad = self.create_ad(self.other, "Смартфон")
+        self.client.force_login(self.user)
+
+    def create_ad(self, user, title):
+        return Ad.objects.create(
+            title=title, description="Описание", category=self.category, condition="used", user=user
+        )
+
+    def url(self, name, pk=None):
+        kwargs = {"version": "v1"} if pk is None else {"version": "v1", "pk": pk}
+        return reverse(f"api:{name}", kwargs=kwargs)
+
+    def send(self, method, url, data):
+        return getattr(self.client, method)(url, json.dumps(data), content_type="application/json")
+
+    def test_ad_list(self):
+        """Курсорная пагинация, фильтры и sparse fieldsets списка товаров."""
+        for number in range(4):
+            self.create_ad(self.other, f"Планшет {number}")
+        response = self.client.get(self.url("ad-list"), {"limit": 4, "fields": "id,title"})
+        data = response.json()
+        self.assertEqual([set(item) for item in data["results"]], [{"id", "title"}] * 4)
+        self.assertEqual([item["title"] for item in data["results"]], [f"Планшет {number}" for number in (3, 2, 1, 0)])
+        data = self.client.get(data["next"]).json()
+        self.assertEqual([item["id"] for item in data["results"]], [self.other_ad.pk, self.own_ad.pk])
+        self.assertIsNone(data["next"])
+
+        ad = self.client.get(self.url("ad-detail", self.own_ad.pk)).json()
+        self.assertEqual(ad["category"], "Электроника")
+        self.assertEqual(ad["user"], self.user.pk)
+        self.assertIsNone(ad["image"])
+
+        response = self.client.get(self.url("ad-list"), {"category": "электроника", "user": self.user.pk})
+        self.assertEqual([item["id"] for item in response.json()["results"]], [self.own_ad.pk])
+        self.assertEqual(self.client.get(self.url("ad-list"), {"fields": "id,secret"}).status_code, 400)
+        self.assertEqual(self.client.get(self.url("ad-list"), {"after": "broken"}).status_code, 404)
+        self.assertEqual(self.client.get("/api/v2/ads/").status_code, 404)
+
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url("ad-list")).status_code, 200)
+        self.assertEqual(self.send("post", self.url("ad-list"), {"title": "Велосипед"}).status_code, 403)
+
+    def test_ad_list_queries(self):
+        def populate(size):
+            while Ad.objects.count() < size:
+                self.create_ad(self.other, "Планшет")
+
+        # Сессия и пользователь, страница товаров с категориями
+        self.assertQueryBudget(self.url("ad-list"), 3, populate)
+
+    def test_ad_write(self):
+        """Создание и изменение своих товаров; чужой товар изменить нельзя."""
+        data = {"title": "Велосипед", "description": "Горный", "category": "спорт", "condition": "used"}
+        response = self.send("post", self.url("ad-list"), data)
+        self.assertEqual(response.status_code, 201)
+        ad = Ad.objects.get(pk=response.json()["id"])
+        self.assertEqual((ad.user, ad.category.name), (self.user, "спорт"))
+
+        response = self.send("patch", self.url("ad-detail", ad.pk), {"title": "Шоссейный велосипед"})
+        self.assertEqual(response.json()["title"], "Шоссейный велосипед")
+        self.assertEqual(
+            self.send("patch", self.url("ad-detail", self.other_ad.pk), {"title": "Мой"}).status_code, 404
+        )
+        self.assertEqual(self.client.delete(self.url("ad-detail", self.other_ad.pk)).status_code, 404)
+        self.assertEqual(self.client.delete(self.url("ad-detail", ad.pk)).status_code, 204)
+
+    def test_ad_batch(self):
+        """Пакет товаров сохраняется целиком или не сохраняется вовсе."""
+        items = [
+            {"title": f"Книга {number}", "description": "Роман", "category": "Книги", "condition": "new"}
+            for number in range(3)
+        ]
+        response = self.send("post", self.url("ad-batch"), items[:2] + [{"title": "Без категории"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()), ["2"])
+        self.assertIn("category", response.json()["2"])
+        self.assertFalse(Ad.objects.filter(title__startswith="Книга").exists())
+        self.assertFalse(Category.objects.filter(key="книги").exists())
+
+        response = self.send("post", self.url("ad-batch"), items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Ad.objects.filter(title__startswith="Книга", user=self.user).count(), 3)
+        # Товары сохраняются с сигналами, поэтому счётчики категорий актуальны
+        self.assertEqual(AdFacet.objects.get(category__key="книги", condition="new").ad_count, 3)
+
+        ids = [item["id"] for item in response.json()]
+        updates = [{"id": pk, "condition": "used"} for pk in ids]
+        response = self.send("patch", self.url("ad-batch"), updates + [{"id": self.other_ad.pk, "title": "Мой"}])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"3": {"id": ["Объект не найден"]}})
+        response = self.send("patch", self.url("ad-batch"), updates)
+        self.assertEqual([item["condition"] for item in response.json()], ["used"] * 3)
+        self.assertEqual(AdFacet.objects.get(category__key="книги", condition="used").ad_count, 3)
+
+        with override_settings(ADS_API_MAX_BATCH=2):
+            self.assertEqual(self.send("post", self.url("ad-batch"), items).status_code, 400)
+        self.assertEqual(self.send("post", self.url("ad-batch"), {"title": "Не список"}).status_code, 400)
+
+    def test_proposals(self):
+        """Пакетное создание, списки и принятие предложений."""
+        others = [self.other_ad] + [self.create_ad(self.other, f"Планшет {number}") for number in range(4)]
+        items = [{"ad_sender": self.own_ad.pk, "ad_receiver": ad.pk, "comment": "Меняю"} for ad in others]
+        # Сессия и пользователь, товары пакета одним запросом, вставка (в транзакции с точкой сохранения),
+        # затем счётчики предложений: по INSERT и по UPDATE на группу строк с одинаковым изменением
+        with self.assertNumQueries(12):
+            response = self.send("post", self.url("proposal-batch"), items)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExchangeProposal.objects.filter(ad_sender=self.own_ad, status="waiting").count(), 5)
+
+        invalid = [
+            {"ad_sender": self.other_ad.pk, "ad_receiver": others[1].pk},
+            {"ad_sender": self.own_ad.pk, "ad_receiver": self.own_ad.pk},
+        ]
+        errors = self.send("post", self.url("proposal-batch"), invalid).json()
+        self.assertEqual(errors["0"], {"ad_sender": ["Предложить можно только свой товар"]})
+        self.assertEqual(errors["1"], {"ad_receiver": ["Запросить можно только чужой товар"]})
+
+        sent = self.client.get(self.url("proposal-list"), {"box": "sent", "fields": "id,status"}).json()["results"]
+        self.assertEqual(len(sent), 5)
+        self.assertEqual(set(sent[0]), {"id", "status"})
+        self.assertEqual(self.client.get(self.url("proposal-list"), {"box": "received"}).json()["results"], [])
+
+        self.client.force_login(self.other)
+        proposal = sent[0]["id"]
+        url = self.url("proposal-accept", proposal)
+        response = self.client.post(url, HTTP_IDEMPOTENCY_KEY="api-retry")
+        self.assertEqual(response.json()["status"], "accepted")
+        self.assertEqual(self.client.post(url, HTTP_IDEMPOTENCY_KEY="api-retry").status_code, 200)
+        self.assertEqual(self.client.post(url).status_code, 409)
+        self.assertEqual(ExchangeProposal.objects.filter(ad_sender=self.own_ad, status="declined").count(), 4)
+        # Изменять предложение может только автор
+        response = self.send("patch", self.url("proposal-detail", proposal), {"comment": "Чужой"})
+        self.assertEqual(response.status_code, 404)
+
+
+class AsyncViewsTestCase(TestCase):
+    """Асинхронные представления для чтения, включённые для всех маршрутов настройкой ADS_ASYNC_VIEWS."""
+
+    def setUp(self):
+        cache.clear()
+        self.use_async_views("all")
+        self.addCleanup(self.use_async_views, "")
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.other = User.objects.create_user(username="other_user", password="password")
+        category = Category.objects.get_for_name("Электроника")
+        self.ads = [
+            Ad.objects.create(
+                title=f"Ноутбук {i}", description="Description", category=category, condition="used", user=self.user
+            )
+            for i in range(3)
+        ]
+        self.other_ads = [
+            Ad.objects.create(
+                title=f"Планшет {i}", description="Description", category=category, condition="new", user=self.other
+            )
+            for i in range(15)
+        ]
+        get_search_backend().rebuild()
+        self.async_client.force_login(self.user)
+
+    @staticmethod
+    def use_async_views(value):
+        """Пересобирает маршруты с другим значением ADS_ASYNC_VIEWS: они выбираются при импорте ads.urls."""
+        with override_settings(ADS_ASYNC_VIEWS=value):
+            importlib.reload(ads.urls)
+            importlib.reload(config.urls)
+        clear_url_caches()
+
+    def test_routes(self):
+        for name, args in [("ad-list", []), ("not-user-ad-list", []), ("search", []), ("ad-detail", [1])]:
+            view_class = resolve(reverse(f"ads:{name}", args=args)).func.view_class
+            self.assertIs(view_class, getattr(async_views, view_class.__name__))
+            self.assertTrue(view_class.view_is_async)
+
+        with override_settings(ADS_ASYNC_VIEWS="search, ad-list"):
+            route = ads.urls.read_path("", "ad-list", views.AdListView, async_views.AdListView)
+            self.assertIs(route.callback.view_class, async_views.AdListView)
+            route = ads.urls.read_path("my/", "user-ad-list", views.UserAdListView, async_views.UserAdListView)
+            self.assertIs(route.callback.view_class, views.UserAdListView)
+
+    async def test_ad_lists(self):
+        """Списки содержат те же товары и страницы, что и синхронные представления."""
+        response = await self.async_client.get(reverse("ads:ad-list"))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(list(response.context["ad_list"]), (self.ads + self.other_ads)[:15])
+        self.assertTrue(response.context["is_paginated"])
+        self.assertContains(response, "Ноутбук 0")
+
+        response = await self.async_client.get(reverse("ads:ad-list"), {"page": "last"})
+        self.assertEqual(list(response.context["ad_list"]), self.other_ads[12:])
+        response = await self.async_client.get(reverse("ads:ad-list"), {"page": 5})
+        self.assertEqual(response.status_code, 404)
+
+        response = await self.async_client.get(reverse("ads:user-ad-list"))
+        self.assertEqual(list(response.context["ad_list"]), self.ads)
+        response = await self.async_client.get(reverse("ads:not-user-ad-list"))
+        self.assertEqual(list(response.context["ad_list"]), self.other_ads)
+
+    async def test_cursor_pagination(self):
+        with override_settings(ADS_PAGINATION="cursor"):
+            response = await self.async_client.get(reverse("ads:ad-list"))
+            page = response.context["page_obj"]
+            self.assertEqual(list(page), (self.ads + self.other_ads)[:15])
+            response = await self.async_client.get(reverse("ads:ad-list"), {"after": page.next_cursor})
+            self.assertEqual(list(response.context["ad_list"]), self.other_ads[12:])
+            self.assertTrue(response.context["is_cursor_paginated"])
+
+    async def test_search(self):
+        response = await self.async_client.get(reverse("ads:search"), {"search": "ноутбук"})
+        self.assertEqual(sorted(ad.pk for ad in response.context["ads"]), [ad.pk for ad in self.ads])
+        response = await self.async_client.get(reverse("ads:search"), {"category": "электроника", "condition": "used"})
+        self.assertEqual(list(response.context["ads"]), self.ads[::-1])
+        self.assertIn(("used", "б/у", 3), response.context["condition_choices"])
+
+    async def test_detail_not_modified(self):
+        url = reverse("ads:ad-detail", args=[self.ads[0].pk])
+        response = await self.async_client.get(url)
+        self.assertEqual(response.context["ad"], self.ads[0])
+        response = await self.async_client.get(url, headers={"if-none-match": response.headers["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        response = await self.async_client.get(reverse("ads:ad-detail", args=[0]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_login_required(self):
+        """Анонимный пользователь перенаправляется на вход, как из синхронных представлений."""
+        await self.async_client.alogout()
+        for url in [reverse("ads:not-user-ad-list"), reverse("ads:ad-detail", args=[self.ads[0].pk])]:
+            response = await self.async_client.get(url)
+            self.assertRedirects(response, f"{reverse('users:login')}?next={url}", fetch_redirect_response=False)
+        self.assertEqual((await self.async_client.get(reverse("ads:ad-list"))).status_code, 200)
+
+    async def test_metrics(self):
+        """Middleware метрик работает в асинхронной цепочке и считает SQL-запросы из потоков sync_to_async."""
+        # Подключение теста открыто до загрузки middleware, поэтому обёртка устанавливается на него явно
+        install_query_recorder(connection)
+        DB_QUERIES.clear()
+        await self.async_client.get(reverse("ads:ad-list"))
+        _, count, total = DB_QUERIES.series[("ads:ad-list",)]
+        self.assertEqual(count, 1)
+        self.assertGreater(total, 0)
+
+
+REPLICAS = [alias for alias in settings.DATABASES if alias != "default"]
+
+
+@skipUnless(REPLICAS, "Нужна хотя бы одна реплика, например DB_REPLICAS=localhost")
+@override_settings(DATABASE_REPLICAS=REPLICAS)
+class ReplicaRouterTestCase(TestCase):
+    """
+    Реплики в тестах - отдельные локальные базы, в которые ничего не реплицируется: данные для чтения с реплики
+    создаются в них вручную, поэтому по содержимому страницы видно, из какой базы она прочитана.
+    """
+
+    databases = {"default", *REPLICAS}
+
+    def setUp(self):
+        cache.clear()
+        get_replica_monitor().reset()
+        self.addCleanup(get_replica_monitor().reset)
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.other = User.objects.create_user(username="other_user", password="password")
+        category = Category.objects.get_for_name("Электроника")
+        self.primary_ad = Ad.objects.create(
+            title="Ноутбук с основной базы",
+            description="Description",
+            category=category,
+            condition="new",
+            user=self.other,
+        )
+        self.replica_ad = Ad(
+            pk=self.primary_ad.pk + 1000,
+            title="Ноутбук с реплики",
+            description="Description",
+            category=category,
+            condition="new",
+            user=self.other,
+        )
+        for alias in REPLICAS:
+            User.objects.using(alias).bulk_create([self.user, self.other])
+            Category.objects.using(alias).bulk_create([category])
+            Ad.objects.using(alias).bulk_create([self.replica_ad])
+        self.client.force_login(self.user)
+
+    def assertReadsFrom(self, database):
+        titles = {"default": "Ноутбук с основной базы", "replica": "Ноутбук с реплики"}
+        response = self.client.get(reverse("ads:ad-list"))
+        self.assertContains(response, titles[database])
+        self.assertNotContains(response, titles["replica" if database == "default" else "default"])
+
+    def test_reads_from_replica(self):
+        """Списки, поиск и страница товара читаются с реплики, остальные страницы - с основной базы."""
+        self.assertReadsFrom("replica")
+        self.assertEqual(self.client.get(reverse("ads:ad-detail", args=[self.replica_ad.pk])).status_code, 200)
+        response = self.client.get(reverse("ads:search"), {"category": "электроника"})
+        self.assertEqual(list(response.context["ads"]), [self.replica_ad])
+        self.assertEqual(self.client.get(reverse("ads:ad-update", args=[self.replica_ad.pk])).status_code, 404)
+        self.assertIsNone(ReplicaRouter().db_for_read(Ad))
+
+    def test_user_sticks_to_primary_after_write(self):
+        """После записи пользователь видит свои изменения, пока не закончится окно DB_REPLICA_STICKY_SECONDS."""
+        data = {"title": "Новый товар", "description": "Description", "category": "Электроника", "condition": "new"}
+        self.client.post(reverse("ads:ad-create"), data)
+        self.assertReadsFrom("default")
+        self.assertContains(self.client.get(reverse("ads:ad-list")), "Новый товар")
+
+        other_client = self.client_class()
+        other_client.force_login(self.other)
+        self.assertContains(other_client.get(reverse("ads:ad-list")), "Ноутбук с реплики")
+
+        cache.delete(pin_key(self.user.pk))
+        self.assertReadsFrom("replica")
+
+    def test_lagging_replica_is_excluded(self):
+        with mock.patch.object(ReplicaMonitor, "measure_lag", return_value=settings.DB_REPLICA_MAX_LAG + 1):
+            with self.assertLogs("config.replicas", "WARNING"):
+                self.assertReadsFrom("default")
+        # Исключённая реплика возвращается в чтение после следующей проверки отставания
+        self.assertReadsFrom("default")
+        get_replica_monitor().reset()
+        self.assertReadsFrom("replica")
+
+
+# Кэш сессий и пользователя включён явно: по умолчанию он только с общим кэшем, а тесты используют LocMemCache
+@override_settings(SESSION_ENGINE="config.sessions", USER_CACHE_TIMEOUT=60)
+class SessionCacheTestCase(TestCase):
+    """Сессия и пользователь запроса читаются из кэша, изменения сессии записываются в базу после ответа."""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username="test_user", password="password")
+        self.client.force_login(self.user)
+
+    def get_session_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return [
+            query["sql"]
+            for query in context.captured_queries
+            if 'FROM "django_session"' in query["sql"] or 'FROM "users_user"' in query["sql"]
+        ]
+
+    def test_warm_request_skips_session_and_user(self):
+        url = reverse("ads:not-user-ad-list")
+        self.assertEqual(len(self.get_session_queries(url)), 1)
+        self.assertEqual(self.get_session_queries(url), [])
+        with override_settings(**DATABASE_SESSIONS):
+            self.client = self.client_class()
+            self.client.force_login(self.user)
+            self.get_session_queries(url)
+            self.assertEqual(len(self.get_session_queries(url)), 2)
+
+    def test_user_change_invalidates_cache(self):
+        url = reverse("ads:not-user-ad-list")
+        self.client.get(url)
+        self.assertIsNotNone(cache.get(user_cache_key(self.user.pk)))
+
+        self.user.first_name = "Иван"
+        self.user.save()
+        self.assertIsNone(cache.get(user_cache_key(self.user.pk)))
+        self.assertEqual(self.client.get(url).wsgi_request.user.first_name, "Иван")
+
+        # После смены пароля сессия с прежним хэшем пароля больше не действует
+        self.user.set_password("new_password")
+        self.user.save()
+        self.assertRedirects(self.client.get(url), f"{reverse('users:login')}?next={url}")
+
+    def test_session_write_behind(self):
+        session_key = self.client.session.session_key
+
+        def view(request):
+            request.session["seen"] = True
+            return HttpResponse()
+
+        request = RequestFactory().get("/")
+        request.COOKIES[settings.SESSION_COOKIE_NAME] = session_key
+        response = SessionMiddleware(view)(request)
+
+        self.assertNotIn("seen", DBStore(session_key).load())
+        self.assertTrue(SessionStore(session_key)["seen"])
+        # Сервер закрывает ответ после отправки; response.close() в тесте закрыл бы и подключение к базе
+        self.assertIn(request.session.write_to_db, response._resource_closers)
+        request.session.write_to_db()
+        self.assertTrue(DBStore(session_key).load()["seen"])
+
+    def test_deleted_session_is_not_restored(self):
+        session = SessionStore(self.client.session.session_key)
+        session.write_behind = True
+        session["seen"] = True
+        session.save()
+        DBStore(session.session_key).delete()
+
+        session.write_to_db()
+        self.assertNotIn("seen", SessionStore(session.session_key).load())
+
+
+class ProposalEventsTestCase(TransactionTestCase):
+    """Поток событий предложений: публикация изменений, брокеры и ASGI-приложение потока."""
+
+    def setUp(self):
+        cache.clear()
+        category = Category.objects.get_for_name("Электроника")
+        self.owner = User.objects.create_user(username="owner", password="password")
+        self.bidder = User.objects.create_user(username="bidder", password="password")
+        self.ad, *self.bidder_ads = [
+            Ad.objects.create(title="Ноутбук", description="Описание", category=category, condition="used", user=user)
+            for user in [self.owner, self.bidder, self.bidder]
+        ]
+
+    def test_changes_are_published(self):
+        """Создание, принятие с отклонением конкурирующего предложения и удаление доходят до обоих участников."""
+        with mock.patch("ads.events.get_event_broker") as get_broker:
+            proposals = [ExchangeProposal.objects.create(ad_sender=ad, ad_receiver=self.ad) for ad in self.bidder_ads]
+            first, second = [proposal.pk for proposal in proposals]
+            proposals[0].resolve("accepted", self.owner)
+            proposals[0].delete()
+        published = [
+            (users, event["action"], event["id"], event["status"])
+            for (users, event), _ in get_broker.return_value.publish.call_args_list
+        ]
+        users = [self.owner.pk, self.bidder.pk]
+        self.assertEqual(
+            published,
+            [
+                (users, "created", first, "waiting"),
+                (users, "created", second, "waiting"),
+                (users, "updated", second, "declined"),
+                (users, "updated", first, "accepted"),
+                (users, "deleted", first, "accepted"),
+            ],
+        )
+
+    def test_rolled_back_changes_are_not_published(self):
+        with mock.patch("ads.events.get_event_broker") as get_broker:
+            with transaction.atomic():
+                ExchangeProposal.objects.create(ad_sender=self.bidder_ads[0], ad_receiver=self.ad)
+                transaction.set_rollback(True)
+        get_broker.return_value.publish.assert_not_called()
+
+    def test_socket_broker(self):
+        """События из другого брокера доходят через сокет процесса, сокеты завершившихся процессов удаляются."""
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        stale.bind(os.path.join(directory, "0.sock"))
+        stale.close()
+
+        async def exchange():
+            broker = SocketBroker(directory)
+            subscription = broker.subscribe(self.owner.pk)
+            other = broker.subscribe(self.bidder.pk)
+            SocketBroker(directory).publish([self.owner.pk], {"type": "proposal", "id": 1})
+            self.assertEqual(await subscription.get(5), b'event: proposal\ndata: {"type": "proposal", "id": 1}\n\n')
+            self.assertIsNone(await other.get(0.1))
+            broker.receiver.close()
+
+        asyncio.run(exchange())
+        self.assertEqual(os.listdir(directory), [f"{os.getpid()}.sock"])
+
+    def scope(self, cookie=""):
+        return {
+            "type": "http",
+            "method": "GET",
+            "path": reverse("ads:proposal-events"),
+            "query_string": b"",
+            "headers": [(b"host", b"testserver"), (b"cookie", cookie.encode())],
+        }
+
+    async def test_stream(self):
+        await sync_to_async(self.client.force_login)(self.owner)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={self.client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        inner = mock.AsyncMock()
+        application = EventStreamApplication(inner)
+        incoming, sent = asyncio.Queue(), asyncio.Queue()
+
+        task = asyncio.ensure_future(application(self.scope(cookie), incoming.get, sent.put))
+        start = await sent.get()
+        self.assertEqual(start["status"], 200)
+        self.assertIn((b"content-type", b"text/event-stream; charset=utf-8"), start["headers"])
+        self.assertEqual((await sent.get())["body"], b"retry: 5000\n\n")
+
+        with override_settings(ADS_EVENTS_HEARTBEAT=0.01):
+            get_event_broker().publish([self.bidder.pk, self.owner.pk], {"type": "proposal", "id": 7})
+            body = (await asyncio.wait_for(sent.get(), 5))["body"].decode()
+            self.assertEqual(body, 'event: proposal\ndata: {"type": "proposal", "id": 7}\n\n')
+            # Без событий в поток отправляется комментарий поддержки соединения
+            self.assertEqual((await asyncio.wait_for(sent.get(), 5))["body"], b": ping\n\n")
+        await incoming.put({"type": "http.disconnect"})
+        await asyncio.wait_for(task, 5)
+        self.assertEqual(get_event_broker().subscribers, {})
+        inner.assert_not_called()
+
+        # Без сессии поток не открывается, остальные запросы передаются Django
+        sent = asyncio.Queue()
+        await application(self.scope(), incoming.get, sent.put)
+        self.assertEqual((await sent.get())["status"], 403)
+        await application({**self.scope(), "path": "/"}, incoming.get, sent.put)
+        inner.assert_awaited_once()
+
+    def test_wsgi_view(self):
+        self.client.force_login(self.owner)
+        self.assertEqual(self.client.get(reverse("ads:proposal-events")).status_code, 204)
+        response = self.client.get(reverse("ads:received-exchange-list"))
+        self.assertFalse(response.context["proposal_events"])
+        self.assertNotContains(response, "proposal_events.js")
+
+
+class StaticFilesTestCase(TestCase):
+    """Файлы с хэшем и сжатые варианты после collectstatic, отдача статических файлов и медиа с Range."""
+
+    def setUp(self):
+        source, self.static_root, self.media_root = [tempfile.mkdtemp() for _ in range(3)]
+        for directory in [source, self.static_root, self.media_root]:
+            self.addCleanup(shutil.rmtree, directory)
+        os.makedirs(os.path.join(source, "css"))
+        with open(os.path.join(source, "css", "site.css"), "w") as file:
+            file.write("body { background: url('../img/bg.svg'); }\n" + ".card { margin: 0; }\n" * 40)
+        # Стили страницы ошибки: адреса в шаблонах берутся из манифеста
+        with open(os.path.join(source, "css", "bootstrap.min.css"), "w") as file:
+            file.write("body { margin: 0; }\n")
+        os.makedirs(os.path.join(source, "img"))
+        with open(os.path.join(source, "img", "bg.svg"), "w") as file:
+            file.write("<svg/>")
+        settings_override = override_settings(
+            STATICFILES_DIRS=[source],
+            STATICFILES_FINDERS=["django.contrib.staticfiles.finders.FileSystemFinder"],
+            STATIC_ROOT=self.static_root,
+            MEDIA_ROOT=self.media_root,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def test_collectstatic(self):
+        self.assertEqual(staticfiles_storage.url("css/site.css"), "/static/css/site.css")
+        call_command("collectstatic", interactive=False, verbosity=0)
+
+        url = staticfiles_storage.url("css/site.css")
+        self.assertRegex(url, r"^/static/css/site\.[0-9a-f]{12}\.css$")
+        name = url.removeprefix("/static/")
+        with open(os.path.join(self.static_root, name), "rb") as file:
+            content = file.read()
+        self.assertIn(f"../{staticfiles_storage.stored_name('img/bg.svg')}".encode(), content)
+        with open(os.path.join(self.static_root, name + ".gz"), "rb") as file:
+            self.assertEqual(gzip.decompress(file.read()), content)
+        with open(os.path.join(self.static_root, name + ".br"), "rb") as file:
+            self.assertEqual(brotli.decompress(file.read()), content)
+        # Маленький файл не сжимается
+        self.assertFalse([item for item in os.listdir(os.path.join(self.static_root, "img")) if item.endswith(".gz")])
+
+        response = self.client.get(url, headers={"accept-encoding": "gzip, deflate, br;q=0.9"})
+        self.assertEqual(response["Content-Encoding"], "br")
+        self.assertEqual(response["Content-Type"], "text/css")
+        self.assertEqual(response["Cache-Control"], "public, max-age=31536000, immutable")
+        self.assertEqual(response["Vary"], "Accept-Encoding")
+        self.assertEqual(brotli.decompress(response.getvalue()), content)
+
+        response = self.client.get(url, headers={"accept-encoding": "gzip, br;q=0"})
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(gzip.decompress(response.getvalue()), content)
+
+        response = self.client.get(url)
+        self.assertFalse(response.has_header("Content-Encoding"))
+        self.assertEqual(response.getvalue(), content)
+        response = self.client.get(url, headers={"if-modified-since": response["Last-Modified"]})
+        self.assertEqual(response.status_code, 304)
+
+        # Адрес без хэша может измениться, поэтому браузер проверяет его при каждом использовании
+        self.assertEqual(self.client.get("/static/css/site.css")["Cache-Control"], "no-cache")
+        self.assertEqual(self.client.get("/static/css/missing.css").status_code, 404)
+
+    def test_media_ranges(self):
+        content = bytes(range(256)) * 4
+        with open(os.path.join(self.media_root, "photo.bin"), "wb") as file:
+            file.write(content)
+        url = "/media/photo.bin"
+
+        response = self.client.get(url)
+        self.assertEqual(response["Accept-Ranges"], "bytes")
+        self.assertEqual(response.getvalue(), content)
+
+        for header, start, end in [("bytes=10-19", 10, 19), ("bytes=1000-", 1000, 1023), ("bytes=-4", 1020, 1023)]:
+            with self.subTest(header):
+                response = self.client.get(url, headers={"range": header})
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(response["Content-Range"], f"bytes {start}-{end}/1024")
+                self.assertEqual(response["Content-Length"], str(end - start + 1))
+                self.assertEqual(response.getvalue(), content[start:][: end - start + 1])
+
+        self.assertEqual(self.client.get(url, headers={"range": "bytes=2000-"}).status_code, 416)
+        # Файл изменился после первого ответа: вместо участка отдаётся весь файл
+        response = self.client.get(url, headers={"range": "bytes=0-9", "if-range": "Thu, 01 Jan 1970 00:00:00 GMT"})
+        self.assertEqual((response.status_code, len(response.getvalue())), (200, 1024))
+
+        self.assertEqual(self.client.get("/media/../manage.py").status_code, 400)
+        self.assertEqual(self.client.post(url).status_code, 405)
@@ -1,24 +1,35 @@
+from django.conf import settings
 from django.urls import path
 
 from ads.apps import AdsConfig
 
-from . import views
+from . import async_views, views
 
 app_name = AdsConfig.name
 
+
+def read_path(route, name, view, async_view):
+    """Маршрут страницы для чтения: асинхронный вариант включает настройка ADS_ASYNC_VIEWS (имя маршрута или all)."""
+    enabled = {item.strip() for item in settings.ADS_ASYNC_VIEWS.split(",")}
+    return path(route, (async_view if name in enabled or "all" in enabled else view).as_view(), name=name)
+
+
 urlpatterns = [
     # Список товаров пользователя/не пользователя
-    path("not_my/", views.NotUserAdListView.as_view(), name="not-user-ad-list"),
-    path("my/", views.UserAdListView.as_view(), name="user-ad-list"),
+    read_path("not_my/", "not-user-ad-list", views.NotUserAdListView, async_views.NotUserAdListView),
+    read_path("my/", "user-ad-list", views.UserAdListView, async_views.UserAdListView),
     # CRUD для товаров
-    path("", views.AdListView.as_view(), name="ad-list"),
-    path("<int:pk>/", views.AdDetailView.as_view(), name="ad-detail"),
+    read_path("", "ad-list", views.AdListView, async_views.AdListView),
+    read_path("<int:pk>/", "ad-detail", views.AdDetailView, async_views.AdDetailView),
     path("create", views.AdCreateView.as_view(), name="ad-create"),
     path("<int:pk>/update/", views.AdUpdateView.as_view(), name="ad-update"),
     path("<int:pk>/delete/", views.AdDeleteView.as_view(), name="ad-delete"),
+    path("autocomplete/", views.AdAutocompleteView.as_view(), name="ad-autocomplete"),
     # CRUD для предложений обмена
     path("exchange/sent/", views.SentExchangeProposalListView.as_view(), name="sent-exchange-list"),
     path("exchange/received/", views.ReceivedExchangeProposalListView.as_view(), name="received-exchange-list"),
+    path("exchange/archive/", views.ExchangeArchiveListView.as_view(), name="exchange-archive"),
+    path("exchange/cycles/", views.ExchangeCycleListView.as_view(), name="exchange-cycles"),
     path("exchange/<int:pk>/", views.ExchangeProposalDetailView.as_view(), name="exchange-detail"),
     path("exchange/create", views.ExchangeProposalCreateView.as_view(), name="exchange-create"),
     path("exchange/<int:pk>/update/", views.ExchangeProposalUpdateView.as_view(), name="exchange-update"),
@@ -26,6 +37,8 @@ urlpatterns = [
     # Смена статуса предложения обмена
     path("exchange/<int:pk>/accept/", views.AcceptExchangeProposalView.as_view(), name="exchange-accept"),
     path("exchange/<int:pk>/decline/", views.DeclineExchangeProposalView.as_view(), name="exchange-decline"),
+    # Поток событий предложений (Server-Sent Events), см. ads/events.py
+    path("exchange/events/", views.ProposalEventsView.as_view(), name="proposal-events"),
     # Поиск
-    path("search/", views.AdSearchView.as_view(), name="search"),
+    read_path("search/", "search", views.AdSearchView, async_views.AdSearchView),
 ]
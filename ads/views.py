@@ -1,83 +1,120 @@
+import uuid
+
+from django.conf import settings
 from django.contrib import messages
-from django.contrib.auth.mixins import LoginRequiredMixin, UserPassesTestMixin
-from django.core.exceptions import PermissionDenied
-from django.db.models import Q
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.core.handlers.asgi import ASGIRequest
+from django.db import IntegrityError
+from django.db.models import Case, Q, When
+from django.http import Http404, HttpResponse, JsonResponse
 from django.shortcuts import redirect
 from django.urls import reverse, reverse_lazy
+from django.views import View
 from django.views.generic import (CreateView, DeleteView, DetailView, ListView,
-                                  UpdateView)
+                                  TemplateView, UpdateView)
 
+from .caching import ConditionalGetMixin, get_ad_version, get_list_version, get_proposal_badges
+from .cycles import get_cycle_engine
 from .forms import AdForm, ExchangeProposalForm, ExchangeProposalUpdateForm
-from .models import Ad, ExchangeProposal
+from .models import (Ad, AdFacet, ArchivedExchangeProposal, ExchangeConflict, ExchangeProposal,
+                     IdempotencyKey)
+from .pagination import CursorPaginationMixin
+from .permissions import OwnerRequiredMixin
+from .ranking import get_ranking_engine
+from .search import filter_search_queryset, filter_title_prefix, get_search_backend
+
+
+class AdListVersionMixin(ConditionalGetMixin):
+    """Списки товаров меняются вместе с общей версией товаров."""
+
+    def get_version(self):
+        return get_list_version()
+
+    def get_client_state(self):
+        # Значки предложений в шапке меняются без изменения товаров
+        return get_proposal_badges(self.request.user)
 
 
-class AdSearchView(ListView):
+class AdSearchView(AdListVersionMixin, ListView):
+    read_from_replica = True
+
     model = Ad
+    queryset = Ad.objects.select_related("user", "category")
     template_name = "ads/search_results.html"
     paginate_by = 15
     context_object_name = "ads"
 
     def get_queryset(self):
-        queryset = super().get_queryset()
-
-        search_query = self.request.GET.get("search")
-        category = self.request.GET.get("category")
-        condition = self.request.GET.get("condition")
-
+        queryset, search_query = filter_search_queryset(super().get_queryset(), self.request.GET)
         if search_query:
-            queryset = queryset.filter(Q(title__icontains=search_query) | Q(description__icontains=search_query))
-        if category:
-            queryset = queryset.filter(category__iexact=category)
-        if condition:
-            queryset = queryset.filter(condition=condition)
-
-        return queryset.order_by("-created_at")
+            # Результаты поиска отсортированы по релевантности
+            return get_search_backend().search(queryset, search_query)
+        return queryset
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
 
-        context["unique_categories"] = Ad.objects.order_by().values_list("category", flat=True).distinct()
-        context["condition_choices"] = Ad.CONDITION_CHOICES
+        # Фильтры строятся по маленькой таблице счётчиков, а не по всем товарам
+        categories, conditions = AdFacet.totals()
+        context["categories"] = categories
+        context["condition_choices"] = [
+            (value, label, conditions.get(value, 0)) for value, label in Ad.CONDITION_CHOICES
+        ]
 
         return context
 
 
-class AdListView(ListView):
+class AdListView(AdListVersionMixin, CursorPaginationMixin, ListView):
     """Класс-представление для отображения списка всех товаров."""
 
+    read_from_replica = True
+
     model = Ad
+    queryset = Ad.objects.select_related("user", "category")
     paginate_by = 15
     ordering = "id"
 
 
-class NotUserAdListView(LoginRequiredMixin, ListView):
+class NotUserAdListView(LoginRequiredMixin, AdListVersionMixin, CursorPaginationMixin, ListView):
     """Класс-представление для отображения списка товаров, не опубликованных пользователем."""
 
+    read_from_replica = True
+
     model = Ad
+    queryset = Ad.objects.select_related("user", "category")
     paginate_by = 15
     ordering = "id"
 
     def get_queryset(self):
-        return Ad.objects.exclude(user=self.request.user)
+        return super().get_queryset().exclude(user=self.request.user)
 
 
-class UserAdListView(LoginRequiredMixin, ListView):
+class UserAdListView(LoginRequiredMixin, AdListVersionMixin, CursorPaginationMixin, ListView):
     """Класс-представление для отображения списка товаров, опубликованных пользователем."""
 
+    read_from_replica = True
+
     model = Ad
+    queryset = Ad.objects.select_related("user", "category")
     paginate_by = 15
     ordering = "id"
 
     def get_queryset(self):
-        return Ad.objects.filter(user=self.request.user)
+        return super().get_queryset().filter(user=self.request.user)
 
 
-class AdDetailView(LoginRequiredMixin, DetailView):
+class AdDetailView(LoginRequiredMixin, ConditionalGetMixin, DetailView):
     """Класс-представление для отображения информации об одном товаре."""
 
+    read_from_replica = True
+
     model = Ad
+    queryset = Ad.objects.select_related("user", "category")
     context_object_name = "ad"
 
+    def get_version(self):
+        return get_ad_version(self.kwargs["pk"])
+
 
 class AdCreateView(LoginRequiredMixin, CreateView):
     """Класс-представление для создания товаров."""
@@ -95,47 +132,87 @@ class AdCreateView(LoginRequiredMixin, CreateView):
         return reverse_lazy("ads:ad-detail", args=[self.object.pk])
 
 
-class AdUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+class AdUpdateView(OwnerRequiredMixin, UpdateView):
     """Класс-представление для изменения товаров."""
 
     model = Ad
     form_class = AdForm
-
-    def test_func(self):
-        ad = self.get_object()
-        return ad.user == self.request.user
+    related_fields = ("category",)
 
     def handle_no_permission(self):
         messages.error(self.request, "Вы не автор этого товара")
         return redirect("ads:ad-list")
 
-    def get_form_class(self):
-        user = self.request.user
-        if user == self.object.user:
-            return AdForm
-        raise PermissionDenied
-
     def get_success_url(self):
         return reverse("ads:ad-detail", args=[self.kwargs.get("pk")])
 
 
-class AdDeleteView(LoginRequiredMixin, DeleteView):
+class AdDeleteView(OwnerRequiredMixin, DeleteView):
     """Класс-представление для удаления товаров."""
 
     model = Ad
     success_url = reverse_lazy("ads:user-ad-list")
+    permission_denied_message = "У вас нет прав для удаления этого товара"
+
+
+class AdAutocompleteView(LoginRequiredMixin, View):
+    """
+    Подсказки товаров для полей форм предложений (ads.widgets.AutocompleteSelect).
+
+    Параметры: scope - own (свои товары) или others (чужие), q - начало названия, page - номер страницы,
+    receiver - чужой товар, по оценке пары с которым упорядочиваются свои товары (ads.ranking).
+    Ответ: {"results": [{"id", "text"}], "more"}; страниц не больше, чем помещается в ADS_AUTOCOMPLETE_MAX_RESULTS.
+    """
+
+    raise_exception = True
+
+    def get(self, request):
+        scope = request.GET.get("scope")
+        page = request.GET.get("page", "1")
+        if scope not in ("own", "others") or not page.isdigit() or int(page) < 1:
+            return JsonResponse({"error": "Неверные параметры scope или page"}, status=400)
+
+        own = scope == "own"
+        queryset = Ad.objects.filter(user=request.user) if own else Ad.objects.exclude(user=request.user)
+        prefix = " ".join(request.GET.get("q", "").split())[: Ad._meta.get_field("title").max_length]
+        queryset = filter_title_prefix(queryset, prefix)
+
+        limit = settings.ADS_AUTOCOMPLETE_MAX_RESULTS
+        receiver = request.GET.get("receiver", "")
+        if own and receiver.isdigit():
+            # В подсказки попадает не больше limit товаров, поэтому и в CASE достаточно первых limit из рейтинга
+            ranked = get_ranking_engine().rank_offers(request.user.pk, int(receiver))[:limit]
+            if ranked:
+                order = Case(*[When(pk=pk, then=position) for position, pk in enumerate(ranked)], default=len(ranked))
+                queryset = queryset.order_by(order, *queryset.query.order_by)
+
+        start = (int(page) - 1) * settings.ADS_AUTOCOMPLETE_PAGE_SIZE
+        count = max(min(settings.ADS_AUTOCOMPLETE_PAGE_SIZE, limit - start), 0)
+        # Лишняя строка показывает, есть ли следующая страница, без COUNT(*)
+        probe = start + count + 1
+        rows = list(queryset.values_list("pk", "title")[start:probe]) if count else []
+        return JsonResponse(
+            {
+                "results": [{"id": pk, "text": title} for pk, title in rows[:count]],
+                "more": len(rows) > count and start + count < limit,
+            }
+        )
+
+
+class ProposalEventsMixin:
+    """Подключает к списку предложений поток событий: он есть только при запуске под ASGI (config/asgi.py)."""
 
-    def get_object(self, queryset=None):
-        obj = super().get_object(queryset)
-        if obj.user != self.request.user:
-            raise PermissionDenied("У вас нет прав для удаления этого товара")
-        return obj
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["proposal_events"] = isinstance(self.request, ASGIRequest)
+        return context
 
 
-class SentExchangeProposalListView(LoginRequiredMixin, ListView):
+class SentExchangeProposalListView(LoginRequiredMixin, ProposalEventsMixin, CursorPaginationMixin, ListView):
     """Класс-представление для отображения списка отправленных предложений обмена."""
 
     model = ExchangeProposal
+    queryset = ExchangeProposal.objects.select_related("ad_sender", "ad_receiver")
     ordering = ["-status"]
     paginate_by = 15
 
@@ -143,10 +220,11 @@ class SentExchangeProposalListView(LoginRequiredMixin, ListView):
         return super().get_queryset().filter(ad_sender__user=self.request.user)
 
 
-class ReceivedExchangeProposalListView(LoginRequiredMixin, ListView):
+class ReceivedExchangeProposalListView(LoginRequiredMixin, ProposalEventsMixin, CursorPaginationMixin, ListView):
     """Класс-представление для отображения списка полученных предложений обмена."""
 
     model = ExchangeProposal
+    queryset = ExchangeProposal.objects.select_related("ad_sender", "ad_receiver")
     ordering = ["-status"]
     paginate_by = 15
 
@@ -154,21 +232,57 @@ class ReceivedExchangeProposalListView(LoginRequiredMixin, ListView):
         return super().get_queryset().filter(ad_receiver__user=self.request.user)
 
 
-class ExchangeProposalDetailView(LoginRequiredMixin, DetailView):
+class ExchangeArchiveListView(LoginRequiredMixin, CursorPaginationMixin, ListView):
+    """Класс-представление для отображения перенесённых в архив предложений пользователя, отправленных и полученных."""
+
+    model = ArchivedExchangeProposal
+    queryset = ArchivedExchangeProposal.objects.select_related("ad_sender", "ad_receiver")
+    template_name = "ads/exchangeproposal_list.html"
+    ordering = ["-id"]
+    paginate_by = 15
+    extra_context = {"archive": True}
+
+    def get_queryset(self):
+        user = self.request.user
+        return super().get_queryset().filter(Q(ad_sender__user=user) | Q(ad_receiver__user=user))
+
+
+class ExchangeCycleListView(LoginRequiredMixin, TemplateView):
+    """Класс-представление для отображения предлагаемых цепочек обмена между несколькими пользователями."""
+
+    template_name = "ads/exchange_cycles.html"
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["cycles"] = get_cycle_engine().suggest(self.request.user)
+        return context
+
+
+class ExchangeProposalDetailView(OwnerRequiredMixin, DetailView):
     """Класс-представление для отображения информации об одном предложении обмена."""
 
     model = ExchangeProposal
+    owner_fields = ("ad_sender__user", "ad_receiver__user")
+    related_fields = ("ad_sender__user", "ad_receiver__user")
+    permission_denied_message = "Вы не можете просматривать это предложение"
+    template_name = "ads/exchangeproposal_detail.html"
 
-    def get(self, request, *args, **kwargs):
-        obj = self.get_object()
-        user = request.user
-
-        sender = obj.ad_sender.user
-        receiver = obj.ad_receiver.user
-        if user != sender and user != receiver:
-            raise PermissionDenied("Вы не можете просматривать это предложение")
+    def get_object(self, queryset=None):
+        try:
+            return super().get_object(queryset)
+        except Http404:
+            # Решённое предложение могло быть перенесено в архив командой archive_proposals
+            if queryset is not None or self.model is ArchivedExchangeProposal:
+                raise
+            self.model = ArchivedExchangeProposal
+            return super().get_object()
 
-        return super().get(self, request, *args, **kwargs)
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context["archived"] = isinstance(self.object, ArchivedExchangeProposal)
+        # Новый ключ при каждом показе: повторная отправка той же формы распознаётся как повтор запроса
+        context["idempotency_key"] = uuid.uuid4().hex
+        return context
 
 
 class ExchangeProposalCreateView(LoginRequiredMixin, CreateView):
@@ -176,6 +290,7 @@ class ExchangeProposalCreateView(LoginRequiredMixin, CreateView):
 
     model = ExchangeProposal
     form_class = ExchangeProposalForm
+    suggestion_count = 5
 
     def get(self, request, *args, **kwargs):
         """Если у пользователя нет товара, то его перенаправит на страницу создания."""
@@ -186,32 +301,48 @@ class ExchangeProposalCreateView(LoginRequiredMixin, CreateView):
     def get_success_url(self):
         return reverse_lazy("ads:exchange-detail", args=[self.object.pk])
 
+    def get_initial(self):
+        """
+        Товары можно выбрать заранее параметрами ad_sender и ad_receiver, например со страницы товара;
+        если задан только чужой товар, предлагается лучший для него свой товар.
+        """
+        initial = super().get_initial()
+        for name in ["ad_sender", "ad_receiver"]:
+            value = self.request.GET.get(name, "")
+            if value.isdigit():
+                initial[name] = int(value)
+        if "ad_receiver" in initial and "ad_sender" not in initial:
+            ranked = get_ranking_engine().rank_offers(self.request.user.pk, initial["ad_receiver"])
+            if ranked:
+                initial["ad_sender"] = ranked[0]
+        return initial
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs["user"] = self.request.user  # Добавляем пользователя
         return kwargs
 
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        pairs = get_ranking_engine().suggest(self.request.user.pk, self.suggestion_count)
+        ads = Ad.objects.in_bulk([ad_id for pair in pairs for ad_id in pair[:2]])
+        context["suggestions"] = [
+            (ads[offered], ads[requested]) for offered, requested, _ in pairs if offered in ads and requested in ads
+        ]
+        return context
 
-class ExchangeProposalUpdateView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
+
+class ExchangeProposalUpdateView(OwnerRequiredMixin, UpdateView):
     """Класс-представление для изменения предложений обмена."""
 
     model = ExchangeProposal
     form_class = ExchangeProposalUpdateForm
-
-    def test_func(self):
-        exchange = self.get_object()
-        return exchange.ad_sender.user == self.request.user
+    owner_fields = ("ad_sender__user",)
 
     def handle_no_permission(self):
         messages.error(self.request, "Вы не автор этого предложения")
         return redirect("ads:sent-exchange-list")
 
-    def get_form_class(self):
-        user = self.request.user
-        if user == self.object.ad_sender.user:
-            return ExchangeProposalUpdateForm
-        raise PermissionDenied
-
     def get_success_url(self):
         return reverse("ads:exchange-detail", args=[self.kwargs.get("pk")])
 
@@ -221,60 +352,69 @@ class ExchangeProposalUpdateView(LoginRequiredMixin, UserPassesTestMixin, Update
         return kwargs
 
 
-class ExchangeProposalDeleteView(LoginRequiredMixin, DeleteView):
+class ExchangeProposalDeleteView(OwnerRequiredMixin, DeleteView):
     """Класс-представление для удаления предложений обмена."""
 
     model = ExchangeProposal
     success_url = reverse_lazy("ads:sent-exchange-list")
+    owner_fields = ("ad_sender__user",)
+    related_fields = ("ad_receiver",)
+    permission_denied_message = "У вас нет прав для удаления этого предложения"
 
-    def get_object(self, queryset=None):
-        obj = super().get_object(queryset)
-        if obj.ad_sender.user != self.request.user:
-            raise PermissionDenied("У вас нет прав для удаления этого предложения")
-        return obj
 
+class ResolveExchangeProposalMixin(OwnerRequiredMixin):
+    """
+    Общая часть принятия и отклонения предложения, см. ExchangeProposal.resolve.
 
-class AcceptExchangeProposalView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
-    """Класс-представление для принятия предложения обмена."""
+    Ключ идемпотентности берётся из заголовка Idempotency-Key или скрытого поля формы, поэтому повторная отправка
+    той же формы не меняет данные.
+    """
 
     model = ExchangeProposal
     fields: list = []
-
-    def test_func(self):
-        exchange = self.get_object()
-        return exchange.ad_receiver.user == self.request.user
+    owner_fields = ("ad_receiver__user",)
+    status: str | None = None
 
     def handle_no_permission(self):
         messages.error(self.request, "Вы не можете принимать или отклонять это предложение")
         return redirect("ads:received-exchange-list")
 
+    def get_idempotency_key(self):
+        key = self.request.headers.get("Idempotency-Key") or self.request.POST.get("idempotency_key", "")
+        return key.strip()[: IdempotencyKey._meta.get_field("key").max_length]
+
     def form_valid(self, form):
-        self.object.status = "accepted"
-        self.object.save()
-        return super().form_valid(form)
+        try:
+            self.object.resolve(self.status, self.request.user, self.get_idempotency_key())
+        except ExchangeConflict as error:
+            messages.error(self.request, str(error))
+        except IntegrityError:
+            # Тот же ключ одновременно использован в другом запросе
+            messages.error(self.request, "Ключ идемпотентности уже использован для другого действия")
+        return redirect(self.get_success_url())
 
     def get_success_url(self):
         return reverse("ads:exchange-detail", args=[self.kwargs.get("pk")])
 
 
-class DeclineExchangeProposalView(LoginRequiredMixin, UserPassesTestMixin, UpdateView):
-    """Класс-представление для отказа от предложения обмена."""
+class AcceptExchangeProposalView(ResolveExchangeProposalMixin, UpdateView):
+    """Класс-представление для принятия предложения обмена с отклонением конкурирующих предложений."""
 
-    model = ExchangeProposal
-    fields: list = []
+    status = "accepted"
 
-    def test_func(self):
-        exchange = self.get_object()
-        return exchange.ad_receiver.user == self.request.user
 
-    def handle_no_permission(self):
-        messages.error(self.request, "Вы не можете принимать или отклонять это предложение")
-        return redirect("ads:received-exchange-list")
+class DeclineExchangeProposalView(ResolveExchangeProposalMixin, UpdateView):
+    """Класс-представление для отказа от предложения обмена."""
 
-    def form_valid(self, form):
-        self.object.status = "declined"
-        self.object.save()
-        return super().form_valid(form)
+    status = "declined"
 
-    def get_success_url(self):
-        return reverse("ads:exchange-detail", args=[self.kwargs.get("pk")])
+
+class ProposalEventsView(View):
+    """
+    Адрес потока событий предложений. Поток обслуживает ads.events.EventStreamApplication до Django, поэтому сюда
+    запрос доходит, только если приложение запущено без него (WSGI). Ответ 204 останавливает переподключения
+    EventSource.
+    """
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(status=204)
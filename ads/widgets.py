@@ -0,0 +1,41 @@
+from django import forms
+from django.urls import reverse
+
+
+class AutocompleteSelect(forms.Select):
+    """
+    Выбор товара с подсказками из ads:ad-autocomplete по мере ввода названия.
+
+    В HTML попадает только выбранный вариант, поэтому размер страницы не зависит от числа товаров.
+    scope - "own" (свои товары) или "others" (чужие); forward - имя поля формы, значение которого
+    передаётся в подсказки как receiver (чужой товар, с которым ранжируются свои).
+    """
+
+    template_name = "ads/widgets/autocomplete_select.html"
+
+    class Media:
+        js = ["js/autocomplete.js"]
+
+    def __init__(self, scope, forward=None, attrs=None):
+        super().__init__(attrs)
+        self.scope = scope
+        self.forward = forward
+
+    def get_context(self, name, value, attrs):
+        context = super().get_context(name, value, attrs)
+        widget_attrs = context["widget"]["attrs"]
+        widget_attrs["data-autocomplete-url"] = reverse("ads:ad-autocomplete")
+        widget_attrs["data-autocomplete-scope"] = self.scope
+        if self.forward:
+            widget_attrs["data-autocomplete-forward"] = self.forward
+        return context
+
+    def optgroups(self, name, value, attrs=None):
+        """Пустой вариант и выбранные товары, загруженные одним запросом по первичному ключу."""
+        selected = [item for item in value if str(item).isdigit()]
+        options = [self.create_option(name, "", self.choices.field.empty_label or "", not selected, 0)]
+        if selected:
+            field = self.choices.field
+            for ad in field.queryset.filter(pk__in=selected):
+                options.append(self.create_option(name, ad.pk, field.label_from_instance(ad), True, len(options)))
+        return [(None, options, 0)]
@@ -3,5 +3,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+# Под ASGI страницы для чтения обслуживаются асинхронными представлениями, см. ads/urls.py
+os.environ.setdefault("ADS_ASYNC_VIEWS", "all")
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+# Поток событий предложений обслуживается до Django, см. ads/events.py
+from ads.events import EventStreamApplication  # noqa: E402
+
+application = EventStreamApplication(django_application)
@@ -0,0 +1,231 @@
+import logging
+import secrets
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.http import HttpResponse, HttpResponseForbidden
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм в единицах метрики (секунды, штуки, байты)
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+SIZE_BUCKETS = (1_000, 10_000, 50_000, 100_000, 500_000, 1_000_000, 5_000_000)
+
+LOCAL_ADDRESSES = {"127.0.0.1", "::1"}
+
+# Сколько запросов к базе хранится для журнала медленных запросов
+MAX_LOGGED_QUERIES = 100
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Histogram:
+    """Гистограмма Prometheus, которая накапливается в памяти процесса."""
+
+    def __init__(self, name, documentation, labels, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = buckets
+        # Значения меток -> [счётчики корзин, число наблюдений, сумма]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series.setdefault(label_values, [[0] * len(self.buckets), 0, 0])
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][position] += 1
+            series[1] += 1
+            series[2] += value
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def collect(self):
+        with self.lock:
+            snapshot = sorted((key, list(counts), count, total) for key, (counts, count, total) in self.series.items())
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for label_values, counts, count, total in snapshot:
+            labels = ",".join(f'{name}="{escape_label(value)}"' for name, value in zip(self.labels, label_values))
+            prefix = f"{labels}," if labels else ""
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {bucket_count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total}")
+            lines.append(f"{self.name}_count{{{labels}}} {count}")
+        return lines
+
+
+REQUEST_DURATION = Histogram(
+    "django_request_duration_seconds", "Время обработки запроса", ("view", "method", "status"), TIME_BUCKETS
+)
+DB_QUERIES = Histogram("django_request_db_queries", "Число SQL-запросов на запрос", ("view",), QUERY_BUCKETS)
+DB_DURATION = Histogram("django_request_db_duration_seconds", "Время SQL-запросов на запрос", ("view",), TIME_BUCKETS)
+TEMPLATE_DURATION = Histogram(
+    "django_template_render_seconds", "Время отрисовки шаблона TemplateResponse", ("view",), TIME_BUCKETS
+)
+RESPONSE_SIZE = Histogram("django_response_size_bytes", "Размер тела ответа", ("view",), SIZE_BUCKETS)
+REGISTRY = [REQUEST_DURATION, DB_QUERIES, DB_DURATION, TEMPLATE_DURATION, RESPONSE_SIZE]
+
+
+def render_metrics():
+    return "\n".join(line for histogram in REGISTRY for line in histogram.collect()) + "\n"
+
+
+class QueryRecorder:
+    """Обёртка execute_wrapper: считает SQL-запросы и их время, сохраняя первые запросы для журнала."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            self.count += 1
+            self.duration += elapsed
+            if len(self.queries) < MAX_LOGGED_QUERIES:
+                self.queries.append((elapsed, sql))
+
+
+# Счётчик SQL-запросов текущего запроса. Асинхронные представления выполняют запросы к базе в потоках
+# sync_to_async со своими подключениями, поэтому счётчик передаётся через контекст, а не через подключение
+CURRENT_RECORDER = ContextVar("metrics_query_recorder", default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    recorder = CURRENT_RECORDER.get()
+    if recorder is None:
+        return execute(sql, params, many, context)
+    return recorder(execute, sql, params, many, context)
+
+
+def install_query_recorder(connection, **kwargs):
+    """Подключает record_query к подключению один раз: обёртка остаётся на нём между запросами."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+connection_created.connect(install_query_recorder, dispatch_uid="config.metrics.install_query_recorder")
+
+
+class MetricsMiddleware:
+    """
+    Записывает для каждого запроса время обработки, число и время SQL-запросов, время отрисовки шаблона
+    и размер ответа в гистограммы по имени представления. Запросы дольше METRICS_SLOW_REQUEST_MS
+    записываются в журнал вместе со списком SQL-запросов.
+
+    Работает и под WSGI, и под ASGI: в асинхронной цепочке middleware не переводит запрос в поток.
+    Гистограммы хранятся в памяти процесса: при нескольких процессах Prometheus опрашивает каждый отдельно.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        for connection in connections.all():
+            install_query_recorder(connection)
+        recorder = QueryRecorder()
+        token = CURRENT_RECORDER.set(recorder)
+        request.template_render_time = 0.0
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            CURRENT_RECORDER.reset(token)
+        return self.observe(request, response, time.perf_counter() - started, recorder)
+
+    async def __acall__(self, request):
+        recorder = QueryRecorder()
+        token = CURRENT_RECORDER.set(recorder)
+        request.template_render_time = 0.0
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            CURRENT_RECORDER.reset(token)
+        return self.observe(request, response, time.perf_counter() - started, recorder)
+
+    def observe(self, request, response, duration, recorder):
+        match = request.resolver_match
+        view = match.view_name if match else "unresolved"
+        REQUEST_DURATION.observe(duration, view, request.method, response.status_code)
+        DB_QUERIES.observe(recorder.count, view)
+        DB_DURATION.observe(recorder.duration, view)
+        if request.template_render_time:
+            TEMPLATE_DURATION.observe(request.template_render_time, view)
+        if not response.streaming:
+            RESPONSE_SIZE.observe(len(response.content), view)
+
+        if duration * 1000 >= settings.METRICS_SLOW_REQUEST_MS:
+            self.log_slow_request(request, view, duration, recorder)
+        return response
+
+    def process_template_response(self, request, response):
+        # TemplateResponse отрисовывается после всех middleware, поэтому время измеряется обёрткой render()
+        render = response.render
+
+        def timed_render():
+            started = time.perf_counter()
+            try:
+                return render()
+            finally:
+                request.template_render_time += time.perf_counter() - started
+
+        response.render = timed_render
+        return response
+
+    @staticmethod
+    def log_slow_request(request, view, duration, recorder):
+        queries = "\n".join(f"  {elapsed * 1000:.1f} мс: {sql}" for elapsed, sql in recorder.queries)
+        logger.warning(
+            "Медленный запрос %s %s (%s): %.0f мс, SQL-запросов %d (%.0f мс), шаблон %.0f мс\n%s",
+            request.method,
+            request.get_full_path(),
+            view,
+            duration * 1000,
+            recorder.count,
+            recorder.duration * 1000,
+            request.template_render_time * 1000,
+            queries,
+        )
+
+
+def metrics_view(request):
+    """
+    Метрики в текстовом формате Prometheus.
+
+    Нужен заголовок Authorization: Bearer <METRICS_TOKEN>. Без токена метрики доступны с локального адреса, только
+    если это явно разрешено METRICS_ALLOW_LOCAL: за обратным прокси на той же машине локальный адрес у всех запросов.
+    """
+    token = settings.METRICS_TOKEN
+    if token:
+        allowed = secrets.compare_digest(request.headers.get("Authorization", ""), f"Bearer {token}")
+    else:
+        allowed = settings.METRICS_ALLOW_LOCAL and request.META.get("REMOTE_ADDR") in LOCAL_ADDRESSES
+    if not allowed:
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8")
@@ -0,0 +1,170 @@
+import functools
+import logging
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# Текущий запрос: маршрутизатор решает по нему, можно ли читать с реплики, и запоминает запись пользователя
+CURRENT_REQUEST = ContextVar("replicas_current_request", default=None)
+
+# Приложения, модели которых читаются с реплик и после записи в которые пользователь читает с основной базы.
+# Пользователи и сессии всегда читаются с основной базы: только что зарегистрированный пользователь может ещё
+# не дойти до реплики
+REPLICA_APPS = {"ads"}
+
+# Отставание реплики PostgreSQL в секундах: реплика, которая воспроизвела весь полученный журнал, не отстаёт,
+# даже если на основной базе давно не было записей
+LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())
+    END
+"""
+
+
+def pin_key(user_id):
+    return f"db-primary:{user_id}"
+
+
+def is_pinned(request):
+    """Пользователь недавно изменял данные и до конца окна DB_REPLICA_STICKY_SECONDS читает с основной базы."""
+    user_id = request.session.get(SESSION_KEY)
+    return user_id is not None and cache.get(pin_key(user_id)) is not None
+
+
+def pin_to_primary(request):
+    """Переводит чтение запроса на основную базу, а пользователя - на время окна DB_REPLICA_STICKY_SECONDS."""
+    request.read_from_replica = False
+    if getattr(request, "pinned_to_primary", False):
+        return
+    request.pinned_to_primary = True
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        cache.set(pin_key(user.pk), True, settings.DB_REPLICA_STICKY_SECONDS)
+
+
+class ReplicaMonitor:
+    """
+    Список реплик, доступных для чтения: отставание проверяется не чаще раза в DB_REPLICA_CHECK_INTERVAL секунд,
+    реплики, отставшие больше чем на DB_REPLICA_MAX_LAG секунд или недоступные, исключаются до следующей проверки.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.available = []
+        self.checked_at = None
+
+    def get_available(self):
+        with self.lock:
+            now = time.monotonic()
+            if self.checked_at is None or now - self.checked_at >= settings.DB_REPLICA_CHECK_INTERVAL:
+                self.available = [alias for alias in settings.DATABASE_REPLICAS if self.is_healthy(alias)]
+                self.checked_at = now
+            return self.available
+
+    def reset(self):
+        with self.lock:
+            self.checked_at = None
+
+    def is_healthy(self, alias):
+        try:
+            lag = self.measure_lag(alias)
+        except DatabaseError as error:
+            logger.warning("Реплика %s недоступна: %s", alias, error)
+            return False
+        if lag > settings.DB_REPLICA_MAX_LAG:
+            logger.warning("Реплика %s отстаёт на %.1f с и исключена из чтения", alias, lag)
+            return False
+        return True
+
+    def measure_lag(self, alias):
+        connection = connections[alias]
+        if connection.vendor != "postgresql":
+            return 0.0
+        with connection.cursor() as cursor:
+            cursor.execute(LAG_SQL)
+            return float(cursor.fetchone()[0] or 0)
+
+
+@functools.cache
+def get_replica_monitor():
+    return ReplicaMonitor()
+
+
+class ReplicaRouter:
+    """
+    Маршрутизатор баз данных: чтение моделей ads из представлений с read_from_replica = True уходит на случайную
+    реплику из доступных, всё остальное - на основную базу.
+
+    Первая же запись в модели ads переводит на основную базу оставшиеся запросы на чтение этого запроса и все
+    чтения пользователя на DB_REPLICA_STICKY_SECONDS, чтобы он видел свои изменения.
+    """
+
+    def db_for_read(self, model, **hints):
+        request = CURRENT_REQUEST.get()
+        if model._meta.app_label not in REPLICA_APPS or not getattr(request, "read_from_replica", False):
+            return None
+        available = get_replica_monitor().get_available()
+        return random.choice(available) if available else None
+
+    def db_for_write(self, model, **hints):
+        request = CURRENT_REQUEST.get()
+        if request is not None and settings.DATABASE_REPLICAS and model._meta.app_label in REPLICA_APPS:
+            pin_to_primary(request)
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Передаёт маршрутизатору текущий запрос и отмечает запросы GET и HEAD к представлениям с read_from_replica = True,
+    если пользователь недавно ничего не изменял. Должен стоять после SessionMiddleware.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = CURRENT_REQUEST.set(request)
+        try:
+            return self.get_response(request)
+        finally:
+            CURRENT_REQUEST.reset(token)
+
+    async def __acall__(self, request):
+        token = CURRENT_REQUEST.set(request)
+        try:
+            return await self.get_response(request)
+        finally:
+            CURRENT_REQUEST.reset(token)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_class = getattr(view_func, "view_class", None)
+        if (
+            settings.DATABASE_REPLICAS
+            and getattr(view_class, "read_from_replica", False)
+            and request.method in ("GET", "HEAD")
+            and not is_pinned(request)
+        ):
+            request.read_from_replica = True
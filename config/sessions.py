@@ -0,0 +1,80 @@
+"""
+Сессии в кэше с отложенной записью в базу.
+
+Сессия читается из кэша и только при промахе - из базы, как в django.contrib.sessions.backends.cached_db.
+Изменения сессии внутри запроса сразу попадают в кэш, а в базу записываются после отправки ответа, при закрытии
+ответа, поэтому запись в базу не входит во время ответа. Новые сессии (вход, смена ключа) создаются в базе сразу:
+уникальность ключа проверяет база. Чтобы сессии были видны всем процессам приложения, нужен общий кэш.
+"""
+
+import logging
+
+from django.contrib.sessions.backends import cached_db
+from django.contrib.sessions.backends.base import UpdateError
+from django.contrib.sessions.backends.db import SessionStore as DBStore
+from django.contrib.sessions.middleware import SessionMiddleware as BaseSessionMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(cached_db.SessionStore):
+    """Хранилище SESSION_ENGINE = "config.sessions"; write_behind включает SessionMiddleware этого модуля."""
+
+    def __init__(self, session_key=None):
+        super().__init__(session_key)
+        self.write_behind = False
+        self.pending_write = False
+
+    def save(self, must_create=False):
+        if not self.write_behind or must_create or self.session_key is None:
+            super().save(must_create)
+            self.pending_write = False
+            return
+        try:
+            self._cache.set(self.cache_key, self._session, self.get_expiry_age())
+        except Exception:
+            logger.exception("Не удалось сохранить сессию в кэш (%s)", self._cache)
+            super().save()
+            return
+        self.pending_write = True
+
+    async def asave(self, must_create=False):
+        if not self.write_behind or must_create or self.session_key is None:
+            await super().asave(must_create)
+            self.pending_write = False
+            return
+        try:
+            await self._cache.aset(await self.acache_key(), self._session, await self.aget_expiry_age())
+        except Exception:
+            logger.exception("Не удалось сохранить сессию в кэш (%s)", self._cache)
+            await super().asave()
+            return
+        self.pending_write = True
+
+    def write_to_db(self):
+        """Записывает в базу изменения, сохранённые пока только в кэше."""
+        if not self.pending_write:
+            return
+        self.pending_write = False
+        try:
+            DBStore.save(self)
+        except UpdateError:
+            # Сессию удалили в другом запросе (например, выход): кэш не должен вернуть её обратно
+            self._cache.delete(self.cache_key)
+
+
+class SessionMiddleware(BaseSessionMiddleware):
+    """SessionMiddleware, который откладывает запись сессий config.sessions в базу до закрытия ответа."""
+
+    def process_request(self, request):
+        super().process_request(request)
+        if isinstance(request.session, SessionStore):
+            request.session.write_behind = True
+
+    def process_response(self, request, response):
+        response = super().process_response(request, response)
+        session = getattr(request, "session", None)
+        if getattr(session, "pending_write", False):
+            # Ответ закрывает сервер после отправки тела (WSGI и ASGI), и тестовый клиент Django
+            response._resource_closers.append(session.write_to_db)
+        return response
@@ -1,6 +1,8 @@
 import os
+import tempfile
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv(override=True)
@@ -11,7 +13,7 @@ SECRET_KEY = os.getenv("SECRET_KEY")
 
 DEBUG = True if os.getenv("DEBUG") == "True" else False
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = [host for host in os.getenv("ALLOWED_HOSTS", "").split(",") if host]
 
 INSTALLED_APPS = [
     "django.contrib.admin",
@@ -20,37 +22,59 @@ INSTALLED_APPS = [
     "django.contrib.sessions",
     "django.contrib.messages",
     "django.contrib.staticfiles",
+    "django.contrib.postgres",
+    "rest_framework",
+    "django_filters",
     "users",
     "ads",
 ]
 
+# JSON API (ads.api): версия в пути /api/v1/, компактный JSON без браузерного интерфейса
 REST_FRAMEWORK = {
     "DEFAULT_FILTER_BACKENDS": ("django_filters.rest_framework.DjangoFilterBackend",),
+    "DEFAULT_VERSIONING_CLASS": "rest_framework.versioning.URLPathVersioning",
+    "ALLOWED_VERSIONS": ("v1",),
+    "DEFAULT_AUTHENTICATION_CLASSES": (
+        "rest_framework.authentication.SessionAuthentication",
+        "rest_framework.authentication.BasicAuthentication",
+    ),
+    "DEFAULT_PERMISSION_CLASSES": ("rest_framework.permissions.IsAuthenticated",),
+    "DEFAULT_RENDERER_CLASSES": ("rest_framework.renderers.JSONRenderer",),
+    "DEFAULT_PARSER_CLASSES": ("rest_framework.parsers.JSONParser",),
 }
 
 MIDDLEWARE = [
+    "config.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
-    "django.contrib.sessions.middleware.SessionMiddleware",
+    "config.sessions.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "config.replicas.ReplicaMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
 
 ROOT_URLCONF = "config.urls"
 
+TEMPLATE_LOADERS = [
+    "django.template.loaders.filesystem.Loader",
+    "django.template.loaders.app_directories.Loader",
+]
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
         "DIRS": [os.path.join(BASE_DIR, "templates")],
-        "APP_DIRS": True,
         "OPTIONS": {
+            # Без DEBUG скомпилированные шаблоны хранятся в памяти процесса и не читаются с диска при каждом запросе
+            "loaders": TEMPLATE_LOADERS if DEBUG else [("django.template.loaders.cached.Loader", TEMPLATE_LOADERS)],
             "context_processors": [
                 "django.template.context_processors.debug",
                 "django.template.context_processors.request",
                 "django.contrib.auth.context_processors.auth",
                 "django.contrib.messages.context_processors.messages",
+                "ads.context_processors.proposal_badges",
             ],
         },
     },
@@ -58,16 +82,60 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "config.wsgi.application"
 
+# Подключения к PostgreSQL: пул psycopg (DB_POOL) или постоянные подключения (DB_CONN_MAX_AGE, секунды).
+# Пул работает и под WSGI, и под ASGI; постоянные подключения под ASGI остаются по одному на каждый поток
+DB_POOL = os.getenv("DB_POOL") == "True"
+DB_STATEMENT_TIMEOUT = int(os.getenv("DB_STATEMENT_TIMEOUT") or 0)
+
 DATABASES = {
     "default": {
-        "ENGINE": "django.db.backends.postgresql_psycopg2",
+        "ENGINE": "django.db.backends.postgresql",
         "NAME": os.getenv("NAME"),
         "USER": os.getenv("USER"),
         "HOST": os.getenv("HOST"),
         "PORT": os.getenv("PORT"),
         "PASSWORD": os.getenv("PASSWORD"),
+        # С пулом подключение возвращается в пул после каждого запроса, и Django требует CONN_MAX_AGE = 0
+        "CONN_MAX_AGE": 0 if DB_POOL else int(os.getenv("DB_CONN_MAX_AGE") or 0),
+        "CONN_HEALTH_CHECKS": os.getenv("DB_CONN_HEALTH_CHECKS", "True") == "True",
+        "OPTIONS": {},
     }
 }
+if DB_STATEMENT_TIMEOUT:
+    # Ограничение времени SQL-запроса в миллисекундах задаётся параметром сервера при подключении
+    DATABASES["default"]["OPTIONS"]["options"] = f"-c statement_timeout={DB_STATEMENT_TIMEOUT}"
+if DB_POOL:
+    # CONN_HEALTH_CHECKS у пула включает проверку подключения при выдаче из пула
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("DB_POOL_MIN_SIZE") or 2),
+        "max_size": int(os.getenv("DB_POOL_MAX_SIZE") or 10),
+        # Секунды: время жизни подключения в пуле и ожидание свободного подключения
+        "max_lifetime": float(os.getenv("DB_POOL_MAX_LIFETIME") or 3600),
+        "timeout": float(os.getenv("DB_POOL_TIMEOUT") or 30),
+    }
+
+# Реплики для чтения: адреса host или host:port через запятую, база и пользователь те же, что у основной.
+# В тестах у каждой реплики своя тестовая база, поэтому DB_REPLICAS=localhost даёт две локальные базы
+DATABASE_REPLICAS = []
+for number, address in enumerate(filter(None, os.getenv("DB_REPLICAS", "").split(",")), start=1):
+    host, _, port = address.strip().partition(":")
+    alias = f"replica_{number}"
+    DATABASES[alias] = {
+        **DATABASES["default"],
+        "HOST": host,
+        "PORT": port or DATABASES["default"]["PORT"],
+        "OPTIONS": dict(DATABASES["default"]["OPTIONS"]),
+        "TEST": {"NAME": f"test_{DATABASES['default']['NAME']}_{alias}"},
+    }
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["config.replicas.ReplicaRouter"]
+TEST_RUNNER = "ads.testing.PrimaryDatabaseTestRunner"
+# Сколько секунд после записи пользователь читает с основной базы, допустимое отставание реплики в секундах
+# и как часто его проверять
+DB_REPLICA_STICKY_SECONDS = int(os.getenv("DB_REPLICA_STICKY_SECONDS") or 10)
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG") or 5)
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL") or 5)
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -94,14 +162,105 @@ USE_L18N = True
 
 STATIC_URL = "static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
+STATIC_ROOT = os.getenv("STATIC_ROOT") or BASE_DIR / "staticfiles"
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
+# collectstatic записывает файлы с хэшем содержимого в имени и их сжатые варианты .gz и .br, см. config/staticfiles.py
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    "staticfiles": {"BACKEND": "config.staticfiles.CompressedManifestStaticFilesStorage"},
+}
+# Статические файлы и медиа отдаёт само приложение (config/urls.py); False, если их отдаёт веб-сервер
+SERVE_FILES = os.getenv("SERVE_FILES", "True") == "True"
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 AUTH_USER_MODEL = "users.User"
 
+# ModelBackend оставлен для сессий, созданных до включения кэша пользователя
+AUTHENTICATION_BACKENDS = ["users.backends.CachedModelBackend", "django.contrib.auth.backends.ModelBackend"]
+
+# Кэш хранит версии товаров для ETag; при нескольких процессах приложения нужен общий кэш (Redis, Memcached)
+CACHES = {
+    "default": {
+        "BACKEND": os.getenv("CACHE_BACKEND") or "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": os.getenv("CACHE_LOCATION", ""),
+    }
+}
+
+# Кэш в памяти процесса: выход или смена пароля сбросили бы сессию и пользователя только в одном процессе
+SHARED_CACHE = CACHES["default"]["BACKEND"] not in (
+    "django.core.cache.backends.locmem.LocMemCache",
+    "django.core.cache.backends.dummy.DummyCache",
+)
+
+# Сессии: config.sessions - кэш с записью в базу после ответа, django.contrib.sessions.backends.db - только база,
+# django.contrib.sessions.backends.signed_cookies - подписанная cookie без обращений к серверу.
+# Пользователь сессии берётся из кэша на USER_CACHE_TIMEOUT секунд (0 - из базы на каждый запрос).
+# Кэш сессий и пользователя включается по умолчанию и допускается только с общим кэшем (CACHE_BACKEND)
+SESSION_ENGINE = os.getenv("SESSION_ENGINE") or (
+    "config.sessions" if SHARED_CACHE else "django.contrib.sessions.backends.db"
+)
+USER_CACHE_TIMEOUT = int(os.getenv("USER_CACHE_TIMEOUT") or (60 if SHARED_CACHE else 0))
+if not SHARED_CACHE and (SESSION_ENGINE == "config.sessions" or USER_CACHE_TIMEOUT):
+    raise ImproperlyConfigured(
+        "SESSION_ENGINE=config.sessions и USER_CACHE_TIMEOUT требуют общего кэша: задайте CACHE_BACKEND "
+        "(Redis, Memcached)"
+    )
+
+# Поисковый движок объявлений; если не задан, выбирается по типу базы данных
+ADS_SEARCH_BACKEND = os.getenv("ADS_SEARCH_BACKEND", "")
+ADS_SEARCH_MAX_RESULTS = int(os.getenv("ADS_SEARCH_MAX_RESULTS", 1000))
+
+# Подсказки товаров в формах предложений: размер страницы и предел числа результатов по одному запросу
+ADS_AUTOCOMPLETE_PAGE_SIZE = int(os.getenv("ADS_AUTOCOMPLETE_PAGE_SIZE") or 20)
+ADS_AUTOCOMPLETE_MAX_RESULTS = int(os.getenv("ADS_AUTOCOMPLETE_MAX_RESULTS") or 200)
+
+# Пагинация списков: "offset" (номера страниц) или "cursor" (keyset-пагинация по ?after=)
+ADS_PAGINATION = os.getenv("ADS_PAGINATION", "offset")
+
+# JSON API: размер страницы по умолчанию, предел параметра ?limit= и число объектов в пакетном запросе
+ADS_API_PAGE_SIZE = int(os.getenv("ADS_API_PAGE_SIZE") or 50)
+ADS_API_MAX_PAGE_SIZE = int(os.getenv("ADS_API_MAX_PAGE_SIZE") or 200)
+ADS_API_MAX_BATCH = int(os.getenv("ADS_API_MAX_BATCH") or 100)
+
+# Маршруты ads/urls.py с асинхронными представлениями (ads.async_views): имена через запятую или "all";
+# config/asgi.py по умолчанию включает все
+ADS_ASYNC_VIEWS = os.getenv("ADS_ASYNC_VIEWS", "")
+
+# Поток событий предложений (ads.events, только под ASGI): брокер ads.events.InProcessBroker для одного процесса или
+# ads.events.SocketBroker для нескольких процессов на машине (сокеты в ADS_EVENTS_SOCKET_DIR), интервал комментария
+# поддержки соединения в секундах, задержка переподключения браузера в мс и число неотправленных событий на поток
+ADS_EVENTS_BROKER = os.getenv("ADS_EVENTS_BROKER") or "ads.events.InProcessBroker"
+ADS_EVENTS_SOCKET_DIR = os.getenv("ADS_EVENTS_SOCKET_DIR") or os.path.join(tempfile.gettempdir(), "barter-events")
+ADS_EVENTS_HEARTBEAT = float(os.getenv("ADS_EVENTS_HEARTBEAT") or 25)
+ADS_EVENTS_RETRY_MS = int(os.getenv("ADS_EVENTS_RETRY_MS") or 5000)
+ADS_EVENTS_QUEUE_SIZE = int(os.getenv("ADS_EVENTS_QUEUE_SIZE") or 32)
+
+# Архив предложений (команда archive_proposals): принятые и отклонённые предложения старше ADS_ARCHIVE_AFTER_DAYS
+# дней переносятся пачками по ADS_ARCHIVE_BATCH_SIZE строк, каждая пачка - отдельная транзакция
+ADS_ARCHIVE_AFTER_DAYS = int(os.getenv("ADS_ARCHIVE_AFTER_DAYS") or 90)
+ADS_ARCHIVE_BATCH_SIZE = int(os.getenv("ADS_ARCHIVE_BATCH_SIZE") or 500)
+
+# Метрики запросов для Prometheus (/metrics) и журнал медленных запросов. Без METRICS_TOKEN /metrics закрыт;
+# METRICS_ALLOW_LOCAL открывает его без токена запросам с localhost - только если перед приложением нет прокси
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+METRICS_ALLOW_LOCAL = os.getenv("METRICS_ALLOW_LOCAL") == "True"
+METRICS_SLOW_REQUEST_MS = int(os.getenv("METRICS_SLOW_REQUEST_MS") or 500)
+
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "handlers": {"console": {"class": "logging.StreamHandler"}},
+    "loggers": {
+        "config.metrics": {"handlers": ["console"], "level": "WARNING"},
+        "config.sessions": {"handlers": ["console"], "level": "WARNING"},
+        "ads.events": {"handlers": ["console"], "level": "WARNING"},
+    },
+}
+
 LOGIN_REDIRECT_URL = "ads:not-user-ad-list"
 LOGOUT_REDIRECT_URL = "ads:ad-list"
 
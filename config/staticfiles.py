@@ -0,0 +1,235 @@
+"""
+Статические файлы и медиа.
+
+collectstatic (CompressedManifestStaticFilesStorage) записывает в STATIC_ROOT копии файлов с хэшем содержимого
+в имени и рядом с каждым текстовым файлом сжатые варианты .gz и .br (brotli).
+serve_static отдаёт сжатый вариант, который принимает клиент, а файлам с хэшем в имени - заголовок
+Cache-Control immutable на год: содержимое по такому адресу не меняется. serve_media отдаёт загруженные файлы
+с поддержкой Range. Оба отдают открытый файл: под gunicorn (WSGI) он уходит клиенту через sendfile без копирования
+в Python.
+"""
+
+import gzip
+import mimetypes
+import os
+import posixpath
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
+
+import brotli
+from django.conf import settings
+from django.contrib.staticfiles import finders
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+from django.views.static import was_modified_since
+
+# Расширения файлов, которые имеет смысл сжимать: изображения и шрифты woff уже сжаты
+COMPRESSIBLE = {".css", ".js", ".mjs", ".map", ".json", ".svg", ".txt", ".html", ".xml", ".ico", ".ttf", ".otf"}
+# Файлы меньше этого размера сжатие почти не уменьшает
+MIN_COMPRESS_SIZE = 256
+# Сжатый вариант сохраняется, только если он меньше исходного хотя бы на 5%
+MIN_COMPRESS_RATIO = 0.95
+# Варианты файлов в порядке предпочтения: кодировка для Accept-Encoding и расширение
+ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+IMMUTABLE = "public, max-age=31536000, immutable"
+RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def is_compressed(path):
+    """Сжатые варианты записаны после последнего изменения файла: повторный collectstatic их не пересчитывает."""
+    try:
+        return os.stat(path + ".gz").st_mtime >= os.stat(path).st_mtime
+    except FileNotFoundError:
+        return False
+
+
+def compress(paths):
+    """
+    Записывает рядом с файлами сжатые варианты, которые заметно меньше исходных. Одинаковые файлы (исходная копия
+    и копия с хэшем, в которой нечего было заменять) сжимаются один раз.
+    """
+    if all(is_compressed(path) for path in paths):
+        return
+    files = {}
+    for path in paths:
+        with open(path, "rb") as file:
+            files.setdefault(file.read(), []).append(path)
+    for data, targets in files.items():
+        if len(data) < MIN_COMPRESS_SIZE:
+            continue
+        variants = {".gz": gzip.compress(data, compresslevel=9, mtime=0), ".br": brotli.compress(data, quality=11)}
+        for suffix, compressed in variants.items():
+            if len(compressed) < len(data) * MIN_COMPRESS_RATIO:
+                for path in targets:
+                    with open(path + suffix, "wb") as file:
+                        file.write(compressed)
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    ManifestStaticFilesStorage, который после записи файлов с хэшем сжимает их (и исходные копии) в несколько
+    потоков: zlib и brotli отпускают GIL. Пока collectstatic не запускался и манифеста нет, адреса файлов
+    строятся без хэша, поэтому тесты и разработка обходятся без collectstatic.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        groups = [
+            [self.path(name) for name in pair]
+            for pair in self.hashed_files.items()
+            if os.path.splitext(pair[0])[1].lower() in COMPRESSIBLE
+        ]
+        with ThreadPoolExecutor() as executor:
+            list(executor.map(compress, groups))
+
+    def stored_name(self, name):
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    @cached_property
+    def immutable_names(self):
+        """Имена файлов с хэшем содержимого из манифеста."""
+        return frozenset(self.hashed_files.values())
+
+
+def accepted_encodings(request):
+    """Кодировки из Accept-Encoding с ненулевым весом."""
+    encodings = set()
+    for item in request.headers.get("Accept-Encoding", "").split(","):
+        coding, _, params = item.strip().partition(";")
+        weight = params.strip().removeprefix("q=")
+        try:
+            if float(weight or 1) > 0:
+                encodings.add(coding.strip().lower())
+        except ValueError:
+            continue
+    return encodings
+
+
+class FileRange:
+    """
+    Участок открытого файла для FileResponse: read() не выходит за длину участка, а fileno() позволяет серверу
+    отправить участок через sendfile с текущей позиции файла и длиной из Content-Length.
+    """
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        size = self.remaining if size < 0 else min(size, self.remaining)
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def fileno(self):
+        return self.file.fileno()
+
+    def close(self):
+        self.file.close()
+
+
+class FileRangeResponse(FileResponse):
+    # Большие блоки, когда файл читается в Python (ASGI, сервер без sendfile)
+    block_size = 64 * 1024
+
+
+def parse_range(header, size):
+    """Начало и длина участка из заголовка Range; None - отдать файл целиком, ValueError - участок вне файла."""
+    match = RANGE_RE.match(header.strip())
+    if match is None or match.groups() == ("", ""):
+        # Несколько участков и другие единицы не поддерживаются: по RFC 9110 можно отдать весь файл
+        return None
+    first, last = match.groups()
+    if not first:
+        length = min(int(last), size)
+        if length == 0:
+            raise ValueError
+        return size - length, length
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or end < start:
+        raise ValueError
+    return start, end - start + 1
+
+
+def file_response(request, path, content_type=None, cache_control=None, encodings=()):
+    """
+    Ответ с файлом path: условный GET по Last-Modified, Range для исходного файла и сжатый вариант из encodings
+    (кодировка и расширение), если клиент его принимает и запрос без Range.
+    """
+    if not os.path.isfile(path):
+        raise Http404
+    stat = os.stat(path)
+    headers = {"Last-Modified": http_date(stat.st_mtime), "Accept-Ranges": "bytes"}
+    if cache_control:
+        headers["Cache-Control"] = cache_control
+    if encodings:
+        headers["Vary"] = "Accept-Encoding"
+    if not was_modified_since(request.headers.get("If-Modified-Since"), stat.st_mtime):
+        return HttpResponseNotModified(headers=headers)
+    content_type = content_type or mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+    range_header = request.headers.get("Range")
+    if_range = request.headers.get("If-Range")
+    if range_header and if_range and parse_http_date_safe(if_range) != int(stat.st_mtime):
+        # Файл изменился после того, как клиент получил начало: участок не подходит
+        range_header = None
+    if range_header:
+        try:
+            part = parse_range(range_header, stat.st_size)
+        except ValueError:
+            return HttpResponse(status=416, headers={**headers, "Content-Range": f"bytes */{stat.st_size}"})
+        if part is not None:
+            start, length = part
+            response = FileRangeResponse(
+                FileRange(open(path, "rb"), start, length), status=206, content_type=content_type, headers=headers
+            )
+            response["Content-Length"] = length
+            response["Content-Range"] = f"bytes {start}-{start + length - 1}/{stat.st_size}"
+            return response
+
+    accepted = accepted_encodings(request)
+    for encoding, suffix in encodings:
+        if encoding in accepted and os.path.exists(path + suffix):
+            response = FileRangeResponse(
+                open(path + suffix, "rb"), content_type=content_type, headers=headers, filename=os.path.basename(path)
+            )
+            # Участки сжатого варианта не отдаются: Range выше относится к исходному файлу
+            del response["Accept-Ranges"]
+            response["Content-Encoding"] = encoding
+            return response
+    return FileRangeResponse(open(path, "rb"), content_type=content_type, headers=headers)
+
+
+@require_safe
+def serve_static(request, path):
+    """Файл из STATIC_ROOT; при DEBUG файлы, которых там нет, ищутся в STATICFILES_DIRS и приложениях."""
+    name = posixpath.normpath(path).lstrip("/")
+    full_path = safe_join(settings.STATIC_ROOT, name)
+    if settings.DEBUG and not os.path.isfile(full_path):
+        full_path = finders.find(name)
+        if full_path is None:
+            raise Http404
+    immutable = name in getattr(staticfiles_storage, "immutable_names", ())
+    return file_response(
+        request,
+        full_path,
+        content_type=mimetypes.guess_type(name)[0],
+        cache_control=IMMUTABLE if immutable else "no-cache",
+        encodings=ENCODINGS,
+    )
+
+
+@require_safe
+def serve_media(request, path):
+    """Загруженный файл из MEDIA_ROOT с поддержкой Range."""
+    return file_response(request, safe_join(settings.MEDIA_ROOT, posixpath.normpath(path).lstrip("/")))
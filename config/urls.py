@@ -1,7 +1,12 @@
+import re
+
 from django.conf import settings
-from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import include, path
+from django.urls import include, path, re_path
+
+from ads.api import router as api_router
+from config.metrics import metrics_view
+from config.staticfiles import serve_media, serve_static
 
 handler403 = "config.views.custom_permission_denied"
 handler404 = "config.views.custom_page_not_found"
@@ -11,4 +16,12 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("users/", include("users.urls", namespace="users")),
     path("ads/", include("ads.urls", namespace="ads")),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    re_path(r"^api/(?P<version>v1)/", include((api_router.urls, "api"))),
+    path("metrics", metrics_view, name="metrics"),
+]
+
+if settings.SERVE_FILES:
+    urlpatterns += [
+        re_path(rf"^{re.escape(settings.STATIC_URL.lstrip('/'))}(?P<path>.+)$", serve_static),
+        re_path(rf"^{re.escape(settings.MEDIA_URL.lstrip('/'))}(?P<path>.+)$", serve_media),
+    ]
@@ -0,0 +1,80 @@
+// Подсказки для полей выбора товара (ads.widgets.AutocompleteSelect): варианты загружаются
+// из ads:ad-autocomplete по мере ввода названия, по одной странице за запрос.
+(function () {
+    "use strict";
+
+    var DELAY_MS = 250;
+
+    function setup(select) {
+        var input = document.querySelector('[data-autocomplete-input="' + select.id + '"]');
+        var more = document.querySelector('[data-autocomplete-more="' + select.id + '"]');
+        var timer = null;
+        var page = 1;
+        var latest = 0;
+        var loaded = false;
+
+        function params() {
+            var query = new URLSearchParams({scope: select.dataset.autocompleteScope, q: input.value.trim(), page: page});
+            var forward = select.dataset.autocompleteForward;
+            var field = forward && document.getElementById("id_" + forward);
+            var receiver = (field && field.value) || select.dataset.autocompleteReceiver;
+            if (receiver) {
+                query.set("receiver", receiver);
+            }
+            return query;
+        }
+
+        function load(append) {
+            var current = ++latest;
+            loaded = true;
+            fetch(select.dataset.autocompleteUrl + "?" + params(), {headers: {Accept: "application/json"}})
+                .then(function (response) {
+                    return response.json();
+                })
+                .then(function (data) {
+                    // Ответ на устаревший запрос не должен затирать более свежие варианты
+                    if (current !== latest) {
+                        return;
+                    }
+                    if (!append) {
+                        Array.from(select.options).forEach(function (option) {
+                            if (option.value && !option.selected) {
+                                option.remove();
+                            }
+                        });
+                    }
+                    data.results.forEach(function (item) {
+                        if (!select.querySelector('option[value="' + item.id + '"]')) {
+                            select.add(new Option(item.text, item.id));
+                        }
+                    });
+                    more.classList.toggle("d-none", !data.more);
+                });
+        }
+
+        function loadFirstPage() {
+            page = 1;
+            load(false);
+        }
+
+        input.addEventListener("input", function () {
+            clearTimeout(timer);
+            timer = setTimeout(loadFirstPage, DELAY_MS);
+        });
+        [input, select].forEach(function (element) {
+            element.addEventListener("focus", function () {
+                if (!loaded) {
+                    loadFirstPage();
+                }
+            });
+        });
+        more.addEventListener("click", function () {
+            page += 1;
+            load(true);
+        });
+    }
+
+    document.addEventListener("DOMContentLoaded", function () {
+        document.querySelectorAll("select[data-autocomplete-url]").forEach(setup);
+    });
+})();
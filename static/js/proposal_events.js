@@ -0,0 +1,21 @@
+// Поток событий предложений (ads:proposal-events): при создании предложения или смене его статуса
+// на странице списка появляется уведомление со ссылкой для обновления.
+(function () {
+    "use strict";
+
+    function setup(banner) {
+        if (!window.EventSource) {
+            return;
+        }
+        var source = new EventSource(banner.dataset.proposalEvents);
+        source.addEventListener("proposal", function () {
+            banner.classList.remove("d-none");
+        });
+        // Браузер переподключается сам через интервал retry из потока, закрывать соединение нужно только при уходе
+        window.addEventListener("pagehide", function () {
+            source.close();
+        });
+    }
+
+    document.querySelectorAll("[data-proposal-events]").forEach(setup);
+})();
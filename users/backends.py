@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+
+
+def user_cache_key(user_id):
+    return f"auth-user:{user_id}"
+
+
+class CachedModelBackend(ModelBackend):
+    """
+    ModelBackend, который хранит пользователя сессии в кэше USER_CACHE_TIMEOUT секунд, чтобы
+    AuthenticationMiddleware не читал users.User из базы на каждый запрос. Запись сбрасывается при сохранении
+    и удалении пользователя (users/signals.py), в том числе при смене пароля; USER_CACHE_TIMEOUT = 0 отключает кэш.
+    """
+
+    def get_user(self, user_id):
+        if not settings.USER_CACHE_TIMEOUT:
+            return super().get_user(user_id)
+        user = cache.get(user_cache_key(user_id))
+        if user is None:
+            user = super().get_user(user_id)
+            if user is not None:
+                cache.set(user_cache_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
+
+    async def aget_user(self, user_id):
+        if not settings.USER_CACHE_TIMEOUT:
+            return await super().aget_user(user_id)
+        user = await cache.aget(user_cache_key(user_id))
+        if user is None:
+            user = await super().aget_user(user_id)
+            if user is not None:
+                await cache.aset(user_cache_key(user_id), user, settings.USER_CACHE_TIMEOUT)
+        return user
@@ -0,0 +1,17 @@
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .backends import user_cache_key
+from .models import User
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    """Сбрасывает пользователя в кэше CachedModelBackend после изменения профиля, пароля или удаления."""
+    key = user_cache_key(instance.pk)
+    cache.delete(key)
+    # Запрос, прочитавший прежнюю строку до фиксации транзакции, мог снова положить её в кэш
+    transaction.on_commit(lambda: cache.delete(key), robust=True)